@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the sources filtering while walking a tree (DirectoryFiltering): compiled PathFilter vs
+the former per-name substring tests against each pattern, with the IAL filter files of
+ial_build/conf/gmkpack/sources_filters.
+
+A synthetic tree is generated for each filter file: the paths of the filter
+(wildcards instantiated) plus filler files in each directory.
+
+Run from the repository, e.g.: python benchmarks/bench_sources_filter.py
+(the package is imported from ../src if not installed).
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+import importlib.resources
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from ial_build.util import DirectoryFiltering
+
+
+def read_filter(filter_file):
+    with open(filter_file, 'r') as f:
+        return [l.strip() for l in f.readlines() if not l.strip().startswith('#') and l.strip() != '']
+
+
+def make_tree(root, patterns, fillers):
+    """Instantiate **patterns** in **root**, with **fillers** files in each directory."""
+    dirs = set([''])
+    for p in patterns:
+        path = re.sub(r'\[!?([^]])[^]]*\]', r'\1', p).replace('*', 'bench').replace('?', 'b')
+        parent = os.path.dirname(path)
+        while parent and parent not in dirs:
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        if '.' in os.path.basename(path):
+            open(os.path.join(root, path), 'w').close()
+        else:
+            os.makedirs(os.path.join(root, path), exist_ok=True)
+            dirs.add(path)
+    for d in dirs:
+        for i in range(fillers):
+            open(os.path.join(root, d, 'filler{:04}.F90'.format(i)), 'w').close()
+        os.makedirs(os.path.join(root, d, 'module'), exist_ok=True)
+        for i in range(fillers):
+            open(os.path.join(root, d, 'module', 'yom{:04}.F90'.format(i)), 'w').close()
+
+
+def legacy_ignore(root, patterns):
+    abspaths = [os.path.join(root, f) for f in patterns]
+
+    def ignore(src, names):
+        ignored_names = []
+        for f in names:
+            abs_f = os.path.join(src, f)
+            for path in abspaths:
+                if abs_f == path or os.path.join(path, '') in abs_f:
+                    ignored_names.append(f)
+                    break
+        return ignored_names
+    return ignore
+
+
+def walk_with(root, ignore):
+    """Walk **root**, not entering ignored directories; return the ignored paths."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        ignored = set(ignore(dirpath, dirnames + filenames))
+        found.extend([os.path.join(dirpath, f) for f in ignored])
+        dirnames[:] = [d for d in dirnames if d not in ignored]
+    return sorted(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', '--fillers', type=int, default=20,
+                        help="Number of filler files per directory (default: 20).")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="Number of timings of each method; the best is kept (default: 5).")
+    args = parser.parse_args()
+    filters_dir = importlib.resources.files('ial_build.conf.gmkpack.sources_filters')
+    filter_files = sorted([f for f in filters_dir.iterdir() if re.match(r'IAL-CY(48|49|50).*\.txt$', f.name)],
+                          key=lambda f: f.name)
+    print("{:28}  {:>8}  {:>6}  {:>10}  {:>10}  {:>7}".format(
+          'filter file', 'patterns', 'files', 'ignore', 'new ignore', 'speedup'))
+    for filter_file in filter_files:
+        patterns = [p for p in read_filter(filter_file) if not re.search(r'[*?\[]', p)]  # former: literal only
+        root = tempfile.mkdtemp(prefix='bench_sources_filter.')
+        try:
+            make_tree(root, patterns, args.fillers)
+            files = sum([len(f) for _, _, f in os.walk(root)])
+            old_ignore = legacy_ignore(root, patterns)
+            new_ignore = DirectoryFiltering(root, patterns)._filter_function
+            # same results
+            assert walk_with(root, old_ignore) == walk_with(root, new_ignore)
+            t_old = min(timeit.repeat(lambda: walk_with(root, old_ignore), number=1, repeat=args.repeat))
+            t_new = min(timeit.repeat(lambda: walk_with(root, new_ignore), number=1, repeat=args.repeat))
+            print("{:28}  {:>8}  {:>6}  {:>8.2f}ms  {:>8.2f}ms  {:>6.1f}x".format(
+                  filter_file.name, len(patterns), files, t_old * 1e3, t_new * 1e3, t_old / t_new))
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
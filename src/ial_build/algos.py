@@ -8,11 +8,12 @@ import os
 import copy
 import shutil
 import re
+import tempfile
 
-from .repositories import IALview, GitProxy
+from .repositories import IALview, GitProxy, WorktreePool
 from .pygmkpack import (Pack, PackError, GmkpackTool,
                         USUAL_BINARIES)
-from .bundle import IALBundle, TmpIALbundleRepo
+from .bundle import IALBundle, IALbundleMirror
 from .config import DEFAULT_BUNDLE_RELPATH
 
 
@@ -21,6 +22,7 @@ def IAL2pack(IAL_git_ref,
              bundle_relpath=DEFAULT_BUNDLE_RELPATH,
              bundle_cache_dir=None,
              bundle_update=True,
+             bundle_clone_mode=None,
              pack_type='incr',
              preexisting_pack=False,
              clean_if_preexisting=False,
@@ -28,7 +30,10 @@ def IAL2pack(IAL_git_ref,
              compiler_flag=None,
              homepack=None,
              rootpack=None,
-             check_coding_norms=False):
+             check_coding_norms=False,
+             checkout=True,
+             worktree=False,
+             copy_mode=None):
     """
     Make a pack out of an **IAL_git_ref** within an **IAL_repo_path** repository, post CY50T2 (bundle in IAL).
     If IAL_git_ref==None, take the currently checkedout ref.
@@ -37,6 +42,7 @@ def IAL2pack(IAL_git_ref,
     :param bundle_relpath: relative path to the bundle in the IAL repo.
     :param bundle_cache_dir: cache directory in which to download/update repositories for the hub
     :param bundle_update: if bundle repositories are to be updated/checkedout
+    :param bundle_clone_mode: how to clone bundle repositories not yet in cache, among IALBundle.clone_modes
     :param pack_type: type of pack, among ('incr', 'main')
     :param preexisting_pack: assume the pack already preexists
     :param clean_if_preexisting: if True, call cleanpack before populating a preexisting pack
@@ -45,11 +51,23 @@ def IAL2pack(IAL_git_ref,
     :param homepack: directory in which to build pack
     :param rootpack: diretory in which to look for root pack (incr packs only)
     :param check_coding_norms: run gmkpack's code norm checker (incr packs only)
+    :param checkout: if False (main packs only), the ref is not checked out in the IAL repository:
+        the pack is populated (as well as the bundle and filter files read) straight from the git objects
+    :param worktree: if True, the ref is checked out in a worktree leased from the pool of worktrees
+        of the IAL repository (cf. ial_build.repositories.WorktreePool), leaving its working copy untouched
+        and allowing concurrent populations from the same repository
+    :param copy_mode: how to copy files to populate the pack, among ial_build.util.ZeroCopier.modes
+        (defaults to config.POPULATE_COPY_MODE)
     """
-    view = IALview(IAL_repo_path, IAL_git_ref)
+    assert checkout or pack_type == 'main', "Populating a pack without checkout is available for main packs only."
+    assert checkout or not worktree, "Options **checkout**=False and **worktree** are exclusive."
+    view = IALview(IAL_repo_path, IAL_git_ref,
+                   need_for_checkout=checkout,
+                   worktree_pool=WorktreePool(IAL_repo_path) if worktree else None)
     s = "Exporting '{}' to pack...".format(view.ref)
     print(s)
     print("=" * len(s))
+    ref_context = view.context  # history walked once for the whole pack creation
     # pack
     if not preexisting_pack:
         args = GmkpackTool.getargs(pack_type,
@@ -58,7 +76,8 @@ def IAL2pack(IAL_git_ref,
                                    compiler_label=compiler_label,
                                    compiler_flag=compiler_flag,
                                    homepack=homepack,
-                                   rootpack=rootpack)
+                                   rootpack=rootpack,
+                                   ref_context=ref_context)
         try:
             pack = GmkpackTool.create_pack_from_args(args, pack_type)
         except Exception:
@@ -67,27 +86,48 @@ def IAL2pack(IAL_git_ref,
     else:
         packname = GmkpackTool.guess_pack_name(view.ref, compiler_label, compiler_flag,
                                                pack_type=pack_type,
-                                               IAL_repo_path=IAL_repo_path)
+                                               IAL_repo_path=IAL_repo_path,
+                                               ref_context=ref_context)
         pack = Pack(packname,
                     homepack=GmkpackTool.get_homepack(homepack))
         if clean_if_preexisting:
             pack.cleanpack()
+    if copy_mode is not None:
+        pack.copy_mode = copy_mode
     # bundle
-    bundle_abspath = os.path.join(IAL_repo_path, bundle_relpath)
-    hub_bundle = IALBundle(bundle_abspath)
+    if view.checkout_free:
+        # bundle and filter files extracted from the git objects, in a private directory
+        extracted_dir = tempfile.mkdtemp(prefix='ial_build.extracted.')
+        bundle_abspath = view.git_proxy.extract_files_from_to(view.commit, [bundle_relpath],
+                                                              extracted_dir)[bundle_relpath]
+        IAL_dir = view.repository  # not above the extracted bundle
+    else:
+        extracted_dir = None
+        bundle_abspath = os.path.join(view.repository, bundle_relpath)
+        IAL_dir = None
+    hub_bundle = IALBundle(bundle_abspath, IAL_ref_context=ref_context, IAL_dir=IAL_dir)
     if pack_type == 'main' or any([p.get('incremental_pack', False) for p in hub_bundle.projects.values()]):
         print(f"Populate pack hub using bundle: {bundle_abspath} ...")
         hub_bundle.download(src_dir=bundle_cache_dir,
-                            update=bundle_update)
+                            update=bundle_update,
+                            clone_mode=bundle_clone_mode)
         pack.populate_hub_from_bundle(hub_bundle)
+        hub_bundle.release_cache()
     # then populate
     if pack_type == 'main':
         filter_file = hub_bundle.projects[hub_bundle.IAL].get('gmkpack_filter_file', None)
         if filter_file is not None:
-            filter_file = os.path.join(IAL_repo_path, filter_file)
-        pack.populate_from_IALview_as_main(view, filter_file=filter_file)
+            if view.checkout_free:
+                filter_file = view.git_proxy.extract_files_from_to(view.commit, [filter_file],
+                                                                   extracted_dir)[filter_file]
+            else:
+                filter_file = os.path.join(view.repository, filter_file)
+        pack.populate_from_IALview_as_main(view, filter_file=filter_file, ref_context=ref_context)
     elif pack_type == 'incr':
-        pack.populate_from_IALview_as_incremental(view)
+        pack.populate_from_IALview_as_incremental(view, ref_context=ref_context, sync=preexisting_pack)
+    view.release_worktree()
+    if extracted_dir is not None:
+        shutil.rmtree(extracted_dir)
     print("Pack successfully populated: " + pack.abspath)
 
     # check coding norms
@@ -122,7 +162,7 @@ def IALgitref2pack(IAL_git_ref,
     If IAL_git_ref==None, take the currently checkedout ref.
     An IAL bundle may be necessary (determined and cloned on the fly) for main packs hub packages.
 
-    :param IAL_bundle_origin_repo: URL of IAL-bundle repository to clone, in which to look for bundle tag.
+    :param IAL_bundle_origin_repo: URL of IAL-bundle repository to mirror, in which to look for bundle tag.
                                    Can be local (e.g. ~user/IAL-bundle)
                                    or distant (e.g. https://github.com/ACCORD-NWP/IAL-bundle.git).
     :param IAL_bundle_tag_for_hub: tag of a bundle to be used for the hub (guessed if not provided).
@@ -142,6 +182,7 @@ def IALgitref2pack(IAL_git_ref,
     s = "Exporting '{}' to pack...".format(view.ref)
     print(s)
     print("=" * len(s))
+    ref_context = view.context  # history walked once for the whole pack creation
     # pack
     if not preexisting_pack:
         args = GmkpackTool.getargs(pack_type,
@@ -150,7 +191,8 @@ def IALgitref2pack(IAL_git_ref,
                                    compiler_label=compiler_label,
                                    compiler_flag=compiler_flag,
                                    homepack=homepack,
-                                   rootpack=rootpack)
+                                   rootpack=rootpack,
+                                   ref_context=ref_context)
         try:
             pack = GmkpackTool.create_pack_from_args(args, pack_type)
         except Exception:
@@ -159,7 +201,8 @@ def IALgitref2pack(IAL_git_ref,
     else:
         packname = GmkpackTool.guess_pack_name(view.ref, compiler_label, compiler_flag,
                                                pack_type=pack_type,
-                                               IAL_repo_path=IAL_repo_path)
+                                               IAL_repo_path=IAL_repo_path,
+                                               ref_context=ref_context)
         pack = Pack(packname,
                     homepack=GmkpackTool.get_homepack(homepack))
         if clean_if_preexisting:
@@ -168,7 +211,7 @@ def IALgitref2pack(IAL_git_ref,
     if pack_type == 'main':
         # hub
         print("Populate pack hub using bundle...")
-        IALbundles = TmpIALbundleRepo(IAL_bundle_origin_repo, verbose=True)
+        IALbundles = IALbundleMirror(IAL_bundle_origin_repo, cache_dir=bundle_cache_dir, verbose=True)
         if IAL_bundle_tag_for_hub is not None:
             hub_bundle = IALbundles.get_bundle(IAL_bundle_tag_for_hub, to_file='__tmp__')
         else:
@@ -178,10 +221,11 @@ def IALgitref2pack(IAL_git_ref,
         hub_bundle.download(src_dir=bundle_cache_dir,
                             update=bundle_update)
         pack.populate_hub_from_bundle(hub_bundle)
+        hub_bundle.release_cache()
         # src/local/
-        pack.populate_from_IALview_as_main(view)
+        pack.populate_from_IALview_as_main(view, ref_context=ref_context)
     elif pack_type == 'incr':
-        pack.populate_from_IALview_as_incremental(view)
+        pack.populate_from_IALview_as_incremental(view, ref_context=ref_context, sync=preexisting_pack)
     print("Pack successfully populated: " + pack.abspath)
 
     # check coding norms
@@ -243,6 +287,7 @@ def bundle_file2pack(bundle_file,
         if clean_if_preexisting:
             pack.cleanpack()
     pack.bundle_populate(b)
+    b.release_cache()
     print("Pack successfully populated: " + pack.abspath)
     return pack
 
@@ -254,13 +299,13 @@ def bundle_tag2pack(IAL_bundle_tag,
     Make a pack out of a bundle tag.
 
     :param IAL_bundle_tag: tag of a bundle in IAL-bundle repo
-    :param IAL_bundle_origin_repo: URL of IAL-bundle repository to clone, in which to look for bundle tag.
+    :param IAL_bundle_origin_repo: URL of IAL-bundle repository to mirror, in which to look for bundle tag.
                                    Can be local (e.g. ~user/IAL-bundle)
                                    or distant (e.g. https://github.com/ACCORD-NWP/IAL-bundle.git).
     --- other arguments:
     cf. bundle_file2pack "bundle download" and "pack" arguments
     """
-    IALbundles = TmpIALbundleRepo(IAL_bundle_origin_repo, verbose=True)
+    IALbundles = IALbundleMirror(IAL_bundle_origin_repo, cache_dir=kwargs.get('src_dir'), verbose=True)
     assert IALbundles.ref_exists(IAL_bundle_tag), "Unknown IAL-bundle tag: {}".format(IAL_bundle_tag)
     bundle_file = IALbundles.extract_file_from_to(IAL_bundle_tag, 'bundle.yml')
     return bundle_file2pack(bundle_file, **kwargs)
@@ -274,13 +319,13 @@ def IALgitref2pack_via_IALbundle(IAL_repo_path,
     Make a pack out of a bundle tag.
 
     :param IAL_bundle_tag: tag of a bundle in IAL-bundle repo
-    :param IAL_bundle_origin_repo: URL of IAL-bundle repository to clone, in which to look for bundle tag.
+    :param IAL_bundle_origin_repo: URL of IAL-bundle repository to mirror, in which to look for bundle tag.
                                    Can be local (e.g. ~user/IAL-bundle)
                                    or distant (e.g. https://github.com/ACCORD-NWP/IAL-bundle.git).
     --- other arguments:
     cf. bundle_file2pack "bundle download" and "pack" arguments
     """
-    IALbundles = TmpIALbundleRepo(IAL_bundle_origin_repo, verbose=True)
+    IALbundles = IALbundleMirror(IAL_bundle_origin_repo, cache_dir=kwargs.get('src_dir'), verbose=True)
     bundle = IALbundles.get_bundle_for_IAL_git_ref(IAL_repo_path,
                                                    IAL_git_ref=IAL_git_ref)
     return bundle_file2pack(bundle.bundle_file,
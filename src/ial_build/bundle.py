@@ -12,10 +12,20 @@ import re
 import shutil
 import sys
 import uuid
+import collections
+import itertools
+import threading
+import hashlib
+import fcntl
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
 
 from .pygmkpack import Pack, GmkpackTool
-from .config import DEFAULT_BUNDLE_CACHE_DIR, DEFAULT_IALBUNDLE_REPO, GITHUB_DEFAULT
-from .repositories import GitProxy, IALview
+from .config import (DEFAULT_BUNDLE_CACHE_DIR, DEFAULT_IALBUNDLE_REPO, GITHUB_DEFAULT, IALBUNDLE_MIRROR_TTL,
+                     BUNDLE_CLONE_MODE, BUNDLE_DOWNLOAD_THREADS, BUNDLE_DOWNLOADS_PER_HOST)
+from .repositories import GitProxy, GitError, IALview, RefContext
+from .cache import BundleCache, disk_usage, format_size
 
 # default value for a potential ${GITHUB} variable in bundle
 if 'GITHUB' not in os.environ:
@@ -24,6 +34,64 @@ if 'GITHUB' not in os.environ:
 
 class IALbundleRepo(GitProxy):
 
+    bundle_tag_re = re.compile(r'^BDL(?P<cycle>[^-]+)-.+$')
+    bundle_tags_index_version = 1
+
+    @property
+    def _bundle_tags_index_path(self):
+        return os.path.join(self.git_common_dir, 'ial_build', 'bundle_tags_index.json')
+
+    @property
+    def bundle_tags_index(self):
+        """
+        Index of bundle tags by cycle id: {'<id>': [BDL<id>-... tags]} (for a tag 'CY<id>').
+        Built once per state of refs, and persisted in the git directory of the repository.
+        """
+        signature = [list(s) for s in self._refs_signature()]
+        if getattr(self, '_bundle_tags_index', None) is not None and self._bundle_tags_index[0] == signature:
+            return self._bundle_tags_index[1]
+        index = None
+        path = self._bundle_tags_index_path
+        if os.path.exists(path):
+            try:
+                with io.open(path, 'r') as f:
+                    persisted = json.load(f)
+                if (persisted.get('version') == self.bundle_tags_index_version and
+                    persisted.get('refs_signature') == signature):
+                    index = persisted['index']
+            except (OSError, ValueError):
+                pass
+        if index is None:
+            index = {}
+            for tag in sorted(self.ref_index.tags.keys()):
+                m = self.bundle_tag_re.match(tag)
+                if m:
+                    index.setdefault(m.group('cycle'), []).append(tag)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.bundle_tags_index')
+                with io.open(fd, 'w') as f:
+                    json.dump({'version':self.bundle_tags_index_version,
+                               'refs_signature':signature,
+                               'index':index}, f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+        self._bundle_tags_index = (signature, index)
+        return index
+
+    def _find_bundle_tags_in_ancestors(self, official_tagged_ancestors, verbose=False):
+        """Walk **official_tagged_ancestors** from the latest, and return (ancestor, bundle tags) of first match."""
+        index = self.bundle_tags_index
+        for t in official_tagged_ancestors[::-1]:
+            # for a tag syntaxed 'CY<id>', bundle tag is 'BDL<id>'
+            matching = index.get(t[2:], [])
+            if len(matching) > 0:
+                return t, list(matching)
+            elif verbose:
+                print("No bundle found for tag: {}".format(t))
+        return None, []
+
     def find_bundle_tags_for_IAL_git_ref(self, IAL_repo_path,
                                          IAL_git_ref=None,
                                          verbose=False):
@@ -35,21 +103,30 @@ class IALbundleRepo(GitProxy):
         IAL = IALview(IAL_repo_path, IAL_git_ref, need_for_checkout=False)
         assert IAL.git_proxy.ref_exists(IAL.ref), "Unknown IAL git reference: {}".format(IAL.ref)
         print("Looking for registered bundles for ancestors of '{}'".format(IAL.ref))
-        matching = []
-        for t in IAL.official_tagged_ancestors[::-1]:
-            # for a tag syntaxed 'CY<id>', bundle tag is 'BDL<id>'
-            matching = [btag for btag in self.tags
-                        if re.match('BDL{}-.+'.format(t[2:]), btag)]
-            if len(matching) > 0:
-                break
-            else:
-                if verbose:
-                    print("No bundle found for tag: {}".format(t))
+        t, matching = self._find_bundle_tags_in_ancestors(IAL.official_tagged_ancestors, verbose=verbose)
         if matching == []:
             raise ValueError("No bundle has been found for reference '{}' or any of its ancestors.".format(IAL.ref))
         else:
             return {'official_tagged_ancestor':t, 'bundles':matching}
 
+    def find_bundle_tags_for_IAL_git_refs(self, IAL_repo_path,
+                                          IAL_git_refs,
+                                          verbose=False):
+        """
+        Bulk version of find_bundle_tags_for_IAL_git_ref, for a list of **IAL_git_refs**,
+        sharing the same IAL repository session and bundle tags index.
+
+        :return: {ref: {'official_tagged_ancestor':..., 'bundles':[...]}, or None if no bundle is found}
+        """
+        IAL = GitProxy(IAL_repo_path)
+        found = {}
+        for ref in IAL_git_refs:
+            assert IAL.ref_exists(ref), "Unknown IAL git reference: {}".format(ref)
+            t, matching = self._find_bundle_tags_in_ancestors(IALview.official_tagged_ancestors_of(IAL, ref),
+                                                              verbose=verbose)
+            found[ref] = {'official_tagged_ancestor':t, 'bundles':matching} if matching else None
+        return found
+
     def print_bundle_tags_for_IAL_git_ref(self, IAL_repo_path,
                                           IAL_git_ref=None,
                                           verbose=False):
@@ -146,12 +223,131 @@ class TmpIALbundleRepo(IALbundleRepo):
         shutil.rmtree(self.repository)
 
 
+class IALbundleMirror(IALbundleRepo):
+
+    def __init__(self, origin_repo=None, cache_dir=None, ttl=None, verbose=False):
+        """
+        IALbundleRepo as a persistent bare mirror of **origin_repo**, managed in **cache_dir**
+        (as IAL-bundle-<hash of origin>.git).
+        The mirror is cloned at first use, then only fetched (incrementally) if its last fetch
+        is older than **ttl** seconds: otherwise, no network access is done.
+        If the fetch fails (e.g. no connection), the mirror is used as is.
+
+        :param cache_dir: defaults to config.DEFAULT_BUNDLE_CACHE_DIR
+        :param ttl: defaults to config.IALBUNDLE_MIRROR_TTL (env var IAL_BUILD_IALBUNDLE_MIRROR_TTL);
+                    0 to fetch at each use
+        """
+        if origin_repo is None:
+            origin_repo = DEFAULT_IALBUNDLE_REPO
+        if cache_dir is None:
+            cache_dir = DEFAULT_BUNDLE_CACHE_DIR
+        if ttl is None:
+            ttl = IALBUNDLE_MIRROR_TTL
+        if os.path.exists(os.path.expanduser(origin_repo)):
+            origin_repo = os.path.abspath(os.path.expanduser(origin_repo))
+        self.origin_repo = origin_repo
+        self.ttl = ttl
+        self.verbose = verbose
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        os.makedirs(cache_dir, exist_ok=True)
+        mirror = os.path.join(cache_dir, 'IAL-bundle-{}.git'.format(
+            hashlib.sha1(origin_repo.encode('utf-8')).hexdigest()[:12]))
+        # lease the mirror in cache against eviction, as long as it is used
+        self.cache_lease = BundleCache(cache_dir, verbose=verbose).lease([os.path.basename(mirror)])
+        with io.open(mirror + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(mirror):
+                    self._clone(mirror)
+                    super(IALbundleMirror, self).__init__(mirror)
+                    self._stamp_fetch()
+                else:
+                    super(IALbundleMirror, self).__init__(mirror)
+                    if self.last_fetch_age is None or self.last_fetch_age >= self.ttl:
+                        self._update()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        if verbose:
+            print("-" * 80)
+
+    def _clone(self, mirror):
+        """Clone origin as a bare repository, atomically."""
+        print("Mirror '{}' in: {}".format(self.origin_repo, mirror))
+        std = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) if not self.verbose else {}
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(mirror), prefix='.' + os.path.basename(mirror))
+        try:
+            subprocess.check_call(['git', 'clone', '--bare', '--quiet', self.origin_repo, tmp], **std)
+            # branches and tags only (not e.g. pull requests refs, as --mirror would)
+            subprocess.check_call(['git', 'config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*'],
+                                  cwd=tmp)
+            os.rename(tmp, mirror)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    @property
+    def _fetch_stamp(self):
+        return os.path.join(self.git_common_dir, 'ial_build', 'last_fetch')
+
+    def _stamp_fetch(self):
+        os.makedirs(os.path.dirname(self._fetch_stamp), exist_ok=True)
+        with io.open(self._fetch_stamp, 'w') as f:
+            f.write(self.origin_repo + '\n')
+
+    @property
+    def last_fetch_age(self):
+        """Age in seconds of the last fetch (or clone) of the mirror, None if unknown."""
+        if not os.path.exists(self._fetch_stamp):
+            return None
+        return time.time() - os.path.getmtime(self._fetch_stamp)
+
+    def _update(self):
+        """Fetch (incrementally) origin into the mirror. Failures are only reported."""
+        std = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) if not self.verbose else {}
+        try:
+            # tags moved or deleted in origin as well (not with --tags, which neither forces nor prunes them)
+            subprocess.check_call(['git', 'fetch', '--prune', '--quiet', 'origin',
+                                   '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*'],
+                                  cwd=self.repository, **std)
+        except subprocess.CalledProcessError:
+            print("Warning: could not fetch '{}', using mirror as is: {}".format(self.origin_repo,
+                                                                               self.repository))
+        else:
+            self._stamp_fetch()
+        self._invalidate_refs()
+
+
+class ProjectSnapshot(collections.namedtuple('ProjectSnapshot', ['name', 'version', 'origin', 'repository',
+                                                                  'commit', 'tags_history'])):
+    """
+    Immutable state of a bundle project: version, origin, local repository,
+    commit of the version in the local repository and tags history
+    (None for non-git projects, not downloaded ones or shallow clones).
+    """
+    __slots__ = ()
+
+
+class BundleSnapshot(collections.namedtuple('BundleSnapshot', ['ID', 'IAL', 'projects'])):
+    """Immutable snapshot of the projects of a bundle: {project: ProjectSnapshot}."""
+    __slots__ = ()
+
+    @property
+    def tags_history(self):
+        """Tags' history for each git project's version."""
+        return {p:list(s.tags_history) for p, s in self.projects.items() if s.tags_history is not None}
+
+
 class IALBundle(object):
 
-    def __init__(self, bundle_file, ID=None, src_dir=None):
+    clone_modes = ('full', 'blobless', 'shallow')
+
+    def __init__(self, bundle_file, ID=None, src_dir=None, IAL_ref_context=None, IAL_dir=None):
         """
         :param bundle: bundle file (yaml)
         :param src_dir: directory where to find sources of the projects
+        :param IAL_ref_context: RefContext of the IAL project version, if already resolved
+        :param IAL_dir: IAL repository, to which $IAL_DIR is set for the bundle;
+                        if None, $IAL_DIR defaults to the directory above the one of the bundle file
         """
         from ecbundle.bundle import Bundle
         self.bundle_file = bundle_file
@@ -160,7 +356,9 @@ class IALBundle(object):
         else:
             self.ID = ID
         # if bundle is in IAL:bundle/ then IAL_DIR must be set, by default to the above directory
-        if 'IAL_DIR' not in os.environ:
+        if IAL_dir is not None:
+            os.environ['IAL_DIR'] = os.path.abspath(IAL_dir)
+        elif 'IAL_DIR' not in os.environ:
             os.environ['IAL_DIR'] = os.path.dirname(os.path.dirname(os.path.abspath(self.bundle_file)))
         self.ecbundle = Bundle(self.bundle_file)
         self.projects = {}
@@ -175,25 +373,43 @@ class IALBundle(object):
             raise KeyError("Bundle must contain IAL source repository as project 'IAL' or 'ial-source'.")
         self.downloaded = None  # none = unknown
         self.src_dir = src_dir
+        self.cache_lease = None
+        self._lockfile = None
+        self.download_timings = {}
+        self._IAL_ref_context = IAL_ref_context
+        # memoized queries to projects' repositories
+        self._queries_lock = threading.Lock()
+        self._git_proxies = {}
+        self._versions = {}  # {(project, HEAD commit): version}
+        self._tags_histories = {}  # {(project, commit): tags history}
+        self._deepenings = collections.Counter()  # {project: number of deepenings}
 
     def download(self,
                  src_dir=None,
                  update=True,
-                 threads=1,
+                 threads=None,
                  no_colour=True,
-                 dryrun=False):
+                 dryrun=False,
+                 clone_mode=None):
         """
         Download repositories and (optionnally) checkout according versions.
 
         :param src_dir: directory in which to download/update repositories of projects
         :param update: if repositories are to be updated/checkedout
-        :param threads: number of threads to do parallel downloads
+        :param threads: number of projects to be downloaded in parallel; if None, chosen after
+                        the number of projects and of cores (cf. download_threads()).
+                        Anyway, clones and downloads from a same host are capped to
+                        config.BUNDLE_DOWNLOADS_PER_HOST (env var IAL_BUILD_BUNDLE_DOWNLOADS_PER_HOST)
         :param no_colour: Disable color output
+        :param clone_mode: how to clone projects not yet in cache, among self.clone_modes
+                           (defaults to config.BUNDLE_CLONE_MODE, env var IAL_BUILD_BUNDLE_CLONE_MODE);
+                           can be overwritten per project by attribute 'clone_mode' in the bundle
+        :return: download time of each project, in seconds: {project: time}
+                 (0. for projects already in cache at their locked commit)
         """
         import logging
         from ecbundle.logging import logger
         logger.setLevel(logging.DEBUG)
-        from ecbundle import BundleDownloader
         # (re)define src_dir
         if src_dir is None and self.src_dir is None:
             self.src_dir = os.getcwd()
@@ -201,20 +417,301 @@ class IALBundle(object):
             if self.src_dir is not None:
                 print("IALBundle: src_dir overwritten by download to '{}'".format(src_dir))
             self.src_dir = src_dir
-        # downloads
-        b = BundleDownloader(bundle=self.bundle_file,
+        # lease projects in cache against eviction, as long as they are used
+        self.release_cache()
+        cache = BundleCache(self.src_dir)
+        self.cache_lease = cache.lease(self.projects.keys())
+        # projects already in cache at their locked commit need no download
+        to_download = list(self.projects.keys())
+        if update and not dryrun:
+            to_download = [p for p in to_download if not self._in_cache_as_locked(p)]
+            if len(to_download) == 0:
+                print("IALBundle: all projects already in cache at their locked commits, no download.")
+            elif len(to_download) < len(self.projects):
+                print("IALBundle: download only projects not in cache at their locked commits: {}".format(
+                      to_download))
+        timings = {p:0. for p in self.projects.keys() if p not in to_download}
+        if len(to_download) > 0:
+            if threads is None:
+                threads = self.download_threads(len(to_download))
+            # partial clones of projects not yet in cache
+            clone_timings = {}
+            if not dryrun:
+                clone_timings = self._partial_clones(cache, to_download, clone_mode, threads)
+            to_clone = [p for p in to_download
+                        if 'git' in self.projects[p] and not os.path.exists(self.local_project_repo(p))]
+            # downloads
+            download_timings = self._download(to_download,
+                                              threads=threads,
+                                              update=update,
+                                              no_colour=no_colour,
+                                              dryrun=dryrun)
+            for project in to_download:
+                timings[project] = download_timings[project] + clone_timings.get(project, 0.)
+            for project in to_clone:  # full clones by the downloader
+                if os.path.isdir(self.local_project_repo(project)):
+                    size = disk_usage(self.local_project_repo(project))
+                    cache.record(project, clone={'mode':'full', 'time':timings[project], 'size':size})
+                    print("IALBundle: cloned '{}' (full): {}".format(project, format_size(size)))
+            if update and not dryrun:
+                self._write_lockfile()
+            if not dryrun:
+                self.cache_lease.gc(to_download)  # git gc --auto: only if needed, after fetches
+        self.downloaded = True
+        self.download_timings = timings
+        cache.evict()  # within budget, if any
+        return timings
+
+    @staticmethod
+    def download_threads(projects_number):
+        """
+        Number of projects to be downloaded in parallel, after the number of projects and of cores
+        (downloads are mostly waiting for network: several per core), capped to config.BUNDLE_DOWNLOAD_THREADS.
+        """
+        return max(1, min(projects_number, max(4, 2 * (os.cpu_count() or 1)), BUNDLE_DOWNLOAD_THREADS))
+
+    @staticmethod
+    def origin_host(origin):
+        """Host of a git **origin** (URL, scp-like syntax or local path)."""
+        m = re.match(r'^(?P<scheme>[a-z][a-z0-9+.-]*)://(?P<netloc>[^/]*)', origin)
+        if m:
+            return m.group('netloc').split('@')[-1].split(':')[0] or 'localhost'
+        m = re.match(r'^(?:[^@/]+@)?(?P<host>[^:/]+):', origin)
+        if m:
+            return m.group('host')
+        return 'localhost'
+
+    def _per_host_map(self, func, projects, threads):
+        """
+        Apply **func** to **projects** over **threads** threads, with at most config.BUNDLE_DOWNLOADS_PER_HOST
+        concurrent calls for projects from a same origin host.
+
+        :return: {project: (elapsed time, result)}
+        """
+        by_host = collections.OrderedDict()
+        for project in projects:
+            by_host.setdefault(self.origin_host(self.project_origin(project)), []).append(project)
+        semaphores = {host:threading.BoundedSemaphore(BUNDLE_DOWNLOADS_PER_HOST) for host in by_host}
+        hosts = {p:host for host, ps in by_host.items() for p in ps}
+        # interleave hosts, so that threads do not all wait for the same host
+        ordered = [p for ps in itertools.zip_longest(*by_host.values()) for p in ps if p is not None]
+        def timed(project):
+            with semaphores[hosts[project]]:
+                start = time.time()
+                result = func(project)
+                return project, (time.time() - start, result)
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(ordered)))) as executor:
+            return dict(executor.map(timed, ordered))
+
+    def _download(self, projects, threads=1, **kwargs):
+        """
+        Download **projects** with ecbundle's downloader, one run per project (on a copy of the bundle
+        reduced to it), over **threads** threads and at most config.BUNDLE_DOWNLOADS_PER_HOST
+        concurrent runs per origin host (cf. _per_host_map()).
+
+        :return: {project: download time}
+        """
+        tmpdir = tempfile.mkdtemp(prefix='ial_build_bundle.')
+        start = time.time()
+        try:
+            def download(project):
+                directory = os.path.join(tmpdir, project)
+                os.makedirs(directory)
+                return self._download_project(self._reduced_bundle_file([project], directory), **kwargs)
+            results = self._per_host_map(download, projects, threads)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.src_dir = list(results.values())[0][1]
+        print("IALBundle: downloaded {} project(s) over {} thread(s) in {:.1f}s".format(
+              len(projects), max(1, min(threads, len(projects))), time.time() - start))
+        return {p:elapsed for p, (elapsed, _) in results.items()}
+
+    def _download_project(self, bundle_file, **kwargs):
+        """Run ecbundle's downloader on **bundle_file**; return its source directory."""
+        from ecbundle import BundleDownloader
+        b = BundleDownloader(bundle=bundle_file,
                              src_dir=self.src_dir,
-                             update=update,
-                             threads=threads,
-                             no_colour=no_colour,
-                             dryrun=dryrun,
-                             dry_run=dryrun,
+                             threads=1,
+                             dry_run=kwargs['dryrun'],
                              shallow=False,
-                             forced_update=update)
+                             forced_update=kwargs['update'],
+                             **kwargs)
         if b.download() != 0:
             raise RuntimeError("Downloading repositories failed.")
-        self.downloaded = True
-        self.src_dir = b.src_dir()
+        return b.src_dir()
+
+    # Clones -------------------------------------------------------------------
+
+    def project_clone_mode(self, project, clone_mode=None):
+        """Clone mode of **project**: from the bundle, else **clone_mode**, else config.BUNDLE_CLONE_MODE."""
+        mode = self.projects[project].get('clone_mode', clone_mode or BUNDLE_CLONE_MODE)
+        if mode not in self.clone_modes:
+            raise ValueError("Unknown clone mode '{}' for project '{}': must be among {}".format(
+                             mode, project, self.clone_modes))
+        return mode
+
+    def _partial_clones(self, cache, projects, clone_mode=None, threads=1):
+        """
+        Clone (as blobless or shallow) the git **projects** not yet in cache, which clone mode is not 'full',
+        so that the downloader only has to update them. Clone times and sizes are recorded in cache.
+
+        :return: {project: clone time}
+        """
+        to_clone = {}
+        for project in projects:
+            if 'git' not in self.projects[project] or os.path.exists(self.local_project_repo(project)):
+                continue
+            mode = self.project_clone_mode(project, clone_mode)
+            if mode != 'full' and not os.path.exists(self.project_origin(project)):  # pointless for local origins
+                to_clone[project] = mode
+        if len(to_clone) == 0:
+            return {}
+        results = self._per_host_map(lambda p: self._partial_clone(p, to_clone[p]), list(to_clone.keys()), threads)
+        for project, (elapsed, size) in results.items():
+            cache.record(project, clone={'mode':to_clone[project], 'time':elapsed, 'size':size})
+            print("IALBundle: cloned '{}' ({}) in {:.1f}s: {}".format(project, to_clone[project], elapsed,
+                                                                    format_size(size)))
+        return {p:elapsed for p, (elapsed, _) in results.items()}
+
+    def _partial_clone(self, project, mode):
+        """Clone **project** in **mode** and checkout its version; return the size of the clone."""
+        repository = self.local_project_repo(project)
+        origin = self.project_origin(project)
+        version = self.projects[project].get('version')
+        if mode == 'blobless':
+            # all commits and trees (for tags history), blobs fetched on demand at checkout
+            subprocess.check_call(['git', 'clone', '--quiet', '--filter=blob:none', '--no-checkout',
+                                   origin, repository])
+            # a --no-checkout clone has an empty index: --force to get a clean working tree
+            for ref in ([version, 'origin/' + version] if version else []) + ['HEAD']:
+                if subprocess.call(['git', 'checkout', '--quiet', '--force', '--detach', ref],
+                                   cwd=repository, stderr=subprocess.DEVNULL) == 0:
+                    break
+        elif mode == 'shallow':
+            # only the version's snapshot (and tags pointing to it): no tags history
+            if version and re.match('^[0-9a-f]{7,40}$', version):
+                # a commit is not among the branches tips of a depth-1 clone: fetch it explicitly
+                subprocess.check_call(['git', 'clone', '--quiet', '--depth', '1', '--no-checkout',
+                                       origin, repository])
+                if subprocess.call(['git', 'fetch', '--quiet', '--depth', '1', 'origin', version],
+                                   cwd=repository, stderr=subprocess.DEVNULL) != 0:
+                    # abbreviated SHA, or server refusing to serve unadvertised objects: full history
+                    subprocess.check_call(['git', 'fetch', '--quiet', '--unshallow', '--tags', 'origin'],
+                                          cwd=repository)
+                    subprocess.check_call(['git', 'checkout', '--quiet', '--force', '--detach', version],
+                                          cwd=repository)
+                else:
+                    subprocess.check_call(['git', 'checkout', '--quiet', '--force', '--detach', 'FETCH_HEAD'],
+                                          cwd=repository)
+            else:
+                branch = ['--branch', version] if version else []
+                subprocess.check_call(['git', 'clone', '--quiet', '--depth', '1', '--no-single-branch'] + branch +
+                                      [origin, repository])
+        return disk_usage(repository)
+
+    def deepen(self, project):
+        """Fetch the full history (and tags) of the shallow clone of **project** in cache."""
+        print("IALBundle: fetching the history of shallow clone '{}'".format(project))
+        subprocess.check_call(['git', 'fetch', '--quiet', '--unshallow', '--tags', 'origin'],
+                              cwd=self.local_project_repo(project))
+        with self._queries_lock:
+            self._git_proxies.pop(project, None)
+            for key in [k for k in self._tags_histories if k[0] == project]:
+                del self._tags_histories[key]
+            self._deepenings[project] += 1
+
+    # Lockfile -----------------------------------------------------------------
+
+    @property
+    def _lockfile_path(self):
+        """Lockfile of the bundle in the cache directory, named after bundle path and contents."""
+        h = hashlib.sha256(os.path.abspath(self.bundle_file).encode('utf-8') + b'\0')
+        with io.open(self.bundle_file, 'rb') as f:
+            h.update(f.read())
+        return os.path.join(self.src_dir, BundleCache.admin_dirname, 'locks', h.hexdigest()[:32] + '.json')
+
+    def _read_lockfile(self):
+        """Locked projects: {project: {'version':..., 'commit':..., 'immutable':...}}"""
+        if self._lockfile is None:
+            self._lockfile = {}
+            if os.path.exists(self._lockfile_path):
+                try:
+                    with io.open(self._lockfile_path, 'r') as f:
+                        self._lockfile = json.load(f)['projects']
+                except (OSError, ValueError, KeyError):
+                    pass
+        return self._lockfile
+
+    def _write_lockfile(self):
+        """Resolve the versions of git projects in cache to commits, and write them in the lockfile."""
+        locked = {}
+        for project, config in self.projects.items():
+            if 'git' not in config or not os.path.isdir(self.local_project_repo(project)):
+                continue
+            repo = self._git_proxy(project)
+            version = config.get('version')
+            commit = repo.commit_of('HEAD')
+            # a tag or a commit always points to the same commit, contrary to a branch
+            immutable = version is not None and (repo.ref_is_tag(version) or
+                                                 (re.match('^[0-9a-f]{7,40}$', version) is not None and
+                                                  commit.startswith(version)))
+            locked[project] = {'version':version, 'commit':commit, 'immutable':immutable}
+        path = self._lockfile_path
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.lock')
+            with io.open(fd, 'w') as f:
+                json.dump({'bundle':os.path.abspath(self.bundle_file), 'projects':locked}, f, indent=1)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+        self._lockfile = locked
+
+    def _in_cache_as_locked(self, project):
+        """
+        Whether **project** is in cache, checked out at the commit locked for its version.
+        Projects which version is a branch are never considered so, as they may have moved on remote.
+        """
+        config = self.projects[project]
+        repository = self.local_project_repo(project)
+        if 'git' not in config:  # link to a local directory
+            return (os.path.exists(repository) and
+                    os.path.realpath(repository) == os.path.realpath(self.project_origin(project)))
+        locked = self._read_lockfile().get(project)
+        if (locked is None or not locked['immutable'] or locked['version'] != config.get('version') or
+            not os.path.isdir(repository)):
+            return False
+        try:
+            return self._git_proxy(project).commit_of('HEAD') == locked['commit']
+        except (GitError, AssertionError):
+            return False
+
+    def _reduced_bundle_file(self, projects, directory):
+        """
+        Write a copy of the bundle file reduced to **projects** in **directory**; return its path.
+        Paths of 'dir' projects relative to the bundle file are made absolute, as the copy is elsewhere.
+        """
+        from ecbundle.parse import parse_yaml_file, to_yaml_str
+        bundle_dir = os.path.dirname(os.path.abspath(self.bundle_file))
+        bundle = parse_yaml_file(self.bundle_file)
+        bundle['projects'] = [p for p in bundle['projects'] if list(p.keys())[0] in projects]
+        for p in bundle['projects']:
+            config = list(p.values())[0]
+            if 'dir' in config:
+                d = os.path.expanduser(os.path.expandvars(config['dir']))
+                # else: relative to the src_dir for the downloader, as in the original
+                if not os.path.isabs(d) and os.path.exists(os.path.join(bundle_dir, d)):
+                    config['dir'] = os.path.join(bundle_dir, d)
+        path = os.path.join(directory, os.path.basename(self.bundle_file))
+        with io.open(path, 'w') as f:
+            f.write(to_yaml_str(bundle))
+        return path
+
+    def release_cache(self):
+        """Release the lease of projects in the cache directory (taken by download)."""
+        if self.cache_lease is not None:
+            self.cache_lease.release()
+            self.cache_lease = None
 
     def local_project_repo(self, project):
         """Path to locally downloaded repository of project."""
@@ -223,14 +720,84 @@ class IALBundle(object):
 
     def tags_history(self):
         """Get tags' history for each project's version."""
-        history = {}
-        cwd = os.getcwd()
-        for p in [p for p in self.projects.keys() if 'git' in self.projects[p]]:
-            repo = GitProxy(self.local_project_repo(p))
-            history[p] = []
-            for t in repo.tags_history(self.projects[p]['version']):
-                history[p].extend(t)
-        return history
+        return self.snapshot().tags_history
+
+    def _git_proxy(self, project):
+        """GitProxy (reused, with its persistent session) to the local repository of **project**."""
+        with self._queries_lock:
+            if project not in self._git_proxies:
+                self._git_proxies[project] = GitProxy(self.local_project_repo(project))
+            return self._git_proxies[project]
+
+    def _project_tags_history(self, project, commit):
+        """
+        Tags history of **project** at **commit**, memoized.
+        None if the project is a shallow clone: its history is truncated (cf. deepen()).
+        """
+        if project == self.IAL and commit == self.IAL_ref_context.commit:
+            return tuple(self.IAL_ref_context.tags_history)  # already resolved
+        key = (project, commit)
+        with self._queries_lock:
+            if key in self._tags_histories:
+                return self._tags_histories[key]
+            deepenings = self._deepenings[project]
+        # queried out of the lock, for projects to be queried concurrently
+        repo = self._git_proxy(project)
+        if repo.is_shallow:
+            history = None
+        else:
+            history = []
+            for t in repo.tags_history(commit):
+                history.extend(t)
+            history = tuple(history)
+        with self._queries_lock:
+            if self._deepenings[project] != deepenings:  # deepened meanwhile: history may be truncated
+                return history
+            return self._tags_histories.setdefault(key, history)
+
+    def deepened_tags_history(self, project, commit):
+        """Tags history of **project** at **commit**, deepening its clone first if shallow."""
+        if self._project_tags_history(project, commit) is None:
+            self.deepen(project)
+        return list(self._project_tags_history(project, commit))
+
+    def _project_snapshot(self, project):
+        """Query the local repository of **project** and return its ProjectSnapshot."""
+        repository = self.local_project_repo(project) if self.src_dir is not None else None
+        version = self.projects[project].get('version')
+        commit = None
+        tags_history = None
+        if repository is not None and os.path.isdir(repository):
+            version = self.project_version(project)
+            if 'git' in self.projects[project]:  # 'dir' projects may not be repositories on their own
+                repo = self._git_proxy(project)
+                commit = repo.latest_commit
+                if repo.commit_exists(version):
+                    commit = repo.commit_of(version)
+                tags_history = self._project_tags_history(project, commit)
+        return ProjectSnapshot(project,
+                               version,
+                               self.project_origin(project),
+                               repository,
+                               commit,
+                               tags_history)
+
+    def snapshot(self, threads=None):
+        """
+        Query all projects' repositories concurrently (over a bounded pool of **threads**),
+        and return an immutable BundleSnapshot.
+        Queries are memoized per (project, commit).
+        """
+        if threads is None:
+            threads = min(8, os.cpu_count() or 1)
+        projects = list(self.projects.keys())
+        if 'git' in self.projects[self.IAL] and self.src_dir is not None and os.path.isdir(self.IAL_repo_path):
+            self.IAL_ref_context  # resolved once, before concurrent queries
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(projects)))) as executor:
+            snapshots = list(executor.map(self._project_snapshot, projects))
+        return BundleSnapshot(self.ID,
+                              self.IAL,
+                              types.MappingProxyType({s.name:s for s in snapshots}))
 
     def dump(self, f):
         """Dump back the bundle in an open bundle file handler."""
@@ -240,8 +807,12 @@ class IALBundle(object):
     def project_version(self, project):
         if 'version' in self.projects[project]:
             return self.projects[project]['version']
+        elif 'git' in self.projects[project]:
+            commit = self._git_proxy(project).latest_commit
+            return self._versions.setdefault((project, commit), commit[:8])
         else:
-            # bundle is in IAL repo, project is a link to a local dir and ref is currently checkedout
+            # bundle is in IAL repo, project is a link to a local dir (possibly within a repository)
+            # and ref is currently checkedout
             return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
                                            cwd=self.local_project_repo(project)).strip().decode()[:8]
 
@@ -263,6 +834,15 @@ class IALBundle(object):
     def IAL_git_ref(self):
         return self.project_version(self.IAL)
 
+    @property
+    def IAL_ref_context(self):
+        """RefContext of the IAL project version (resolved once, once downloaded)."""
+        if self._IAL_ref_context is None:
+            if self._git_proxy(self.IAL).is_shallow:  # its official tagged ancestors are needed
+                self.deepen(self.IAL)
+            self._IAL_ref_context = RefContext.build(self.IAL_repo_path, self.IAL_git_ref)
+        return self._IAL_ref_context
+
 # gmkpack binding -------------------------------------------------------------
 
     def gmkpack_guess_pack_name(self,
@@ -284,7 +864,8 @@ class IALBundle(object):
         """
         packname = GmkpackTool.guess_pack_name(self.IAL_git_ref, compiler_label, compiler_flag,
                                                pack_type=pack_type,
-                                               IAL_repo_path=self.IAL_repo_path)
+                                               IAL_repo_path=self.IAL_repo_path,
+                                               ref_context=self._IAL_ref_context)
         # finalisation
         path_elements = [packname]
         if abspath:
@@ -317,7 +898,9 @@ class IALBundle(object):
                                    compiler_label=compiler_label,
                                    compiler_flag=compiler_flag,
                                    homepack=homepack,
-                                   rootpack=rootpack)
+                                   rootpack=rootpack,
+                                   # history is needed for incr packs only: resolve it only then
+                                   ref_context=self.IAL_ref_context if pack_type == 'incr' else self._IAL_ref_context)
         try:
             return GmkpackTool.create_pack_from_args(args, pack_type, silent=silent)
         except Exception:
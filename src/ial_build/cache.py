@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Météo France (2020)
+# This software is governed by the CeCILL-C license under French law.
+# http://www.cecill.info
+"""
+Management of the bundle cache directory: usage records, size budget with LRU eviction, git gc.
+"""
+import os
+import io
+import re
+import json
+import time
+import fcntl
+import shutil
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from .config import DEFAULT_BUNDLE_CACHE_DIR, BUNDLE_CACHE_BUDGET
+
+
+def parse_size(size):
+    """Parse a size in bytes, possibly with a unit suffix (K, M, G, T; powers of 1024), e.g. '20G'."""
+    if size is None or isinstance(size, int):
+        return size
+    m = re.match(r'^\s*(?P<n>\d+(\.\d*)?)\s*(?P<unit>[KMGT]?)i?B?\s*$', str(size), re.IGNORECASE)
+    if m is None:
+        raise ValueError("Unable to parse size: '{}'".format(size))
+    return int(float(m.group('n')) * 1024 ** ' KMGT'.index(m.group('unit').upper() or ' '))
+
+
+def format_size(size):
+    """Human-readable **size** in bytes."""
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, unit) if unit != 'B' else '{}B'.format(size)
+        size /= 1024.
+    return '{:.1f}T'.format(size)
+
+
+def disk_usage(path):
+    """Disk usage (in bytes) of the directory tree at **path** (symlinks not followed)."""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:  # vanished meanwhile
+                pass
+    return total
+
+
+class BundleCache(object):
+
+    admin_dirname = '.ial_build_cache'
+    history_length = 200
+
+    def __init__(self, cache_dir=None, budget=None, verbose=True):
+        """
+        Manager of a bundle cache directory, in which entries are the checkouts of projects
+        (and mirrors of repositories) found at the top of the directory.
+
+        Usage (last use, hits, misses) and size of entries are recorded in a registry,
+        in <cache_dir>/.ial_build_cache; entries used by a running build are leased
+        (shared lock on <cache_dir>/.ial_build_cache/<entry>.inuse) and never evicted.
+
+        :param cache_dir: defaults to config.DEFAULT_BUNDLE_CACHE_DIR
+        :param budget: size budget in bytes (or e.g. '20G') enforced by evict();
+                       defaults to config.BUNDLE_CACHE_BUDGET (env var IAL_BUILD_BUNDLE_CACHE_BUDGET)
+        """
+        if cache_dir is None:
+            cache_dir = DEFAULT_BUNDLE_CACHE_DIR
+        if budget is None:
+            budget = BUNDLE_CACHE_BUDGET
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.budget = parse_size(budget)
+        self.verbose = verbose
+        self.admin_dir = os.path.join(self.cache_dir, self.admin_dirname)
+        self._lock = threading.RLock()
+
+    # Registry -----------------------------------------------------------------
+
+    @property
+    def _registry_path(self):
+        return os.path.join(self.admin_dir, 'registry.json')
+
+    @contextmanager
+    def _registry(self):
+        """Context: the registry, locked (threads and processes) and saved atomically when leaving."""
+        with self._lock:
+            os.makedirs(self.admin_dir, exist_ok=True)
+            with io.open(os.path.join(self.admin_dir, 'registry.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    registry = self._load()
+                    yield registry
+                    self._save(registry)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        registry = {'entries':{}, 'evictions':[], 'hits':0, 'misses':0}
+        if os.path.exists(self._registry_path):
+            try:
+                with io.open(self._registry_path, 'r') as f:
+                    registry.update(json.load(f))
+            except (OSError, ValueError):
+                pass  # corrupted: restart from scratch
+        return registry
+
+    def _save(self, registry):
+        registry['evictions'] = registry['evictions'][-self.history_length:]
+        fd, tmp = tempfile.mkstemp(dir=self.admin_dir, prefix='.registry')
+        with io.open(fd, 'w') as f:
+            json.dump(registry, f, indent=1)
+        os.replace(tmp, self._registry_path)
+
+    @staticmethod
+    def _entry(registry, name):
+        return registry['entries'].setdefault(name, {'size':None, 'last_used':None, 'hits':0, 'misses':0})
+
+    @property
+    def entries(self):
+        """Names of the entries (projects checkouts, mirrors) of the cache directory."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted([e for e in os.listdir(self.cache_dir)
+                       if not e.startswith('.') and os.path.isdir(os.path.join(self.cache_dir, e))])
+
+    # Leases -------------------------------------------------------------------
+
+    def _inuse_path(self, name):
+        return os.path.join(self.admin_dir, name + '.inuse')
+
+    def lease(self, names):
+        """
+        Record the use of entries **names** (hit if present, miss otherwise) and lease them
+        (against eviction) until the returned CacheLease is released.
+        """
+        os.makedirs(self.admin_dir, exist_ok=True)
+        locks = []
+        for name in names:
+            lock = io.open(self._inuse_path(name), 'w')
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            locks.append(lock)
+        with self._registry() as registry:
+            for name in names:
+                entry = self._entry(registry, name)
+                outcome = 'hits' if os.path.isdir(os.path.join(self.cache_dir, name)) else 'misses'
+                entry[outcome] += 1
+                registry[outcome] += 1
+                entry['last_used'] = time.time()
+        return CacheLease(self, names, locks)
+
+    def record(self, name, **info):
+        """Record additional **info** about entry **name** (e.g. clone mode, time and size)."""
+        with self._registry() as registry:
+            self._entry(registry, name).update(info)
+
+    def in_use(self, name):
+        """Whether entry **name** is leased by a running build."""
+        if not os.path.exists(self._inuse_path(name)):  # never leased: no lock file to be created
+            return False
+        lock = self._try_lock_exclusive(name)
+        if lock is None:
+            return True
+        lock.close()
+        return False
+
+    def _try_lock_exclusive(self, name):
+        """Try to lock entry **name** exclusively: return the open lock file if successful, else None."""
+        os.makedirs(self.admin_dir, exist_ok=True)
+        lock = io.open(self._inuse_path(name), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    # Maintenance --------------------------------------------------------------
+
+    def refresh_sizes(self, names=None):
+        """Measure and record the size of entries **names** (default: all, then forgetting vanished ones)."""
+        forget_vanished = names is None
+        if names is None:
+            names = self.entries
+        sizes = {name:disk_usage(os.path.join(self.cache_dir, name)) for name in names
+                 if os.path.isdir(os.path.join(self.cache_dir, name))}
+        with self._registry() as registry:
+            for name, size in sizes.items():
+                self._entry(registry, name)['size'] = size
+            if forget_vanished:
+                for name in list(registry['entries'].keys()):
+                    if not os.path.isdir(os.path.join(self.cache_dir, name)) and not self.in_use(name):
+                        del registry['entries'][name]
+        return sizes
+
+    def evict(self, budget=None, dryrun=False):
+        """
+        Evict least recently used entries not in use, until the total size of the cache fits in **budget**
+        (defaults to self.budget; nothing is done if None).
+
+        :return: list of evicted entries
+        """
+        budget = self.budget if budget is None else parse_size(budget)
+        if budget is None:
+            return []
+        sizes = self.refresh_sizes()
+        total = sum(sizes.values())
+        evicted = []
+        with self._registry() as registry:
+            lru = sorted(sizes.keys(), key=lambda n: self._entry(registry, n)['last_used'] or 0)
+            for name in lru:
+                if total <= budget:
+                    break
+                lock = self._try_lock_exclusive(name)
+                if lock is None:  # in use by a running build
+                    if self.verbose:
+                        print("Cache: not evicting '{}' (in use)".format(name))
+                    continue
+                try:
+                    if self.verbose:
+                        print("Cache: evicting '{}' ({})".format(name, format_size(sizes[name])))
+                    if not dryrun:
+                        shutil.rmtree(os.path.join(self.cache_dir, name))
+                        del registry['entries'][name]
+                        registry['evictions'].append({'name':name, 'size':sizes[name], 'time':time.time(),
+                                                      'budget':budget})
+                finally:
+                    lock.close()
+                total -= sizes[name]
+                evicted.append(name)
+        return evicted
+
+    def gc(self, names=None, auto=True):
+        """
+        Run git maintenance on the git repositories among entries **names** (default: all)
+        that are not in use.
+
+        :param auto: `git gc --auto` (only if needed) rather than a full `git gc`
+        """
+        if names is None:
+            names = self.entries
+        done = []
+        for name in names:
+            if not self._is_git_repository(name):
+                continue
+            lock = self._try_lock_exclusive(name)
+            if lock is None:
+                continue
+            try:
+                if self._git_gc(name, auto):
+                    done.append(name)
+            finally:
+                lock.close()
+        self.refresh_sizes(done)
+        return done
+
+    def _is_git_repository(self, name):
+        """Whether entry **name** is a git repository of the cache (not a link to one elsewhere)."""
+        path = os.path.join(self.cache_dir, name)
+        return not os.path.islink(path) and (os.path.exists(os.path.join(path, '.git')) or
+                                             os.path.exists(os.path.join(path, 'objects')))
+
+    def _git_gc(self, name, auto=True):
+        """Run `git gc` in entry **name**; return whether it succeeded."""
+        if self.verbose:
+            print("Cache: git gc{} in '{}'".format(' --auto' if auto else '', name))
+        cmd = ['git', 'gc', '--quiet'] + (['--auto'] if auto else [])
+        return subprocess.call(cmd, cwd=os.path.join(self.cache_dir, name)) == 0
+
+    def report(self):
+        """Usage report of the cache: entries, sizes, hit rate and eviction history."""
+        with self._registry() as registry:
+            entries = {}
+            for name in self.entries:
+                entry = dict(self._entry(registry, name))
+                entry['in_use'] = self.in_use(name)
+                entries[name] = entry
+            evictions = list(registry['evictions'])
+            hits = registry['hits']
+            misses = registry['misses']
+        # clones accounting, per clone mode
+        clones = {}
+        for e in entries.values():
+            if 'clone' in e:
+                c = clones.setdefault(e['clone']['mode'], {'count':0, 'size':0, 'time':0., 'timed':0})
+                c['count'] += 1
+                c['size'] += e['clone']['size']
+                if e['clone']['time'] is not None:
+                    c['time'] += e['clone']['time']
+                    c['timed'] += 1
+        return {'cache_dir':self.cache_dir,
+                'budget':self.budget,
+                'size':sum([e['size'] or 0 for e in entries.values()]),
+                'hits':hits,
+                'misses':misses,
+                'hit_rate':hits / (hits + misses) if hits + misses > 0 else None,
+                'clones':clones,
+                'entries':entries,
+                'evictions':evictions}
+
+
+class CacheLease(object):
+
+    def __init__(self, cache, names, locks):
+        """Lease of entries of a BundleCache, against eviction. To be released (or used as a context)."""
+        self.cache = cache
+        self.names = list(names)
+        self._locks = locks
+
+    def release(self, refresh_sizes=True):
+        """Release the lease, recording the sizes of the entries."""
+        if self._locks is None:
+            return
+        if refresh_sizes:
+            self.cache.refresh_sizes([n for n in self.names
+                                      if os.path.isdir(os.path.join(self.cache.cache_dir, n))])
+        for lock in self._locks:
+            lock.close()
+        self._locks = None
+
+    def gc(self, names=None, auto=True):
+        """
+        Run git maintenance on the git repositories among leased entries **names** (default: all).
+        Unlike BundleCache.gc(), entries are not skipped for being in use: by the holder of the lease,
+        and git maintenance is safe for concurrent readers.
+
+        :param auto: `git gc --auto` (only if needed) rather than a full `git gc`
+        """
+        assert self._locks is not None, "Lease already released."
+        names = self.names if names is None else [n for n in names if n in self.names]
+        return [n for n in names if self.cache._is_git_repository(n) and self.cache._git_gc(n, auto)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __del__(self):
+        if self._locks is not None:
+            for lock in self._locks:
+                lock.close()
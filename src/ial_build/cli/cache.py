@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report on and maintain the bundle cache directory: sizes, hit rates, LRU eviction, git gc.
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from ial_build.cache import BundleCache, format_size
+from ial_build.config import (DEFAULT_BUNDLE_CACHE_DIR,
+                              BUNDLE_CACHE_BUDGET)
+
+
+def main():
+    args = get_args()
+    cache = BundleCache(args.cache_dir, budget=args.budget)
+    if args.gc:
+        cache.gc(auto=not args.full_gc)
+    if args.evict:
+        evicted = cache.evict(dryrun=args.dryrun)
+        if cache.budget is None:
+            print("No budget defined (cf. --budget or $IAL_BUILD_BUNDLE_CACHE_BUDGET): nothing to evict.")
+        elif args.dryrun:
+            print("Would evict: {}".format(', '.join(evicted) if evicted else '-'))
+    else:
+        cache.refresh_sizes()
+    report = cache.report()
+    if args.format == 'json':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report, history=args.history)
+
+def _date(timestamp):
+    if timestamp is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+def print_report(report, history=10):
+    print("Cache directory: {}".format(report['cache_dir']))
+    print("Size: {} / budget: {}".format(format_size(report['size']),
+                                         format_size(report['budget']) if report['budget'] is not None else '-'))
+    print("Hits: {}, misses: {}, hit rate: {}".format(
+        report['hits'], report['misses'],
+        '{:.0%}'.format(report['hit_rate']) if report['hit_rate'] is not None else '-'))
+    if report['clones']:
+        print("Clones (at first download, per mode):")
+        for mode, c in sorted(report['clones'].items()):
+            print(" - {:8}: {} project(s), {} on average{}".format(
+                mode, c['count'], format_size(c['size'] // c['count']),
+                ', in {:.1f}s on average'.format(c['time'] / c['timed']) if c['timed'] else ''))
+    if report['entries']:
+        width = max([len(name) for name in report['entries']])
+        print()
+        print("{:{}}  {:>8}  {:16}  {:>5}  {:>6}  {:8}".format('entry', width, 'size', 'last used', 'hits', 'misses',
+                                                              'clone'))
+        for name, e in sorted(report['entries'].items(), key=lambda x: x[1]['last_used'] or 0, reverse=True):
+            print("{:{}}  {:>8}  {:16}  {:>5}  {:>6}  {:8}{}".format(
+                name, width,
+                format_size(e['size']) if e['size'] is not None else '-',
+                _date(e['last_used']),
+                e['hits'], e['misses'],
+                e['clone']['mode'] if 'clone' in e else '-',
+                '  (in use)' if e['in_use'] else ''))
+    if history and report['evictions']:
+        print()
+        print("Last evictions:")
+        for e in report['evictions'][-history:]:
+            print(" - {}  {} ({})".format(_date(e['time']), e['name'], format_size(e['size'])))
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Report on and maintain the bundle cache directory: ' +
+                                                 'sizes, hit rates, LRU eviction, git gc.')
+    parser.add_argument('-d', '--cache_dir',
+                        help="Bundle cache directory. Default: " + DEFAULT_BUNDLE_CACHE_DIR,
+                        default=DEFAULT_BUNDLE_CACHE_DIR)
+    parser.add_argument('-b', '--budget',
+                        help="Size budget of the cache, e.g. '50G'. " +
+                             "Default: $IAL_BUILD_BUNDLE_CACHE_BUDGET ({})".format(BUNDLE_CACHE_BUDGET),
+                        default=None)
+    parser.add_argument('-e', '--evict',
+                        action='store_true',
+                        help="Evict least recently used entries (not in use), to fit in the budget.")
+    parser.add_argument('-n', '--dryrun',
+                        action='store_true',
+                        help="With --evict: only tell what would be evicted.")
+    parser.add_argument('--gc',
+                        action='store_true',
+                        help="Run `git gc --auto` in the git repositories of the cache (not in use).")
+    parser.add_argument('--full_gc',
+                        action='store_true',
+                        help="With --gc: run a full `git gc` rather than `git gc --auto`.")
+    parser.add_argument('--history',
+                        type=int,
+                        default=10,
+                        help="Number of last evictions to report (default: 10).")
+    parser.add_argument('--format',
+                        default='table',
+                        choices=['table', 'json'],
+                        help='Output format (default: table).')
+    return parser.parse_args()
+
@@ -4,34 +4,66 @@
 Find the most recent bundle tag(s) in IAL-bundle repository, available for an IAL git reference.
 """
 import argparse
+import io
+import sys
 
-from ial_build.bundle import TmpIALbundleRepo
+from ial_build.bundle import IALbundleMirror
 from ial_build.config import (DEFAULT_IAL_REPO,
+                              DEFAULT_BUNDLE_CACHE_DIR,
+                              IALBUNDLE_MIRROR_TTL,
                               DEFAULT_IALBUNDLE_REPO)
 
 
 def main():
     args = get_args()
-    IALbundles = TmpIALbundleRepo(args.IAL_bundle_origin_repo, verbose=args.verbose)
-    if args.get_copy:
+    refs = list(args.git_refs)
+    if args.refs_file:
+        if args.refs_file == '-':  # stdin is not ours to close
+            refs.extend([l.strip() for l in sys.stdin if l.strip() != ''])
+        else:
+            with io.open(args.refs_file, 'r') as f:
+                refs.extend([l.strip() for l in f if l.strip() != ''])
+    IALbundles = IALbundleMirror(args.IAL_bundle_origin_repo,
+                                 cache_dir=args.cache_dir,
+                                 ttl=args.mirror_ttl,
+                                 verbose=args.verbose)
+    if len(refs) > 1:
+        if args.get_copy:
+            raise SystemExit("--get_copy is only available for a single git ref.")
+        found = IALbundles.find_bundle_tags_for_IAL_git_refs(args.repository,
+                                                             refs,
+                                                             verbose=args.verbose)
+        width = max([len(ref) for ref in refs])
+        for ref, bundles in found.items():
+            if bundles is None:
+                print("{:{}}  -".format(ref, width))
+            else:
+                print("{:{}}  {}: {}".format(ref, width,
+                                             bundles['official_tagged_ancestor'],
+                                             ' '.join(bundles['bundles'])))
+    elif args.get_copy:
         IALbundles.get_bundle_for_IAL_git_ref(args.repository,
-                                              args.git_ref,
+                                              refs[0] if refs else None,
                                               to_file='__tag__',
                                               overwrite=args.overwrite)
     else:
         IALbundles.print_bundle_tags_for_IAL_git_ref(args.repository,
-                                                     args.git_ref,
+                                                     refs[0] if refs else None,
                                                      verbose=args.verbose)
 
 def get_args():
     parser = argparse.ArgumentParser(description='Find the most recent bundle tag(s) in IAL-bundle repository, ' +
                                                  'available for an IAL git reference.')
-    parser.add_argument('git_ref',
-                        help='Git ref: branch or tag. WARNING: if none is provided, the currently checked out ref is taken.',
-                        nargs='?',
-                        default=None)
+    parser.add_argument('git_refs',
+                        help='Git ref(s): branch or tag. If several are provided, the bundles found for each ' +
+                             'are printed as a table. ' +
+                             'WARNING: if none is provided, the currently checked out ref is taken.',
+                        nargs='*')
+    parser.add_argument('--refs_file',
+                        default=None,
+                        help="File containing git refs, one per line ('-' for stdin).")
     parser.add_argument('--get_copy',
-                        help="Get a local copy of the bundle file, if only one.",
+                        help="Get a local copy of the bundle file, if only one (single git ref only).",
                         action='store_true')
     parser.add_argument('-r', '--repository',
                         help='Location of the IAL Git repository (defaults to: {}).'.format(DEFAULT_IAL_REPO),
@@ -43,8 +75,17 @@ def get_args():
                         dest='overwrite',
                         action='store_true')
     parser.add_argument('-o', '--IAL_bundle_origin_repo',
-                        help="URL of the 'IAL-bundle' repository to clone. " +
+                        help="URL of the 'IAL-bundle' repository to mirror. " +
                              "Default: " + DEFAULT_IALBUNDLE_REPO,
                         default=DEFAULT_IALBUNDLE_REPO)
+    parser.add_argument('-d', '--cache_dir',
+                        help="Directory in which the mirror of 'IAL-bundle' is kept. " +
+                             "Default: " + DEFAULT_BUNDLE_CACHE_DIR,
+                        default=DEFAULT_BUNDLE_CACHE_DIR)
+    parser.add_argument('--mirror_ttl',
+                        help="Time (in seconds) after which the mirror of 'IAL-bundle' is fetched again " +
+                             "(0 to fetch at each use). Default: {}".format(IALBUNDLE_MIRROR_TTL),
+                        type=int,
+                        default=IALBUNDLE_MIRROR_TTL)
     return parser.parse_args()
 
@@ -5,27 +5,63 @@ Get the oldest "diverging" common ancestor between two git references,
 or in other words, the commit before the first diverging commit in refs respective histories.
 """
 import argparse
+import io
+import json
+import sys
 
 from ..repositories import GitProxy
 
 def main():
     args = get_args()
     r = GitProxy(args.repository)
-    commit = r.fork_point(args.refA, args.refB)
-    print("Ancestor (last commit between divergence) between {} and {} is:\n{}".format(args.refA, args.refB, commit))
+    if args.batch or args.refs_file:
+        refs = list(args.refs)
+        if args.refs_file:
+            if args.refs_file == '-':  # stdin is not ours to close
+                refs.extend([l.strip() for l in sys.stdin if l.strip() != ''])
+            else:
+                with io.open(args.refs_file, 'r') as f:
+                    refs.extend([l.strip() for l in f if l.strip() != ''])
+        fork_points = r.fork_points(refs, base=args.base)
+        if args.format == 'json':
+            json.dump(fork_points, sys.stdout, indent=2)
+            print()
+        else:
+            width = max([len(ref) for ref in refs] + [0])
+            for ref, commit in fork_points.items():
+                print("{:{}}  {}".format(ref, width, commit if commit is not None else '-'))
+    else:
+        if len(args.refs) not in (1, 2):
+            raise SystemExit("Expecting 1 or 2 references (refA [refB]), unless in --batch mode.")
+        refA = args.refs[0]
+        refB = args.refs[1] if len(args.refs) == 2 else 'HEAD'
+        commit = r.fork_point(refA, refB)
+        print("Ancestor (last commit between divergence) between {} and {} is:\n{}".format(refA, refB, commit))
 
 def get_args():
     parser = argparse.ArgumentParser(description=' '.join([
         'Get the oldest "diverging" common ancestor between two git references,',
         'or in other words, the commit before the first diverging commit in refs respective histories.']))
-    parser.add_argument('refA',
-                        help='First reference.')
-    parser.add_argument('refB',
-                        help='Second reference, defaults to HEAD.',
-                        nargs='?',
-                        default='HEAD')
+    parser.add_argument('refs',
+                        help='refA [refB]: first reference, and second reference (defaults to HEAD). ' +
+                             'In --batch mode: references which fork points with --base are to be computed.',
+                        nargs='*')
     parser.add_argument('-r', '--repository',
                         default='.',
                         help='Path to repository to explore. Default is current working dir.')
+    parser.add_argument('-b', '--batch',
+                        action='store_true',
+                        help='Batch mode: compute the fork points of all references against --base, ' +
+                             'in a single traversal of the history of --base.')
+    parser.add_argument('--base',
+                        default='HEAD',
+                        help='Batch mode: base reference against which to compute fork points. Defaults to HEAD.')
+    parser.add_argument('-f', '--refs_file',
+                        default=None,
+                        help="Batch mode: file containing references, one per line ('-' for stdin). " +
+                             "Implies --batch.")
+    parser.add_argument('--format',
+                        default='table',
+                        choices=['table', 'json'],
+                        help='Batch mode: output format (default: table).')
     return parser.parse_args()
-
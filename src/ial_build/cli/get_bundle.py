@@ -6,14 +6,19 @@ Get a copy of a bundle from IAL-bundle repository.
 import argparse
 import sys
 
-from ial_build.bundle import TmpIALbundleRepo
+from ial_build.bundle import IALbundleMirror
 from ial_build.config import (DEFAULT_IAL_REPO,
+                              DEFAULT_BUNDLE_CACHE_DIR,
+                              IALBUNDLE_MIRROR_TTL,
                               DEFAULT_IALBUNDLE_REPO)
 
 
 def main():
     args = get_args()
-    IALbundles = TmpIALbundleRepo(args.IAL_bundle_origin_repo, verbose=args.verbose)
+    IALbundles = IALbundleMirror(args.IAL_bundle_origin_repo,
+                                 cache_dir=args.cache_dir,
+                                 ttl=args.mirror_ttl,
+                                 verbose=args.verbose)
     IALbundles.get_bundle(args.bundle_tag,
                           to_file=args.output,
                           overwrite=args.overwrite)
@@ -39,7 +44,16 @@ def get_args():
                         dest='output',
                         const=sys.stdout)
     parser.add_argument('-o', '--IAL_bundle_origin_repo',
-                        help="URL of the 'IAL-bundle' repository to clone. " +
+                        help="URL of the 'IAL-bundle' repository to mirror. " +
                              "Default: " + DEFAULT_IALBUNDLE_REPO,
                         default=DEFAULT_IALBUNDLE_REPO)
+    parser.add_argument('-d', '--cache_dir',
+                        help="Directory in which the mirror of 'IAL-bundle' is kept. " +
+                             "Default: " + DEFAULT_BUNDLE_CACHE_DIR,
+                        default=DEFAULT_BUNDLE_CACHE_DIR)
+    parser.add_argument('--mirror_ttl',
+                        help="Time (in seconds) after which the mirror of 'IAL-bundle' is fetched again " +
+                             "(0 to fetch at each use). Default: {}".format(IALBUNDLE_MIRROR_TTL),
+                        type=int,
+                        default=IALBUNDLE_MIRROR_TTL)
     return parser.parse_args()
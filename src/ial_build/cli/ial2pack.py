@@ -10,7 +10,9 @@ from ial_build.pygmkpack import GmkpackTool
 from ial_build.config import (DEFAULT_IAL_REPO,
                               DEFAULT_BUNDLE_RELPATH,
                               DEFAULT_BUNDLE_CACHE_DIR,
-                              DEFAULT_PACK_COMPILER_FLAG)
+                              DEFAULT_PACK_COMPILER_FLAG,
+                              BUNDLE_CLONE_MODE,
+                              POPULATE_COPY_MODE)
 
 
 def main():
@@ -20,13 +22,17 @@ def main():
                     bundle_relpath=args.hub_bundle_relpath,
                     bundle_cache_dir=args.hub_bundle_cache_dir,
                     bundle_update=args.hub_bundle_update,
+                    bundle_clone_mode=args.hub_bundle_clone_mode,
                     pack_type=args.packtype,
                     preexisting_pack=args.preexisting_pack,
                     clean_if_preexisting=args.clean_if_preexisting,
                     compiler_label=args.compiler_label,
                     compiler_flag=args.compiler_flag,
                     homepack=args.homepack,
-                    rootpack=args.rootpack)
+                    rootpack=args.rootpack,
+                    checkout=not args.no_checkout,
+                    worktree=args.worktree,
+                    copy_mode=args.copy_mode)
     pack.ics_tune('', GMK_THREADS=int(args.threads_number))
     if args.programs != '':
         for p in GmkpackTool.parse_programs(args.programs):
@@ -89,5 +95,34 @@ def get_args():
                         help="Main packs only: not to update=download bundled hub packages from their remote, " +
                              "so that no 'git fetch' and 'git checkout' is required",
                         default=True)
+    parser.add_argument('--hub_bundle_clone_mode', '--hbcm',
+                        help="How to clone bundled hub packages not yet in cache: " +
+                             "'full', 'blobless' (history without file contents, fetched on demand) " +
+                             "or 'shallow' (latest snapshot only; history fetched if needed for the IAL context or a filter file). " +
+                             "Can be overwritten per package with attribute 'clone_mode' in the bundle. " +
+                             "Default: " + BUNDLE_CLONE_MODE,
+                        choices=['full', 'blobless', 'shallow'],
+                        default=None)
+    parser.add_argument('--no_checkout',
+                        action='store_true',
+                        help="Main packs only: do not checkout the git ref in the IAL repository, " +
+                             "but populate the pack straight from the git objects of the ref " +
+                             "(the working copy is left untouched).",
+                        default=False)
+    parser.add_argument('--worktree',
+                        action='store_true',
+                        help="Checkout the git ref in a worktree leased from a pool of worktrees managed next to " +
+                             "the IAL repository (<repository>.worktrees), rather than in the repository itself: " +
+                             "its working copy is left untouched, and several packs can be populated concurrently.",
+                        default=False)
+    parser.add_argument('--copy_mode',
+                        help="How to copy files into the pack: 'copy' (plain copies), " +
+                             "'reflink' (copy-on-write clones where the filesystem supports it, e.g. XFS, Btrfs), " +
+                             "'hardlink' (main packs and from the bundle cache only, else as reflink) " +
+                             "or 'auto' (hardlink, else reflink); " +
+                             "falling back to plain copies where not supported. " +
+                             "Default: " + POPULATE_COPY_MODE,
+                        choices=['copy', 'reflink', 'hardlink', 'auto'],
+                        default=None)
     return parser.parse_args()
 
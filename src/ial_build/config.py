@@ -23,6 +23,13 @@ IAL_BRANCHES_re = re.compile(r'_'.join([r'(?P<user>\w+)',
 IAL_DOC_OUTPUT_DIR = os.path.join(os.environ['HOME'], 'tmp','prep_doc')
 
 DEFAULT_BUNDLE_CACHE_DIR = os.path.join(os.environ['HOME'], 'ial-bundle_cache')
+# size budget of the bundle cache directory (e.g. '50G'), enforced by LRU eviction; no budget if unset
+BUNDLE_CACHE_BUDGET = os.environ.get('IAL_BUILD_BUNDLE_CACHE_BUDGET') or None
+# how to clone bundle projects not yet in cache: 'full', 'blobless' (--filter=blob:none) or 'shallow' (--depth 1)
+BUNDLE_CLONE_MODE = os.environ.get('IAL_BUILD_BUNDLE_CLONE_MODE', 'full')
+# parallel downloads of bundle projects: maximum number overall, and from a same host
+BUNDLE_DOWNLOAD_THREADS = int(os.environ.get('IAL_BUILD_BUNDLE_DOWNLOAD_THREADS', 8))
+BUNDLE_DOWNLOADS_PER_HOST = int(os.environ.get('IAL_BUILD_BUNDLE_DOWNLOADS_PER_HOST', 4))
 
 # default repository for IAL
 DEFAULT_IAL_REPO = os.environ.get('DEFAULT_IAL_REPO')
@@ -33,9 +40,17 @@ if DEFAULT_IAL_REPO in ('', None):
 DEFAULT_IALBUNDLE_REPO = os.environ.get('DEFAULT_IALBUNDLE_REPO')
 if DEFAULT_IALBUNDLE_REPO in ('', None):
     DEFAULT_IALBUNDLE_REPO = 'https://github.com/ACCORD-NWP/IAL-bundle.git'
+# time-to-live (in seconds) of the IAL-bundle mirror in the bundle cache, before it is fetched again
+IALBUNDLE_MIRROR_TTL = int(os.environ.get('IAL_BUILD_IALBUNDLE_MIRROR_TTL', 3600))
 # default gmkpack compiler flag
 DEFAULT_PACK_COMPILER_FLAG = os.environ.get('GMK_OPT', 'x')
 DEFAULT_BUNDLE_RELPATH = 'bundle/bundle.yml'
+# persistent git session (`git cat-file --batch` pipes) behind GitProxy queries
+GIT_PERSISTENT_SESSION = os.environ.get('IAL_BUILD_GIT_PERSISTENT_SESSION', '1') not in ('0', '')
+# concurrent copy processes to populate packs
+POPULATE_WORKERS = int(os.environ.get('IAL_BUILD_POPULATE_WORKERS', min(8, os.cpu_count() or 1)))
+# how to copy files to populate packs: 'copy', 'reflink', 'hardlink' or 'auto' (cf. util.ZeroCopier)
+POPULATE_COPY_MODE = os.environ.get('IAL_BUILD_POPULATE_COPY_MODE', 'copy')
 
 # hosts recognition
 hosts_re = {
@@ -171,13 +171,15 @@ class GmkpackTool(object):
 
     @staticmethod
     def mainpack_getargs_from_IAL_git_ref(IAL_git_ref,
-                                          IAL_repo_path=None):
+                                          IAL_repo_path=None,
+                                          ref_context=None):
         """
         Get necessary arguments for main pack from IAL_git_ref.
 
         :IAL_repo_path: required only if IAL_git_ref is not conventional
+        :ref_context: RefContext of IAL_git_ref, if already resolved
         """
-        from ial_build.repositories import IALview
+        from ial_build.repositories import RefContext
         is_a_tag = IAL_OFFICIAL_TAGS_re.match(IAL_git_ref)
         is_a_conventional_branch = IAL_BRANCHES_re.match(IAL_git_ref)
         if is_a_tag:
@@ -192,9 +194,10 @@ class GmkpackTool(object):
             gmk_prefix = is_a_conventional_branch.group('user') + '_CY'
         else:
             print("Warning: pack nomenclature will not be perfectly mapping git reference.")
-            assert IAL_repo_path is not None, "IAL repository path is required because git ref is not conventional."
-            ial = IALview(IAL_repo_path, IAL_git_ref)
-            ancestor = IAL_OFFICIAL_TAGS_re.match(ial.latest_official_tagged_ancestor).groupdict()
+            if ref_context is None:
+                assert IAL_repo_path is not None, "IAL repository path is required because git ref is not conventional."
+                ref_context = RefContext.build(IAL_repo_path, IAL_git_ref)
+            ancestor = ref_context.latest_official_ancestor_split
             gmk_release = ancestor['release']
             gmk_branch = IAL_git_ref
             gmk_version = '00'
@@ -217,16 +220,22 @@ class GmkpackTool(object):
 
     @staticmethod
     def incrpack_getargs_from_IAL_git_ref(IAL_git_ref,
-                                          IAL_repo_path):
-        """Get necessary arguments for incr pack from IAL_git_ref."""
-        from ial_build.repositories import IALview
-        ial = IALview(IAL_repo_path, IAL_git_ref)
+                                          IAL_repo_path,
+                                          ref_context=None):
+        """
+        Get necessary arguments for incr pack from IAL_git_ref.
+
+        :ref_context: RefContext of IAL_git_ref, if already resolved
+        """
+        from ial_build.repositories import RefContext
+        if ref_context is None:
+            ref_context = RefContext.build(IAL_repo_path, IAL_git_ref)
         # ancestor, for root pack
-        ancestor = IAL_OFFICIAL_TAGS_re.match(ial.latest_official_tagged_ancestor)
-        args = {'-r':ancestor.group('release')}
-        if ancestor.group('radical'):
-            args['-b'] = ancestor.group('radical')
-            args['-v'] = ancestor.group('version')
+        ancestor = ref_context.latest_official_ancestor_split
+        args = {'-r':ancestor['release']}
+        if ancestor['radical']:
+            args['-b'] = ancestor['radical']
+            args['-v'] = ancestor['version']
         return args
 
     @classmethod
@@ -243,14 +252,20 @@ class GmkpackTool(object):
                                         IAL_repo_path,
                                         rootpack=None,
                                         compiler_label=None,
-                                        compiler_flag=None):
-        """Get arguments linked to syntax of root pack."""
-        from ial_build.repositories import IALview
+                                        compiler_flag=None,
+                                        ref_context=None):
+        """
+        Get arguments linked to syntax of root pack.
+
+        :ref_context: RefContext of IAL_git_ref, if already resolved
+        """
+        from ial_build.repositories import RefContext
         rootpack = cls.get_rootpack(rootpack)
         args['-f'] = rootpack
         # ancestor, for root pack
-        ial = IALview(IAL_repo_path, IAL_git_ref)
-        ancestor = ial.latest_official_tagged_ancestor
+        if ref_context is None:
+            ref_context = RefContext.build(IAL_repo_path, IAL_git_ref)
+        ancestor = ref_context.latest_official_tagged_ancestor
         matching = cls.find_matching_rootpacks(rootpack, ancestor, compiler_label, compiler_flag)
         if len(matching) == 1:
             actual_rootpack = matching[list(matching.keys())[0]]
@@ -280,7 +295,8 @@ class GmkpackTool(object):
                 compiler_label=None,
                 compiler_flag=None,
                 homepack=None,
-                rootpack=None):
+                rootpack=None,
+                ref_context=None):
         """
         Build args to gmkpack command for creating a pack.
 
@@ -291,11 +307,16 @@ class GmkpackTool(object):
         :param compiler_flag: Gmkpack's compiler flag to be used
         :param homepack: directory in which to build pack
         :param rootpack: diretory in which to look for root pack
+        :param ref_context: RefContext of IAL_git_ref, if already resolved
+            (otherwise resolved here once if needed)
         """
+        from ial_build.repositories import RefContext
         if pack_type == 'main':
-            args = cls.mainpack_getargs_from_IAL_git_ref(IAL_git_ref, IAL_repo_path)
+            args = cls.mainpack_getargs_from_IAL_git_ref(IAL_git_ref, IAL_repo_path, ref_context=ref_context)
         elif pack_type == 'incr':
-            args = cls.incrpack_getargs_from_IAL_git_ref(IAL_git_ref, IAL_repo_path)
+            if ref_context is None:
+                ref_context = RefContext.build(IAL_repo_path, IAL_git_ref)
+            args = cls.incrpack_getargs_from_IAL_git_ref(IAL_git_ref, IAL_repo_path, ref_context=ref_context)
             args.update(cls.incrpack_getargs_packname(IAL_git_ref,
                                                       compiler_label=compiler_label,
                                                       compiler_flag=compiler_flag))
@@ -304,7 +325,8 @@ class GmkpackTool(object):
                                                             IAL_repo_path,
                                                             rootpack=rootpack,
                                                             compiler_label=compiler_label,
-                                                            compiler_flag=compiler_flag))
+                                                            compiler_flag=compiler_flag,
+                                                            ref_context=ref_context))
         args.update(cls.pack_getargs_others(compiler_label=compiler_label,
                                             compiler_flag=compiler_flag,
                                             homepack=homepack))
@@ -327,7 +349,8 @@ class GmkpackTool(object):
                         IAL_repo_path=None,
                         abspath=False,
                         homepack=None,
-                        to_bin=False):
+                        to_bin=False,
+                        ref_context=None):
         """
         Guess pack name given IAL git ref and compiler options.
 
@@ -336,13 +359,15 @@ class GmkpackTool(object):
         :param abspath: join homepack and packname
         :param homepack: home of packs
         :param to_bin: add /bin to path, in case abspath=True
+        :param ref_context: RefContext of IAL_git_ref, if already resolved
         """
         if pack_type == 'main':
             args = cls.getargs(pack_type,
                                IAL_git_ref,
                                IAL_repo_path=IAL_repo_path,
                                compiler_label=compiler_label,
-                               compiler_flag=compiler_flag)
+                               compiler_flag=compiler_flag,
+                               ref_context=ref_context)
         elif pack_type == 'incr':
             args = cls.incrpack_getargs_packname(IAL_git_ref,
                                                  compiler_label,
@@ -12,10 +12,14 @@ import tarfile
 import io
 import shutil
 import glob
+import tempfile
+import threading
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from ial_build.util import copy_files_in_cwd, now
+from ial_build.util import copy_files, now, ParallelRsync, ZeroCopier, PathFilter, captured_output
 from ial_build.repositories import git_clone
+from ial_build.config import POPULATE_WORKERS, POPULATE_COPY_MODE
 from . import PackError, COMPONENTS_MAP, COMPONENTS_RENAME
 from . import GmkpackTool
 from . import unsatisfied_references
@@ -29,11 +33,17 @@ class Pack(object):
     _filter_file_in_repo_re     = '__in_repo:(?P<file>.*)__'
     _filter_file_in_repo_format = '__in_repo:{}__'
 
-    def __init__(self, packname, preexisting=True, homepack=None):
+    def __init__(self, packname, preexisting=True, homepack=None, copy_mode=None):
         """
         Create Pack object from the **packname**.
+
+        :param copy_mode: how to copy files when populating the pack, among ial_build.util.ZeroCopier.modes;
+            defaults to config.POPULATE_COPY_MODE. Hardlinks are used in main packs only,
+            as files of incremental packs are meant to be edited, and from the bundle cache only,
+            as files of a working copy are.
         """
         self.packname = packname
+        self.copy_mode = POPULATE_COPY_MODE if copy_mode is None else copy_mode
         if homepack in (None, ''):
             homepack = GmkpackTool.get_homepack()
         self.homepack = homepack
@@ -41,12 +51,26 @@ class Pack(object):
         self._local = os.path.join(self.abspath, 'src', 'local')
         self._hub_local_src = os.path.join(self.abspath, 'hub', 'local', 'src')
         self._hub_gmkview_file = os.path.join(self.abspath, 'hub', '.gmkview')
+        self._hub_gmkview_lock = threading.Lock()
+        self._ignored_sources_lock = threading.Lock()
         self._bin = os.path.join(self.abspath, 'bin')
         if not preexisting and os.path.exists(self.abspath):
             raise PackError("Pack already exists, while *preexisting* is False ({}).".format(self.abspath))
         if preexisting and not os.path.exists(self.abspath):
             raise PackError("Pack is supposed to preexist, while it doesn't ({}).".format(self.abspath))
 
+    def copier(self, immutable_source=False):
+        """
+        A ZeroCopier according to self.copy_mode, or None for plain copies.
+
+        :param immutable_source: whether the files to be copied are never edited in place
+            (e.g. bundle cache, as opposed to a working copy), so that they can be hardlinked
+            (in a main pack)
+        """
+        if self.copy_mode == 'copy':
+            return None
+        return ZeroCopier(self.copy_mode, hardlinks=immutable_source and not self.is_incremental)
+
     @property
     def is_incremental(self):
         """Is the pack incremental ? (vs. main)"""
@@ -296,48 +320,69 @@ class Pack(object):
         with tarfile.open(tar, 'r') as t:
             t.extractall(path=self._local)
 
-    def populate_from_list_of_files_in_dir(self, list_of_files, directory, subdir=None):
+    def populate_from_list_of_files_in_dir(self, list_of_files, directory, subdir=None, sync=False, blobs=None):
         """
         Populate the incremental pack with the **list_of_files** from a given **directory**.
 
         :param subdir: if given, populate in src/local/subdir/
+        :param sync: only copy the files which contents differ from the ones already in the pack,
+            leaving the others untouched (and hence not to be recompiled)
+        :param blobs: with **sync**, {path: SHA of the git blob of the file contents}, if known
         """
         directory_abspath = os.path.abspath(directory)
-        with self._cd_local(subdir=subdir):
-            copy_files_in_cwd(list_of_files, directory_abspath)
-
-    def populate_from_IALview_as_main(self, view, filter_file=None):
+        copier = self.copier()
+        # no chdir: components may be populated concurrently
+        destination = self._local if subdir is None else os.path.join(self._local, subdir)
+        counts = copy_files(list_of_files, directory_abspath, destination, copier=copier, sync=sync, blobs=blobs)
+        if sync:
+            print("  {} files copied, {} unchanged files skipped.".format(counts['copied'], counts['skipped']))
+        if copier is not None:
+            print("  " + copier.report())
+
+    def populate_from_IALview_as_main(self, view, filter_file=None, ref_context=None):
         """
         Populate main pack with contents from a IALview.
+
+        :param ref_context: RefContext of the view, if already resolved
         """
         from ial_build.repositories import IALview
         assert isinstance(view, IALview)
+        if ref_context is None:
+            ref_context = view.context
         if filter_file is None:
-            filter_file = self._configfile_for_sources_filtering('IAL', view.tags_history)
+            filter_file = self._configfile_for_sources_filtering('IAL', list(ref_context.tags_history))
         msg = "Populating main pack with: '{}'".format(view.ref)
         print('\n' + msg + '\n' + '=' * len(msg))
-        self._populate_from_repo_in_bulk(view.repository, filter_file=filter_file)
+        if view.checkout_free:
+            self._populate_from_git_ref_in_bulk(view.repository, view.commit, filter_file=filter_file)
+        else:
+            self._populate_from_repo_in_bulk(view.repository, filter_file=filter_file)
         # symbols to be ignored
-        self.ignore_symbols_from_cycles(view.tags_history)
+        self.ignore_symbols_from_cycles(list(ref_context.tags_history))
         self.write_view_info(view)
 
-    def populate_from_IALview_as_incremental(self, view, start_ref=None):
+    def populate_from_IALview_as_incremental(self, view, start_ref=None, ref_context=None, sync=False):
         """
         Populate as incremental pack with contents from a IALview.
 
         :param view: a IALview instance
         :param start_ref: increment of modification starts from this ref.
             If None, starts from latest official tagged ancestor.
+        :param ref_context: RefContext of the view, if already resolved
+        :param sync: (re)populating a preexisting pack, only copy the files which contents changed
         """
         from ial_build.repositories import IALview, GitError
         assert isinstance(view, IALview)
         if start_ref is None:
-            assert self.tag_of_latest_official_ancestor == view.latest_official_tagged_ancestor, \
+            if ref_context is None:
+                ref_context = view.context
+            ancestor = ref_context.latest_official_tagged_ancestor
+            assert self.tag_of_latest_official_ancestor == ancestor, \
                 "Latest official ancestor differ in pack ({}) and repository ({})".format(
-                    self.tag_of_latest_official_ancestor, view.latest_official_tagged_ancestor)
-            touched_files = view.touched_files_since_latest_official_tagged_ancestor
+                    self.tag_of_latest_official_ancestor, ancestor)
+            touched_files = view.touched_files_since(ancestor)
             print("Populating with modifications between '{}' and '{}'".
-                format(view.latest_official_tagged_ancestor,
+                format(ancestor,
                        view.ref))
         else:
             touched_files = view.touched_files_since(start_ref)
@@ -346,36 +391,30 @@ class Pack(object):
                        view.ref))
         if len(view.git_proxy.touched_since_last_commit) > 0:
             print("! Note:  non-committed files in the view are exported to the pack.")
-        # files to be copied
-        files_to_copy = []
-        for k in ('A', 'M', 'T'):
-            files_to_copy.extend(list(touched_files.get(k, [])))
-        for k in ('R', 'C'):
-            files_to_copy.extend([f[1] for f in touched_files.get(k, [])])  # new name of renamed or copied files
-        self.populate_from_list_of_files_in_dir(files_to_copy, view.repository)
-        # files to be ignored/deleted
-        files_to_delete = list(touched_files.get('D', []))
-        files_to_delete.extend([f[0] for f in touched_files.get('R', [])])  # original name of renamed files
-        self.write_ignored_sources(files_to_delete)
         # files of unknown status
-        for k in ('U', 'X', 'B'):
-            if k in touched_files:
-                raise GitError("Don't know what to do with files which Git status is: " + k)
+        for k in touched_files.unknown:
+            raise GitError("Don't know what to do with files which Git status is: " + k)
+        # files to be copied (incl. new name of renamed or copied files)
+        self.populate_from_list_of_files_in_dir(touched_files.to_copy, view.repository,
+                                                sync=sync,
+                                                blobs=touched_files.blobs if sync else None)
+        # files to be ignored/deleted (incl. original name of renamed files)
+        self.write_ignored_sources(touched_files.to_delete)
         self.write_view_info(view)
 
-    def populate_hub_from_bundle(self, bundle):
+    def populate_hub_from_bundle(self, bundle, workers=None):
         """
         Populate hub from bundle.
 
         :param bundle: the ial_build.bundle.IALBundle object.
+        :param workers: number of hub packages populated concurrently
+                        (defaults to config.POPULATE_WORKERS)
         """
         hub_components = {component:config for component, config in bundle.projects.items()
                           if self.bundle_component_destination(component, config).startswith('hub')}
         msg = "Populating components in pack's hub:"
         print("\n" + msg + "\n" + "=" * len(msg))
-        for component, config in hub_components.items():
-            self.bundle_populate_hub_component(component,
-                                               bundle)
+        self.bundle_populate_hub_components(list(hub_components.keys()), bundle, workers=workers)
         # log
         openmode = 'a' if os.path.exists(self.origin_filepath) else 'w'
         with io.open(self.origin_filepath, openmode) as f:
@@ -394,12 +433,14 @@ class Pack(object):
     def _populate_from_repo_in_bulk(self,
                                     repository,
                                     subdir=None,
-                                    filter_file=None):
+                                    filter_file=None,
+                                    workers=None):
         """
         Populate a main pack src/local/ with the contents of a repo.
 
         :param subdir: if given, populate in src/local/{subdir}/
         :param filter_file: file in which to find list of files/dir to be filtered out
+        :param workers: number of concurrent rsync processes (cf. ial_build.util.ParallelRsync)
         """
         # read filter a first time to list sub-projects to be ignored
         filter_list = self.read_sources_filter_list(filter_file)
@@ -410,6 +451,7 @@ class Pack(object):
             if not os.path.exists(dst):
                 os.makedirs(dst)
         print("\n  Subprojects:")
+        to_copy = []
         for f in sorted(os.listdir(repository)):
             if f == '.git':
                 continue
@@ -420,10 +462,46 @@ class Pack(object):
                     continue
                 else:
                     print('  {}'.format(f))
-            subprocess.check_call(['rsync', '-avq', f_src, dst])
-        # filter a posteriori
-        to_be_filtered = self.prepare_sources_filter(filter_file, subdir=subdir)
-        self.filter_sources_a_posteriori(to_be_filtered)
+            to_copy.append(f)
+        # filtered sources are not copied
+        exclude = self.sources_filter_exclusions(filter_list, repository, subdir=subdir)
+        # subprojects spread across concurrent rsync processes
+        copier = self.copier()
+        rsync = ParallelRsync(workers=workers, copier=copier)
+        print("\n  Copying with {} {} workers...".format(rsync.workers,
+                                                        'rsync' if copier is None else self.copy_mode))
+        totals = rsync.copy(repository, to_copy, dst, exclude=exclude)
+        print("  {} files ({} bytes) copied".format(totals['files'], totals['bytes']))
+        if copier is not None:
+            print("  " + copier.report())
+        # filter a posteriori what could not be excluded
+        self.reconcile_sources_filter(filter_file, exclude, subdir=subdir)
+
+    def _populate_from_git_ref_in_bulk(self,
+                                       repository,
+                                       git_ref,
+                                       subdir=None,
+                                       filter_file=None):
+        """
+        Populate a main pack src/local/ with the contents of **git_ref** in a repo,
+        read from the git objects: the ref is not checked out and the working copy is left untouched.
+        Files/dirs to be filtered are skipped while exporting.
+
+        :param subdir: if given, populate in src/local/{subdir}/
+        :param filter_file: file in which to find list of files/dir to be filtered out
+        """
+        from ial_build.repositories import GitProxy
+        filter_list = self.read_sources_filter_list(filter_file)
+        if subdir is None:
+            dst = self._local
+        else:
+            dst = os.path.join(self._local, subdir)
+        is_filtered = self.sources_filter_matcher(filter_list, subdir=subdir)
+        print("\n  Exporting tree of '{}' (no checkout)...".format(git_ref))
+        stats = GitProxy(repository).export_tree(git_ref, dst, exclude=is_filtered)
+        print("  {} files ({} bytes) written, {} filtered out".format(stats['files'],
+                                                                      stats['bytes'],
+                                                                      stats['excluded']))
 
     def _populate_from_repo_as_incremental_component(self,
                                                      repository,
@@ -435,24 +513,16 @@ class Pack(object):
 
         :param subdir: if given, populate in src/local/subdir/ (otherwise src/local/)
         """
-        from ial_build.repositories import GitProxy
+        from ial_build.repositories import GitProxy, GitError
         repo = GitProxy(repository)
         touched_files = repo.touched_files_since(initial_version)
-        # files to be copied
-        files_to_copy = []
-        for k in ('A', 'M', 'T'):
-            files_to_copy.extend(list(touched_files.get(k, [])))
-        for k in ('R', 'C'):
-            files_to_copy.extend([f[1] for f in touched_files.get(k, [])])  # new name of renamed or copied files
-        self.populate_from_list_of_files_in_dir(files_to_copy, repository, subdir=subdir)
-        # files to be ignored/deleted
-        files_to_delete = list(touched_files.get('D', []))
-        files_to_delete.extend([f[0] for f in touched_files.get('R', [])])  # original name of renamed files
-        self.write_ignored_sources(files_to_delete)
         # files of unknown status
-        for k in ('U', 'X', 'B'):
-            if k in touched_files:
-                raise GitError("Don't know what to do with files which Git status is: " + k)
+        for k in touched_files.unknown:
+            raise GitError("Don't know what to do with files which Git status is: " + k)
+        # files to be copied (incl. new name of renamed or copied files)
+        self.populate_from_list_of_files_in_dir(touched_files.to_copy, repository, subdir=subdir)
+        # files to be ignored/deleted (incl. original name of renamed files)
+        self.write_ignored_sources(touched_files.to_delete)
 
 # Populate from bundle --------------------------------------------------------
 
@@ -468,11 +538,52 @@ class Pack(object):
             version = None  # this will turn component to be populated in bulk rather than as increment
         return version
 
+    def bundle_populate_hub_components(self, components, bundle, snapshot=None, workers=None):
+        """
+        Populate hub with **components** from bundle, concurrently.
+        The output of each component is printed as a block, once it is populated.
+
+        :param bundle: the ial_build.bundle.IALBundle object.
+        :param snapshot: BundleSnapshot of the bundle, if already queried
+        :param workers: number of components populated concurrently
+                        (defaults to config.POPULATE_WORKERS)
+        """
+        self._concurrently(lambda component: self.bundle_populate_hub_component(component,
+                                                                                bundle,
+                                                                                snapshot=snapshot),
+                           components,
+                           workers=workers)
+
+    @staticmethod
+    def _concurrently(func, components, workers=None):
+        """
+        Call **func** on each of **components**, concurrently (up to **workers**, defaults to
+        config.POPULATE_WORKERS). The output of each call is printed as a block, in the order of **components**.
+        """
+        def call(component):
+            with captured_output() as log:
+                try:
+                    func(component)
+                except Exception as e:
+                    return log.getvalue(), e
+            return log.getvalue(), None
+        if not components:
+            return
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers or POPULATE_WORKERS, len(components)))) as executor:
+            for log, error in executor.map(call, components):
+                print(log, end='')
+                if error is not None:
+                    errors.append(error)
+        if errors:
+            raise errors[0]
+
     def bundle_populate_hub_component(self,
                                       component,
                                       bundle,
                                       as_a_git_clone=True,
-                                      filter_file=None):
+                                      filter_file=None,
+                                      snapshot=None):
         """
         Populate hub with 'component' from bundle.
 
@@ -480,34 +591,58 @@ class Pack(object):
         :param as_a_git_clone: if True, populates as a git clone
         :param filter_file: file in which to read the files to be
             filtered at populate time.
+        :param snapshot: BundleSnapshot of the bundle, if already queried
         """
         config = bundle.projects[component]
         pkg_dst = self.bundle_component_destination(component, config)
         repository = bundle.local_project_repo(component)
+        project = snapshot.projects[component] if snapshot is not None else None
         # packages auto-compiled, in hub
         print("\n* '{}' ({}) from repo: {} via cache: {}".format(component,
-                                                                 bundle.project_version(component),
-                                                                 bundle.project_origin(component),
+                                                                 project.version if project
+                                                                 else bundle.project_version(component),
+                                                                 project.origin if project
+                                                                 else bundle.project_origin(component),
                                                                  repository))
         if not self.is_incremental or self.is_incremental and config.get('incremental_pack', True):
             # main pack or incremental and package to be added in hub/local in bulk
             pkg = self.bundle_component_renamed(component, config)
             pkg_dst = os.path.join(self.abspath, pkg_dst, pkg)
-            if as_a_git_clone:
-                git_clone(repository, pkg_dst, remove_if_preexisting=True)
-            else:
+            # staged in a sibling directory, then renamed into place
+            os.makedirs(os.path.dirname(pkg_dst), exist_ok=True)
+            staging = tempfile.mkdtemp(prefix='.{}.'.format(pkg), dir=os.path.dirname(pkg_dst))
+            try:
+                staged = os.path.join(staging, pkg)
+                copier = self.copier(immutable_source=True)
+                if as_a_git_clone and copier is not None:
+                    # clone without checkout (git objects are hardlinked), then working tree from the cache's one
+                    subprocess.check_call(['git', 'clone', '--quiet', '--no-checkout', repository, staged])
+                    copier.copytree(repository, staged,
+                                    ignore=lambda d, names: ['.git'] if d == repository else [])
+                    subprocess.check_call(['git', 'reset', '--quiet'], cwd=staged)  # index
+                    print("  " + copier.report())
+                elif as_a_git_clone:
+                    git_clone(repository, staged, quiet=True)
+                elif copier is not None:
+                    copier.copytree(repository, staged)
+                    print("  " + copier.report())
+                else:
+                    shutil.copytree(repository, staged, symlinks=True)
                 if os.path.exists(pkg_dst):
-                    shutil.rmtree(pkg_dst)
-                shutil.copytree(repository, pkg_dst, symlinks=True)
+                    os.rename(pkg_dst, os.path.join(staging, '.previous'))
+                os.rename(staged, pkg_dst)
+            finally:
+                shutil.rmtree(staging)
             print(" ... package populated.")
             if self.is_incremental:
                 print("(Package populated in bulk : incremental hub packages is currently not available. " +
                       "To deactivate package population in incremental packs, set bundle key: " +
                         "incremental_pack = False (default:True).)")
                 # edit hub/.gmkview to account priorily for local packages
-                os.remove(self._hub_gmkview_file)
-                with open(self._hub_gmkview_file, 'w') as hgf:
-                    hgf.writelines(['local\n', 'main'])
+                with self._hub_gmkview_lock:
+                    os.remove(self._hub_gmkview_file)
+                    with open(self._hub_gmkview_file, 'w') as hgf:
+                        hgf.writelines(['local\n', 'main'])
         else:
             # incremental pack and package ignored
             print(" ... package ignored (bundle: incremental_pack = False).")
@@ -516,7 +651,8 @@ class Pack(object):
                                           component,
                                           bundle,
                                           as_a_git_clone=True,
-                                          filter_file=None):
+                                          filter_file=None,
+                                          snapshot=None):
         """
         Populate src/local with component from bundle.
 
@@ -524,13 +660,17 @@ class Pack(object):
         :param as_a_git_clone: if True, populates as a git clone
         :param filter_file: file in which to read the files to be
             filtered at populate time.
+        :param snapshot: BundleSnapshot of the bundle, if already queried
         """
         config = bundle.projects[component]
         pkg_dst = self.bundle_component_destination(component, config)
         repository = bundle.local_project_repo(component)
+        project = snapshot.projects[component] if snapshot is not None else None
         print("\n* Component: '{}' ({}) from repo: {} via cache: {}".format(component,
-                                                                            bundle.project_version(component),
-                                                                            bundle.project_origin(component),
+                                                                            project.version if project
+                                                                            else bundle.project_version(component),
+                                                                            project.origin if project
+                                                                            else bundle.project_origin(component),
                                                                             repository))
         subdir = pkg_dst.split(os.path.sep)
         if len(subdir) > 2:
@@ -545,22 +685,23 @@ class Pack(object):
             # main pack, or not able to determine an increment: bulk
             pkg_parentdir = os.path.join(self.abspath, pkg_dst)
             pkg_dst = os.path.join(self.abspath, pkg_dst, component)
-            git_clone(repository, pkg_dst, remove_if_preexisting=True)
-            if component.upper() == bundle.IAL.upper():
-                print("Move contents of {} to {}".format(pkg_dst, pkg_parentdir))
-                # move everything one level up
-                for a in os.listdir(pkg_dst):
-                    shutil.move(os.path.join(pkg_dst, a), os.path.join(pkg_parentdir, a))
-                os.rmdir(pkg_dst)
-                pkg_dst = pkg_parentdir
-            # filter a posteriori
-            # if filter_file is specified in bundle: special syntax
+            # if filter_file is specified in bundle: special syntax (read in the cache repository)
             if filter_file is not None:
                 in_repo = re.match(self._filter_file_in_repo_re, filter_file)
                 if in_repo:
-                    filter_file = os.path.join(pkg_dst, in_repo.group('file'))
-                to_be_filtered = self.prepare_sources_filter(filter_file, subdir=subdir)
-                self.filter_sources_a_posteriori(to_be_filtered)
+                    filter_file = os.path.join(repository, in_repo.group('file'))
+            filter_list = self.read_sources_filter_list(filter_file) if filter_file is not None else []
+            if component.upper() == bundle.IAL.upper():
+                # IAL contents at the root of src/local: exported from the cache repository objects, no clone
+                exclude = self._export_IAL_component(repository, pkg_parentdir, filter_list, subdir=subdir)
+                pkg_dst = pkg_parentdir
+            else:
+                # filtered sources are not checked out
+                exclude = self.sources_filter_exclusions(filter_list, repository, subdir=subdir, destination=pkg_dst)
+                git_clone(repository, pkg_dst, remove_if_preexisting=True, exclude=exclude)
+            # filter a posteriori what could not be excluded
+            if filter_file is not None:
+                self.reconcile_sources_filter(filter_file, exclude, subdir=subdir)
         else:
             # incremental pack
             self._populate_from_repo_as_incremental_component(repository,
@@ -568,14 +709,46 @@ class Pack(object):
                                                               subdir=subdir)
             print("  ! Incremental source update: no filtering.")
 
+    def _export_IAL_component(self, repository, destination, filter_list, subdir=None):
+        """
+        Export the checkedout commit of IAL **repository** (bundle cache) into **destination**,
+        straight from its object database (no clone, no .git), filtering out the sources of **filter_list**
+        on the way. The exported commit is recorded in self.origin_filepath.
+
+        :return: the paths filtered out
+        """
+        from ial_build.repositories import GitProxy
+        repo = GitProxy(repository)
+        commit = repo.latest_commit
+        is_filtered = self.sources_filter_matcher(filter_list, subdir=subdir)
+        excluded = []
+
+        def exclude(path):
+            if is_filtered(path):
+                excluded.append(path)
+                return True
+            return False
+        print("  Exporting tree of commit {} to {} (no clone)...".format(commit, destination))
+        stats = repo.export_tree(commit, destination, exclude=exclude)
+        print("  {} files ({} bytes) written, {} filtered out".format(stats['files'],
+                                                                      stats['bytes'],
+                                                                      stats['excluded']))
+        openmode = 'a' if os.path.exists(self.origin_filepath) else 'w'
+        with io.open(self.origin_filepath, openmode) as f:
+            f.write("Component IAL exported from '{}' at commit: {}\n".format(repository, commit))
+        return excluded
+
     def bundle_populate(self,
                         bundle,
-                        cleanpack=False):
+                        cleanpack=False,
+                        workers=None):
         """
         Populate pack from bundle.
 
         :param bundle: the ial_build.bundle.IALBundle object.
         :param cleanpack: if True, call cleanpack before populating
+        :param workers: number of src/local components (and hub packages) populated concurrently
+                        (defaults to config.POPULATE_WORKERS)
         """
         if cleanpack:
             self.cleanpack()
@@ -584,29 +757,44 @@ class Pack(object):
                           if self.bundle_component_destination(component, config).startswith('hub')}
         gmkpack_components = {component:config for component, config in bundle.projects.items()
                               if self.bundle_component_destination(component, config).startswith('src/local')}
-        tags_history = bundle.tags_history()
+        snapshot = bundle.snapshot()  # projects' repositories queried concurrently, once
+        tags_history = snapshot.tags_history
         # start with hub:
         msg = "Populating components in pack's hub:"
         print("\n" + msg + "\n" + "=" * len(msg))
-        for component, config in hub_components.items():
-            self.bundle_populate_hub_component(component,
-                                               bundle)
+        self.bundle_populate_hub_components(list(hub_components.keys()), bundle, snapshot=snapshot,
+                                            workers=workers)
         # then src/local components:
         print("Clean src/local")
         shutil.rmtree(self._local)
         os.makedirs(self._local)
         msg = "Populating components in pack's src/local:"
         print("\n" + msg + "\n" + "=" * len(msg))
+        filter_files = {}
         for component, config in gmkpack_components.items():
             if 'gmkpack_filter_file' in config:
                 # filter file is specified in the bundle - and the file is in the repo
-                filter_file = self._filter_file_in_repo_format.format(config['gmkpack_filter_file'])
+                filter_files[component] = self._filter_file_in_repo_format.format(config['gmkpack_filter_file'])
             else:
-                # otherwise, taken from IAL-build (old way)
-                filter_file = self._configfile_for_sources_filtering(component, tags_history[component])
+                # otherwise, taken from IAL-build (old way), after the tags history
+                if 'git' in config and tags_history.get(component) is None:  # shallow clone
+                    tags_history[component] = bundle.deepened_tags_history(component,
+                                                                           snapshot.projects[component].commit)
+                filter_files[component] = self._configfile_for_sources_filtering(component,
+                                                                                 tags_history.get(component))
+
+        def populate(component):
             self.bundle_populate_gmkpack_component(component,
                                                    bundle,
-                                                   filter_file=filter_file)
+                                                   filter_file=filter_files[component],
+                                                   snapshot=snapshot)
+        # IAL first, as it is populated (and filtered) at the root of src/local,
+        # then the other components, each in its own subdirectory, concurrently
+        others = [c for c in gmkpack_components.keys() if c.upper() != bundle.IAL.upper()]
+        for component in gmkpack_components.keys():
+            if component not in others:
+                populate(component)
+        self._concurrently(populate, others, workers=workers)
         print('-' * 80)
         if not self.is_incremental:
             # symbols to be ignored
@@ -683,12 +871,61 @@ class Pack(object):
                     filter_list[i] = os.path.join(self._local, f)
                 else:
                     filter_list[i] = os.path.join(self._local, subdir, f)
-        # expand wildcards
+        # expand wildcards: filters are mostly literal paths, for which glob is a mere lstat,
+        # faster than a walk of the tree (cf. benchmarks/bench_sources_filter.py)
         expanded_filter_list = []
         for f in filter_list:
             expanded_filter_list.extend(glob.glob(f))
         return expanded_filter_list
 
+    def sources_filter_exclusions(self, filter_list, source_root, subdir=None, destination=None):
+        """
+        Paths (relative to **source_root**) of the sources to be filtered out according to **filter_list**
+        (as read by read_sources_filter_list), to be excluded when copying **source_root** to **destination**
+        (defaults to src/local/{subdir}). They are expanded in the source as prepare_sources_filter would
+        expand them in the pack once copied, so that excluding them is equivalent to filtering a posteriori.
+        """
+        root = self._local if subdir is None else os.path.join(self._local, subdir)
+        if destination is None:
+            destination = root
+        excluded = set()
+        for f in filter_list:
+            if not os.path.isabs(f):
+                f = os.path.join(root, f)
+            f = os.path.relpath(os.path.normpath(f), destination)
+            if f.startswith('..'):  # not within destination: left to a posteriori filtering
+                continue
+            for path in glob.glob(os.path.join(source_root, f)):
+                excluded.add(os.path.relpath(path, source_root))
+        return excluded
+
+    def reconcile_sources_filter(self, filter_file, excluded, subdir=None):
+        """
+        Filter a posteriori the sources filtered out according to **filter_file** that have not been
+        **excluded** at copy time, and report.
+        """
+        to_be_filtered = self.prepare_sources_filter(filter_file, subdir=subdir)
+        print("Sources filter: {} paths excluded at copy, {} left to be removed a posteriori.".format(
+              len(excluded), len(to_be_filtered)))
+        self.filter_sources_a_posteriori(to_be_filtered)
+
+    def sources_filter_matcher(self, filter_list, subdir=None):
+        """
+        Return a function telling whether a path (relative to src/local/{subdir})
+        is to be filtered out according to **filter_list** (as read by read_sources_filter_list),
+        i.e. if the path or one of its parent directories matches an entry of the list.
+        Wildcards match within a path component, as in prepare_sources_filter.
+        """
+        root = self._local if subdir is None else os.path.join(self._local, subdir)
+        patterns = []
+        for f in filter_list:
+            if os.path.isabs(f):
+                f = os.path.relpath(os.path.abspath(f), root)
+                if f.startswith('..'):  # out of pack/src/local: ignore
+                    continue
+            patterns.append(f)
+        return PathFilter(patterns).matches
+
     def _configfile_for_sources_filtering(self, project, versions=None):
         """
         Find filter file in conf, for project and optionally version.
@@ -733,6 +970,10 @@ class Pack(object):
 
     def write_ignored_sources(self, list_of_files):
         """Write sources to be ignored in a dedicated file."""
+        with self._ignored_sources_lock:  # components may be populated concurrently
+            self._write_ignored_sources(list_of_files)
+
+    def _write_ignored_sources(self, list_of_files):
         if isinstance(list_of_files, str):  # already a file containing filenames: copy
             shutil.copyfile(list_of_files, self._ignored_sources_filepath)
         else:
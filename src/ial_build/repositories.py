@@ -5,6 +5,7 @@ Management of repositories.
 """
 import subprocess
 import os
+import json
 import re
 import sys
 import io
@@ -12,33 +13,632 @@ from contextlib import contextmanager
 import getpass
 import tempfile
 import shutil
+import threading
+import bisect
+import heapq
+import collections.abc
+import types
+import fcntl
+import time
 
-from .config import IAL_OFFICIAL_TAGS_re, IAL_BRANCHES_re
+from .config import IAL_OFFICIAL_TAGS_re, IAL_BRANCHES_re, GIT_PERSISTENT_SESSION
 
 
 def git_clone(repository,
               destination,
-              remove_if_preexisting=False):
-    """Wrapper to `git clone <repository> <destination>`"""
+              remove_if_preexisting=False,
+              exclude=None,
+              quiet=False):
+    """
+    Wrapper to `git clone <repository> <destination>`
+
+    :param exclude: paths (files or directories, relative to the repository root) not to be checked out:
+        they are then seen as deleted in the clone's working tree
+    :param quiet: `git clone --quiet`
+    """
     if os.path.exists(destination) and remove_if_preexisting:
         shutil.rmtree(destination)
-    subprocess.check_call(['git', 'clone', repository, destination])
+    clone = ['git', 'clone'] + (['--quiet'] if quiet else [])
+    if not exclude:
+        subprocess.check_call(clone + [repository, destination])
+        return
+    subprocess.check_call(clone + ['--no-checkout', repository, destination])
+    subprocess.check_call(['git', 'reset', '--quiet'], cwd=destination)  # index, as after a checkout
+    exclude = set([os.path.normpath(p) for p in exclude])
+
+    def excluded(path):
+        parts = path.split('/')
+        return any(['/'.join(parts[:i]) in exclude for i in range(1, len(parts) + 1)])
+    files = subprocess.check_output(['git', 'ls-files', '-z'], cwd=destination).decode('utf-8').split('\0')
+    to_checkout = [f for f in files if f != '' and not excluded(f)]
+    subprocess.run(['git', 'checkout-index', '-z', '--stdin'], cwd=destination, check=True,
+                   input='\0'.join(to_checkout).encode('utf-8'))
 
 
 class GitError(Exception):
     pass
 
 
+class GitBatchPipe(object):
+    """
+    Long-lived `git cat-file --batch` (or `--batch-check`) process,
+    answering object queries (commits, tags, refs, blobs...) through a pipe
+    rather than forking a new git process for each query.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, repository, mode='--batch-check'):
+        """
+        :param repository: path to the git repository
+        :param mode: '--batch-check' (headers only) or '--batch' (headers and contents)
+        """
+        assert mode in ('--batch-check', '--batch')
+        self.repository = repository
+        self.mode = mode
+        self.spawns = 0
+        self.queries = 0
+        self._process = None
+        self._lock = threading.Lock()
+
+    @property
+    def spawns_avoided(self):
+        """Number of queries that have been answered by an already running process."""
+        return self.queries - self.spawns
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        self._process = subprocess.Popen(['git', 'cat-file', self.mode],
+                                         cwd=self.repository,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL)
+        self.spawns += 1
+
+    def _query(self, obj):
+        """Send query for **obj**, and return its header (oid, type, size), or None if missing."""
+        if '\n' in obj:
+            raise GitError("Invalid object name: {!r}".format(obj))
+        if not self.alive:
+            self._start()
+        self.queries += 1
+        try:
+            self._process.stdin.write(obj.encode('utf-8') + b'\n')
+            self._process.stdin.flush()
+            header = self._process.stdout.readline()
+        except (BrokenPipeError, OSError):
+            header = b''
+        if not header:
+            self.close()
+            raise GitError("git cat-file process ended unexpectedly in: {}".format(self.repository))
+        header = header.decode('utf-8').rstrip('\n').split(' ')
+        if header[-1] in ('missing', 'ambiguous') or len(header) != 3:
+            return None
+        return (header[0], header[1], int(header[2]))
+
+    def check(self, obj):
+        """Return (oid, type, size) of **obj**, or None if it does not exist."""
+        with self._lock:
+            header = self._query(obj)
+            if header is not None and self.mode == '--batch':
+                self._read_contents(header[2], None)
+            return header
+
+    def read(self, obj, out=None):
+        """
+        Read contents of **obj**.
+
+        :param out: if None, return the contents as bytes;
+                    otherwise, a binary file-like object in which contents are written chunk by chunk,
+                    and the header (oid, type, size) is returned.
+        :return: None if object does not exist
+        """
+        assert self.mode == '--batch', "Reading contents requires a '--batch' pipe."
+        with self._lock:
+            header = self._query(obj)
+            if header is None:
+                return None
+            contents = self._read_contents(header[2], out)
+        return header if out is not None else contents
+
+    def _read_contents(self, size, out):
+        stdout = self._process.stdout
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = stdout.read(min(self.chunk_size, remaining))
+            if not chunk:
+                self.close()
+                raise GitError("git cat-file process ended unexpectedly in: {}".format(self.repository))
+            remaining -= len(chunk)
+            if out is None:
+                chunks.append(chunk)
+            else:
+                out.write(chunk)
+        stdout.read(1)  # trailing LF
+        return b''.join(chunks) if out is None else None
+
+    def close(self):
+        """Terminate the process."""
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except Exception:
+                self._process.kill()
+            self._process = None
+
+
+class RefIndex(object):
+    """
+    Index of the refs of a repository: tags, local branches and remote branches per remote,
+    as hash-keyed dicts/sets built from a single `git for-each-ref`,
+    including the map of tags peeled to the commits they point to.
+    """
+
+    for_each_ref_format = '%(objectname) %(objecttype) %(*objectname) %(*objecttype) %(refname)'
+    namespaces = ('refs/heads', 'refs/remotes', 'refs/tags')
+
+    def __init__(self, for_each_ref_lines):
+        """
+        :param for_each_ref_lines: output lines of `git for-each-ref` with format
+            self.for_each_ref_format
+        """
+        self.tags = {}
+        self.local_branches = {}
+        self.remote_branches = {}  # {remote: {branch: hash}}
+        self.remote_heads = {}  # {remote: hash of remote/HEAD}
+        self.detached_branches = {}  # {'remote/branch': hash}
+        self.tag_commits = {}  # {tag: peeled commit}
+        self._remote_branch_names = set()
+        for line in for_each_ref_lines:
+            h, htype, peeled, peeled_type, r = line.split(' ', 4)
+            if r.startswith('refs/remotes/'):
+                remote, _, branch = r[len('refs/remotes/'):].partition('/')
+                if branch == 'HEAD':
+                    self.remote_heads[remote] = h
+                elif branch != '':
+                    self.remote_branches.setdefault(remote, {})[branch] = h
+                    self.detached_branches['/'.join([remote, branch])] = h
+                    self._remote_branch_names.add(branch)
+            elif r.startswith('refs/heads/'):
+                self.local_branches[r[len('refs/heads/'):]] = h
+            elif r.startswith('refs/tags/'):
+                tag = r[len('refs/tags/'):]
+                self.tags[tag] = h
+                if htype == 'commit':
+                    self.tag_commits[tag] = h
+                elif peeled_type == 'commit':
+                    self.tag_commits[tag] = peeled
+
+    @classmethod
+    def build(cls, git_proxy):
+        """Build index for the repository of **git_proxy**."""
+        git_cmd = ['git', 'for-each-ref', '--format=' + cls.for_each_ref_format] + list(cls.namespaces)
+        return cls(git_proxy._git_cmd(git_cmd))
+
+    def is_tag(self, ref):
+        return ref in self.tags
+
+    def tag_commit(self, tag):
+        """Commit pointed by **tag**, or None if unknown (or not pointing to a commit)."""
+        return self.tag_commits.get(tag)
+
+    def is_branch(self, ref):
+        """Local branch, remote branch, or remote branch as detached (remote/branch)."""
+        return (ref in self.local_branches or
+                ref in self._remote_branch_names or
+                ref in self.detached_branches)
+
+
+class TagGenealogy(object):
+    """
+    Persistent index of the genealogy of tags of a repository, stored under its .git:
+    each tag is mapped to its peeled commit, and tagged commits are ranked in a
+    topological (and otherwise chronological) order.
+    The index is updated incrementally when new tags appear.
+
+    Tagged ancestors of a commit are then found by `git for-each-ref --merged`
+    (which benefits from commit-graph generation numbers) and sorted by rank,
+    instead of walking and parsing the whole `git log`.
+    """
+
+    version = 1
+    subdir = 'ial_build'
+    filename = 'tag_genealogy.json'
+
+    def __init__(self, git_proxy):
+        self.git_proxy = git_proxy
+        self.path = os.path.join(git_proxy.git_common_dir, self.subdir, self.filename)
+        self.tags = {}  # {tag: [tag object, peeled commit]}
+        self.ranks = {}  # {commit: rank}
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with io.open(self.path, 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                return
+            if index.get('version') == self.version:
+                self.tags = index['tags']
+                self.ranks = index['ranks']
+
+    def _save(self):
+        """Save atomically; silently skipped if the repository is not writable."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.' + self.filename)
+            with io.open(fd, 'w') as f:
+                json.dump({'version':self.version, 'tags':self.tags, 'ranks':self.ranks}, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def refresh(self):
+        """Integrate new, moved or deleted tags, if any."""
+        ref_index = self.git_proxy.ref_index
+        tag_objects = ref_index.tags
+        # only tags pointing (peeled) to a commit are in genealogy
+        if len(ref_index.tag_commits) == len(self.tags) and \
+           all([self.tags.get(t, [None])[0] == tag_objects[t] for t in ref_index.tag_commits]):
+            return  # up-to-date
+        tags = {t:[tag_objects[t], c] for t, c in ref_index.tag_commits.items()}
+        commits = set([c for _, c in tags.values()])
+        ranks = {c:r for c, r in self.ranks.items() if c in commits}
+        new_commits = commits.difference(ranks.keys())
+        if len(new_commits) > 0:
+            if len(ranks) == 0 or not self._append_ranks(ranks, new_commits):
+                ranks = self._rank(commits)
+        self.tags = tags
+        self.ranks = ranks
+        self._save()
+
+    def _rev_list(self, revisions):
+        git_cmd = ['git', 'rev-list', '--date-order', '--reverse', '--stdin']
+        out = subprocess.run(git_cmd, cwd=self.git_proxy.repository,
+                             input='\n'.join(revisions).encode('utf-8') + b'\n',
+                             stdout=subprocess.PIPE, check=True).stdout
+        return out.decode('utf-8').split()
+
+    def _rank(self, commits):
+        """Rank **commits** from scratch, in one walk of their history."""
+        ranks = {}
+        for c in self._rev_list(sorted(commits)):
+            if c in commits:
+                ranks[c] = len(ranks)
+        return ranks
+
+    def _append_ranks(self, ranks, new_commits):
+        """
+        Rank **new_commits** after the already ranked commits, walking only their history
+        down to the already ranked commits. Return False if impossible, i.e. if one of the new commits
+        is an ancestor of an already ranked commit.
+        """
+        revisions = sorted(new_commits) + ['^' + c for c in ranks.keys()]
+        appended = [c for c in self._rev_list(revisions) if c in new_commits]
+        if len(appended) != len(new_commits):
+            return False
+        start = max(ranks.values()) + 1
+        for i, c in enumerate(appended):
+            ranks[c] = start + i
+        return True
+
+    def tagged_ancestors(self, ref):
+        """Set of tags which commit is an ancestor of (or is) **ref**."""
+        git_cmd = ['git', 'for-each-ref', '--merged', ref, '--format=%(refname)', 'refs/tags']
+        return set([r[len('refs/tags/'):] for r in self.git_proxy._git_cmd(git_cmd)])
+
+    def tags_between(self, start_ref=None, end_ref='HEAD'):
+        """
+        Tags between 2 references (as `git log start_ref...end_ref`), grouped by commit
+        in chronological order.
+        """
+        self.refresh()
+        tags = self.tagged_ancestors(end_ref)
+        if start_ref is not None:
+            tags = tags.symmetric_difference(self.tagged_ancestors(start_ref))
+        by_commit = {}
+        for t in tags:
+            if t in self.tags:
+                by_commit.setdefault(self.tags[t][1], []).append(t)
+        return [sorted(by_commit[c], reverse=True)  # same order as git log decorations
+                for c in sorted(by_commit.keys(), key=lambda c: self.ranks[c])]
+
+
+class FileChange(object):
+    """Change of a file, as reported by `git diff` or `git status`."""
+
+    __slots__ = ('status', 'old_path', 'new_path', 'similarity', 'blob')
+
+    _null_sha = '0' * 40
+
+    def __init__(self, status, old_path, new_path=None, similarity=None, blob=None):
+        """
+        :param status: status letter (A, M, T, D, R, C, U, X, B)
+        :param old_path: path of the file (original path for renamed/copied files)
+        :param new_path: new path for renamed/copied files (same as old_path otherwise)
+        :param similarity: similarity score (%) of renamed/copied files
+        :param blob: SHA of the git blob of the new contents of the file, if known
+        """
+        self.status = status
+        self.old_path = sys.intern(old_path)
+        self.new_path = self.old_path if new_path is None else sys.intern(new_path)
+        self.similarity = similarity
+        self.blob = blob
+
+    def __repr__(self):
+        if self.status in ('R', 'C'):
+            return "<FileChange {}{}: {} -> {}>".format(self.status, self.similarity, self.old_path, self.new_path)
+        return "<FileChange {}: {}>".format(self.status, self.new_path)
+
+    @classmethod
+    def from_diff_z(cls, tokens):
+        """
+        Parse the NUL-delimited **tokens** of `git diff --name-status -z`
+        (or `git diff --raw --no-abbrev -z`, then with the blobs of the new contents),
+        and yield FileChange objects.
+        """
+        tokens = iter(tokens)
+        for status in tokens:
+            if status == '':
+                continue
+            blob = None
+            if status.startswith(':'):  # raw: ':<old mode> <new mode> <old sha> <new sha> <status>'
+                _, _, _, blob, status = status.split(' ')
+                if blob == cls._null_sha:  # deleted, or not in the object database (working tree)
+                    blob = None
+            letter, score = status[0], status[1:]
+            if letter in ('R', 'C'):
+                old_path = next(tokens)
+                yield cls(letter, old_path, next(tokens), similarity=int(score) if score else None, blob=blob)
+            else:
+                yield cls(letter, next(tokens), blob=blob)
+
+    @classmethod
+    def from_status_z(cls, tokens):
+        """
+        Parse the NUL-delimited **tokens** of `git status --porcelain -z`,
+        and yield FileChange objects. Untracked files are reported as Added;
+        the status is the one of the index, or of the working tree if unchanged in index.
+        """
+        tokens = iter(tokens)
+        for entry in tokens:
+            if entry == '':
+                continue
+            xy, path = entry[:2], entry[3:]
+            if xy == '??':
+                letter = 'A'
+            elif xy == '!!':
+                continue
+            else:
+                letter = xy[0] if xy[0] != ' ' else xy[1]
+            if xy[0] in ('R', 'C'):
+                yield cls(letter, next(tokens), path)  # syntax: XY new\0old\0
+            else:
+                yield cls(letter, path)
+
+
+class TouchedFiles(collections.abc.Mapping):
+    """
+    Touched files, as a read-only mapping: {status letter: sorted tuple of entries},
+    entries being paths for A/M/T/D/U/X/B, and (old path, new path) tuples for R/C.
+
+    Paths are interned and stored in sorted tuples, so that lookups are done by bisection.
+    Merging several TouchedFiles (e.g. committed and uncommitted changes) does not copy them:
+    the merged object only references the layers of changes of each of them,
+    later layers superseding earlier ones for a given path.
+    """
+
+    _copied_statuses = ('A', 'M', 'T', 'R', 'C')
+    unknown_statuses = ('U', 'X', 'B')
+
+    def __init__(self, changes=(), layers=None, blobs=None):
+        """
+        :param changes: iterable of FileChange
+        :param layers: (internal) already built layers
+        :param blobs: (internal) blobs of the new contents of files, per layer
+        """
+        if layers is None:
+            by_status = {}
+            layer_blobs = {}
+            for change in changes:
+                if change.blob is not None:
+                    layer_blobs[change.new_path] = change.blob
+                if change.status in ('R', 'C'):
+                    by_status.setdefault(change.status, []).append((change.old_path, change.new_path))
+                else:
+                    by_status.setdefault(change.status, []).append(change.new_path)
+            layer = {}
+            for k, entries in by_status.items():
+                entries = tuple(sorted(set(entries)))
+                if k in ('R', 'C'):
+                    layer[k] = (entries,
+                                tuple(sorted([e[0] for e in entries])),
+                                tuple(sorted([e[1] for e in entries])))
+                else:
+                    layer[k] = (entries,)
+            layers = (layer,)
+            blobs = (layer_blobs,)
+        self._layers = tuple(layers)
+        self._blobs = tuple(blobs) if blobs is not None else tuple([{} for _ in self._layers])
+
+    def merged(self, other):
+        """Merge with **other** (which supersedes self for the files touched in both), without copying."""
+        return TouchedFiles(layers=self._layers + other._layers, blobs=self._blobs + other._blobs)
+
+    # Mapping interface
+    def __getitem__(self, status):
+        entries = [layer[status][0] for layer in self._layers if status in layer]
+        if len(entries) == 0:
+            raise KeyError(status)
+        elif len(entries) == 1:
+            return entries[0]
+        merged = []
+        for e in heapq.merge(*entries):
+            if len(merged) == 0 or merged[-1] != e:
+                merged.append(e)
+        return tuple(merged)
+
+    def __iter__(self):
+        statuses = []
+        for layer in self._layers:
+            statuses.extend([k for k in layer.keys() if k not in statuses])
+        return iter(statuses)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return "<TouchedFiles {}>".format({k:len(v) for k, v in self.items()})
+
+    # Lookups
+    @staticmethod
+    def _bisect_in(path, sorted_paths):
+        i = bisect.bisect_left(sorted_paths, path)
+        return i < len(sorted_paths) and sorted_paths[i] == path
+
+    def _layer_statuses_of(self, layer, path):
+        """Statuses of **path** in **layer**, as a list of (status, entry)."""
+        found = []
+        for k, arrays in layer.items():
+            if k in ('R', 'C'):
+                entries, old_paths, new_paths = arrays
+                if self._bisect_in(path, old_paths) or self._bisect_in(path, new_paths):
+                    found.extend([(k, e) for e in entries if path in e])
+            elif self._bisect_in(path, arrays[0]):
+                found.append((k, path))
+        return found
+
+    def changes_touching(self, path):
+        """List of (status, entry) touching **path**, in any layer."""
+        found = []
+        for layer in self._layers:
+            found.extend([f for f in self._layer_statuses_of(layer, path) if f not in found])
+        return found
+
+    def touches(self, path):
+        """Whether **path** is touched."""
+        return len(self.changes_touching(path)) > 0
+
+    def _resolved(self):
+        """
+        {path: to be copied (True) or deleted (False)}, later layers superseding earlier ones.
+        Within a layer, deletions are resolved before copies (e.g. a renamed file re-created untracked).
+        """
+        resolved = {}
+        for layer in self._layers:
+            resolved.update({path:False for path in layer.get('D', ((),))[0]})
+            resolved.update({old_path:False for old_path, _ in layer.get('R', ((),))[0]})
+            for k in ('A', 'M', 'T'):
+                resolved.update({path:True for path in layer.get(k, ((),))[0]})
+            for k in ('R', 'C'):
+                resolved.update({new_path:True for _, new_path in layer.get(k, ((),))[0]})
+        return resolved
+
+    @property
+    def blobs(self):
+        """
+        {path: SHA of the git blob of its new contents}, for the files to be copied of which it is known,
+        i.e. not touched again in a later layer of unknown blobs (e.g. uncommitted changes).
+        """
+        blobs = {}
+        for layer, layer_blobs in zip(self._layers, self._blobs):
+            for k, arrays in layer.items():
+                for entry in arrays[0]:
+                    for path in (entry if k in ('R', 'C') else (entry,)):
+                        blobs.pop(path, None)
+            blobs.update(layer_blobs)
+        resolved = self._resolved()
+        return {path:blob for path, blob in blobs.items() if resolved.get(path, False)}
+
+    @property
+    def to_copy(self):
+        """Sorted list of paths to be copied (added, modified, type changed, new path of renamed/copied)."""
+        return sorted([path for path, copy in self._resolved().items() if copy])
+
+    @property
+    def to_delete(self):
+        """Sorted list of paths to be deleted (deleted, original path of renamed)."""
+        return sorted([path for path, copy in self._resolved().items() if not copy])
+
+    @property
+    def unknown(self):
+        """Statuses of unknown interpretation present in changes."""
+        return [k for k in self.unknown_statuses if k in self]
+
+
+class ResolvedRef(collections.namedtuple('ResolvedRef', ['ref', 'kind', 'full_name', 'commit',
+                                                          'head_branch', 'head_commit', 'dirty'])):
+    """
+    Frozen resolution of a reference in a repository, along with the state of its HEAD:
+
+    - ref: the reference as given
+    - kind: 'branch' (local), 'remote_branch' (branch known on a remote only),
+      'detached_branch' (remote/branch), 'tag', 'HEAD', 'commit', or None if it does not exist
+    - full_name: full refname (e.g. refs/heads/<branch>), or None
+    - commit: the commit pointed by the ref (peeled), or None
+    - head_branch: the branch currently checked out, or None if HEAD is detached
+    - head_commit: the commit currently checked out
+    - dirty: whether the working copy has uncommitted changes (including untracked files)
+    """
+    __slots__ = ()
+
+    @property
+    def exists(self):
+        return self.kind is not None
+
+    @property
+    def is_branch(self):
+        return self.kind in ('branch', 'remote_branch', 'detached_branch')
+
+    @property
+    def is_tag(self):
+        return self.kind == 'tag'
+
+    @property
+    def head(self):
+        """What is currently checked out: the branch, or else the commit."""
+        return self.head_branch if self.head_branch is not None else self.head_commit
+
+    @property
+    def is_clean(self):
+        return not self.dirty
+
+
 class GitProxy(object):
 
     re_author_in_commit = re.compile(r'Author: (?P<name>.+) <(?P<email>.+@.+)>$')
     re_detached_HEAD = re.compile(r'^\* \(HEAD detached at (?P<ref>.+)\)$')
     re_oneline_decorated_commit = re.compile(r'^(?P<commit>[0-9a-f]+) \((?P<deco>.+?)\) (?P<msg>.+)$')
 
-    def __init__(self, repository='.'):
+    def __init__(self, repository='.', persistent_session=None):
+        """
+        :param persistent_session: answer object and ref queries through long-lived
+            `git cat-file` processes rather than one git process per query.
+            Defaults to config.GIT_PERSISTENT_SESSION.
+        """
         self.repository = os.path.abspath(repository)
-        assert os.path.exists(os.path.join(self.repository, '.git')), \
+        self.is_bare = (not os.path.exists(os.path.join(self.repository, '.git')) and
+                        all([os.path.exists(os.path.join(self.repository, f)) for f in ('HEAD', 'objects', 'refs')]))
+        assert self.is_bare or os.path.exists(os.path.join(self.repository, '.git')), \
             "This is not a Git **repository** : {}".format(self.repository)
+        if persistent_session is None:
+            persistent_session = GIT_PERSISTENT_SESSION
+        self.persistent_session = persistent_session
+        self._batch_pipes = {}
+        self._git_common_dir = None
+        self._ref_index = None
+        self._ref_index_signature = None
+        self._ref_index_time = None
+        self._tag_genealogy = None
+
+    def __del__(self):
+        self.close_session()
 
     @contextmanager
     def cd_repo(self):
@@ -58,8 +658,101 @@ class GitProxy(object):
         else:
             return out
 
+    @contextmanager
+    def _git_stream(self, cmd, sep='\n', check=False):
+        """
+        Context: iterator on the output lines of a git command, read lazily.
+        The process is terminated when leaving the context, even if output has not been fully read.
+
+        :param sep: separator of output records, e.g. '\\0' for commands with option -z
+        :param check: raise GitError if the command, having terminated, failed
+        """
+        p = subprocess.Popen(cmd, cwd=self.repository, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if sep == '\n':
+            records = (line.decode('utf-8').rstrip('\n') for line in p.stdout)
+        else:
+            records = self._split_stream(p.stdout, sep.encode('utf-8'))
+        try:
+            yield records
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.stdout.close()
+            p.wait()
+        if check and p.returncode not in (0, -9):
+            raise GitError("Command failed ({}): {}".format(p.returncode, ' '.join(cmd)))
+
+    @staticmethod
+    def _split_stream(stream, sep, chunk_size=65536):
+        """Generator of the decoded records of binary **stream**, separated by **sep**."""
+        pending = b''
+        while True:
+            chunk = stream.read1(chunk_size)
+            if not chunk:
+                break
+            records = (pending + chunk).split(sep)
+            pending = records.pop()
+            for record in records:
+                yield record.decode('utf-8')
+        if pending:
+            yield pending.decode('utf-8')
+
+    # Persistent session -------------------------------------------------------
+
+    def _batch_pipe(self, mode='--batch-check'):
+        """Get the (reusable) cat-file pipe of this proxy for **mode**."""
+        if mode not in self._batch_pipes:
+            self._batch_pipes[mode] = GitBatchPipe(self.repository, mode)
+        return self._batch_pipes[mode]
+
+    def _object_header(self, obj):
+        """
+        Get (oid, type, size) of **obj** (any revision syntax), or None if it does not exist.
+        Goes through the persistent session if enabled.
+        """
+        if self.persistent_session:
+            return self._batch_pipe('--batch-check').check(obj)
+        git_cmd = ['git', 'cat-file', '--batch-check']
+        out = subprocess.run(git_cmd, cwd=self.repository, input=(obj + '\n').encode('utf-8'),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        header = out.decode('utf-8').rstrip('\n').split(' ')
+        if header[-1] in ('missing', 'ambiguous') or len(header) != 3:
+            return None
+        return (header[0], header[1], int(header[2]))
+
+    def _object_contents(self, obj):
+        """Get contents of **obj** as bytes, or None if it does not exist."""
+        if self.persistent_session:
+            return self._batch_pipe('--batch').read(obj)
+        if self._object_header(obj) is None:
+            return None
+        return subprocess.check_output(['git', 'cat-file', '-p', obj], cwd=self.repository)
+
+    @property
+    def spawns_avoided(self):
+        """Number of git process spawns avoided thanks to the persistent session."""
+        return sum([p.spawns_avoided for p in self._batch_pipes.values()])
+
+    def close_session(self):
+        """Terminate the processes of the persistent session (they are restarted on demand)."""
+        for pipe in getattr(self, '_batch_pipes', {}).values():
+            pipe.close()
+
     # Repository ---------------------------------------------------------------
 
+    @property
+    def git_common_dir(self):
+        """The .git directory of the repository (shared between worktrees), or the repository itself if bare."""
+        if self._git_common_dir is None:
+            git_dir = os.path.join(self.repository, '.git')
+            if self.is_bare:
+                git_dir = self.repository
+            elif not os.path.isdir(git_dir):  # worktree
+                git_dir = self._git_cmd(['git', 'rev-parse', '--git-common-dir'])[0]
+                git_dir = os.path.join(self.repository, git_dir)
+            self._git_common_dir = os.path.abspath(git_dir)
+        return self._git_common_dir
+
     def fetch(self, ref=None, remote=None):
         """Fetch distant **remote**."""
         print("Fetch...")
@@ -70,6 +763,7 @@ class GitProxy(object):
                 git_cmd.append(ref)
         for out in self._git_cmd(git_cmd):
             print(out)
+        self._invalidate_refs()
         print("     ...ok")
 
     def push(self, remote=None):
@@ -78,6 +772,7 @@ class GitProxy(object):
         if remote is not None:
             git_cmd.append(remote)
         self._git_cmd(git_cmd)
+        self._invalidate_refs()
 
     @property
     def currently_checkedout(self):
@@ -94,13 +789,67 @@ class GitProxy(object):
                 break
         return ref
 
+    def resolve_ref(self, ref='HEAD'):
+        """
+        Resolve **ref** and the state of HEAD at once, as a frozen ResolvedRef,
+        from `git rev-parse --symbolic-full-name` and `git status --porcelain=v2 --branch -z`.
+        """
+        # ref
+        full_name = None
+        commit = None
+        kind = None
+        p = subprocess.run(['git', 'rev-parse', '--verify', '--quiet', '--symbolic-full-name', ref],
+                           cwd=self.repository, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if p.returncode == 0:
+            full_name = p.stdout.decode('utf-8').strip() or None
+            header = self._object_header(ref + '^{commit}')
+            if header is not None:
+                commit = header[0]
+                if ref == 'HEAD':
+                    kind = 'HEAD'
+                elif full_name is None:
+                    kind = 'commit'
+                elif full_name.startswith('refs/heads/'):
+                    kind = 'branch'
+                elif full_name.startswith('refs/remotes/'):
+                    kind = 'detached_branch'
+                elif full_name.startswith('refs/tags/'):
+                    kind = 'tag'
+                else:
+                    kind = 'commit'
+        else:  # maybe a branch known on a remote only
+            for remote, branches in self.ref_index.remote_branches.items():
+                if ref in branches:
+                    kind = 'remote_branch'
+                    full_name = 'refs/remotes/{}/{}'.format(remote, ref)
+                    commit = self._object_header(branches[ref] + '^{commit}')[0]
+                    break
+        # HEAD and working copy
+        head_branch = None
+        head_commit = None
+        dirty = False
+        with self._git_stream(['git', 'status', '--porcelain=v2', '--branch', '-z'],
+                              sep='\0', check=True) as entries:
+            for entry in entries:
+                if entry.startswith('# branch.oid '):
+                    head_commit = entry.split()[2]
+                elif entry.startswith('# branch.head '):
+                    head_branch = entry.split(' ', 2)[2]
+                    if head_branch == '(detached)':
+                        head_branch = None
+                elif entry != '' and not entry.startswith('#'):
+                    dirty = True
+                    break
+        if head_commit == '(initial)':
+            head_commit = None
+        return ResolvedRef(ref, kind, full_name, commit, head_branch, head_commit, dirty)
+
     # Branch(es) ---------------------------------------------------------------
 
     @property
     def local_branches(self):
         """List of local branches."""
-        return sorted([r['ref'] for r in self._refs_get()
-                       if r['rtype'] == 'branch' and r['remote'] is None])
+        return sorted(self.ref_index.local_branches.keys())
 
     def remote_branches(self, only_remote=None):
         """
@@ -109,13 +858,8 @@ class GitProxy(object):
          'remote2':...}
         If **only_remote**, keep only this.
         """
-        remotes = {}
-        for r in self._refs_get():
-            if r['rtype'] == 'branch' and r['remote'] is not None:  # is a branch and not local
-                if r['remote'] not in remotes:
-                    remotes[r['remote']] = [r['ref']]
-                else:
-                    remotes[r['remote']].append(r['ref'])
+        remotes = {remote:sorted(branches.keys())
+                   for remote, branches in self.ref_index.remote_branches.items()}
         if only_remote:
             for k in list(remotes.keys()):
                 if k != only_remote:
@@ -173,6 +917,7 @@ class GitProxy(object):
         if start_ref is not None:
             git_cmd.append(start_ref)
         self._git_cmd(git_cmd)
+        self._invalidate_refs()
 
     def pull(self, remote=None):
         """Update the local branch from remote's version."""
@@ -182,6 +927,7 @@ class GitProxy(object):
             git_cmd.append(remote)
         for out in self._git_cmd(git_cmd):
             print(out)
+        self._invalidate_refs()
         print("    ...ok")
 
     def fork_point(self, refA, refB='HEAD'):
@@ -193,47 +939,133 @@ class GitProxy(object):
 
         diff -u <(git rev-list --first-parent topic) \
                 <(git rev-list --first-parent master) | sed -ne 's/^ //p' | head -1
+
+        Both first-parent histories are read lazily and alternately from the refs,
+        and reading stops as soon as the common part is reached.
         """
-        refA_revlist = self._git_cmd(['git', 'rev-list', '--first-parent', refA])[::-1]
-        refB_revlist = self._git_cmd(['git', 'rev-list', '--first-parent', refB])[::-1]
-        for i, c in enumerate(refA_revlist):
-            if refB_revlist[i] != c:  # first different commit in history
-                i0 = i-1  # the previous is the last common one
-                break
-        return refA_revlist[i0]
+        commit = self.fork_points([refA], base=refB)[refA]
+        if commit is None:
+            raise GitError("'{}' and '{}' have no common first-parent history.".format(refA, refB))
+        return commit
+
+    def fork_points(self, refs, base='HEAD'):
+        """
+        Get the fork points of each of **refs** with **base** (cf. fork_point()),
+        with a single traversal of the history of **base**, shared by all refs.
+
+        :return: {ref: commit}, commit being None if ref and base have no common first-parent history
+        """
+        for ref in list(refs) + [base]:
+            if not self.commit_exists(ref):
+                raise GitError("Unknown reference: {}".format(ref))
+        fork_points = {}
+        with self._git_stream(['git', 'rev-list', '--first-parent', base]) as base_history:
+            base_seen = set()
+            for ref in refs:
+                with self._git_stream(['git', 'rev-list', '--first-parent', ref]) as ref_history:
+                    fork_points[ref] = self._first_common_commit(ref_history, base_history, base_seen)
+        return fork_points
+
+    @staticmethod
+    def _first_common_commit(history, base_history, base_seen):
+        """
+        Read alternately **history** and **base_history** (iterators on first-parent histories, from their tip),
+        and return the first commit found in both, i.e. the most recent common one.
+        **base_seen** is the set of commits already read from **base_history**, updated along reading.
+        """
+        seen = set()
+        exhausted = base_exhausted = False
+        while not (exhausted and base_exhausted):
+            if not exhausted:
+                c = next(history, None)
+                if c is None:
+                    exhausted = True
+                elif c in base_seen:
+                    return c
+                else:
+                    seen.add(c)
+            if not base_exhausted:
+                c = next(base_history, None)
+                if c is None:
+                    base_exhausted = True
+                else:
+                    base_seen.add(c)
+                    if c in seen:
+                        return c
+        return None
 
     # Ref(s) -------------------------------------------------------------------
 
+    def _refs_signature(self, directories=None):
+        """
+        Cheap signature of the state of refs: mtimes (and size) of packed-refs and mtimes of the refs/
+        directories (a ref creation/update/deletion renames a file within its directory, and a new
+        directory changes the mtime of its parent).
+
+        :param directories: refs/ directories to be stat'ed; if None, walked for
+        """
+        signature = []
+        packed_refs = os.path.join(self.git_common_dir, 'packed-refs')
+        if os.path.exists(packed_refs):
+            st = os.stat(packed_refs)
+            signature.append(('packed-refs', st.st_mtime_ns, st.st_size))
+        if directories is None:
+            directories = [dirpath for dirpath, _, _ in os.walk(os.path.join(self.git_common_dir, 'refs'))]
+        for dirpath in directories:
+            try:
+                signature.append((dirpath, os.stat(dirpath).st_mtime_ns))
+            except FileNotFoundError:
+                signature.append((dirpath, None))
+        return tuple(signature)
+
+    def _invalidate_refs(self):
+        """Invalidate memoized refs, after a refs-mutating operation."""
+        self._ref_index = None
+        self._ref_index_signature = None
+        self._ref_index_time = None
+
+    def _ref_index_is_current(self):
+        """
+        Whether the memoized RefIndex is up to date: the directories of its signature are stat'ed
+        again (no walk), and mtimes too close to the build of the index are not trusted.
+        """
+        if self._ref_index is None:
+            return False
+        directories = [s[0] for s in self._ref_index_signature if s[0] != 'packed-refs']
+        if self._refs_signature(directories) != self._ref_index_signature:
+            return False
+        # as "racily clean" files for git: a change in the same timestamp tick as the build would go unseen
+        mtimes = [s[1] for s in self._ref_index_signature if s[1] is not None]
+        return all([m < self._ref_index_time - self._mtime_tick_ns(mtimes) for m in mtimes])
+
+    @staticmethod
+    def _mtime_tick_ns(mtimes):
+        """Bound of the timestamps tick: a second if none has a fractional part, else a few clock ticks."""
+        if all([m % 10 ** 9 == 0 for m in mtimes]):
+            return 10 ** 9
+        return 2 * 10 ** 7
+
+    @property
+    def ref_index(self):
+        """Index of refs (RefIndex), memoized as long as refs do not change."""
+        if not self._ref_index_is_current():
+            self._ref_index_time = time.time_ns()
+            self._ref_index_signature = self._refs_signature()
+            self._ref_index = RefIndex.build(self)
+        return self._ref_index
+
     def _refs_get(self):
-        git_cmd = ['git', 'show-ref']
-        list_of_refs = [ref.split() for ref in self._git_cmd(git_cmd)]
+        index = self.ref_index
         refs = []
-        for h, r in list_of_refs:
-            if r.startswith('refs/remotes'):
-                remote = r.split('/')[2]
-                if r.endswith('/HEAD'):
-                    refs.append({'ref':r.split('/')[3],
-                                 'hash':h,
-                                 'rtype':'HEAD',
-                                 'remote':remote})
-                else:
-                    s = '/'.join(['refs/remotes', remote])
-                    refs.append({'ref':r[len(s)+1:],
-                                 'hash':h,
-                                 'rtype':'branch',
-                                 'remote':remote})
-            elif r.startswith('refs/heads'):
-                s = 'refs/heads'
-                refs.append({'ref':r[len(s)+1:],
-                             'hash':h,
-                             'rtype':'branch',
-                             'remote':None})
-            elif r.startswith('refs/tags'):
-                s = 'refs/tags'
-                refs.append({'ref':r[len(s)+1:],
-                             'hash':h,
-                             'rtype':'tag',
-                             'remote':None})
+        for remote, h in index.remote_heads.items():
+            refs.append({'ref':'HEAD', 'hash':h, 'rtype':'HEAD', 'remote':remote})
+        for remote, branches in index.remote_branches.items():
+            refs.extend([{'ref':b, 'hash':h, 'rtype':'branch', 'remote':remote}
+                         for b, h in branches.items()])
+        refs.extend([{'ref':b, 'hash':h, 'rtype':'branch', 'remote':None}
+                     for b, h in index.local_branches.items()])
+        refs.extend([{'ref':t, 'hash':h, 'rtype':'tag', 'remote':None}
+                     for t, h in index.tags.items()])
         return refs
 
     def ref_exists(self, ref):
@@ -245,13 +1077,11 @@ class GitProxy(object):
 
     def ref_is_tag(self, ref):
         """Check whether reference is tag."""
-        return ref in self.tags
+        return self.ref_index.is_tag(ref)
 
     def ref_is_branch(self, ref):
         """Check whether reference is branch."""
-        return (ref in self.local_branches or
-                any([ref in remote for remote in self.remote_branches().values()]) or
-                ref in self.detached_branches())
+        return self.ref_index.is_branch(ref)
 
     def refs_common_ancestor(self, ref1, ref2):
         """Common ancestor commit between 2 references (commits, branches, tags)."""
@@ -264,38 +1094,37 @@ class GitProxy(object):
         print("Checkout: '{}' ...".format(ref))
         git_cmd = ['git', 'checkout', ref]
         self._git_cmd(git_cmd)
+        self._invalidate_refs()
 
     # Tag(s) -------------------------------------------------------------------
 
     @property
     def tags(self):
         """Return list of tags."""
-        return sorted([r['ref'] for r in self._refs_get()
-                       if r['rtype'] == 'tag'])
+        return sorted(self.ref_index.tags.keys())
 
     def tag_points_to(self, tag):
         """Return the associated commit to **tag**."""
-        assert self.ref_exists(tag)
-        git_cmd = ['git', 'rev-list', '-n', '1', tag]
-        commit = self._git_cmd(git_cmd)[0]
+        commit = self.ref_index.tag_commit(tag)
+        if commit is None:  # not a tag (or nested tag): resolve the ref
+            assert self.ref_exists(tag)
+            commit = self._object_header(tag + '^{commit}')[0]
         return commit
 
+    def tag_commit(self, tag):
+        """Commit pointed by **tag** (from the peeled tags map), or None if unknown."""
+        return self.ref_index.tag_commit(tag)
+
+    @property
+    def tag_genealogy(self):
+        """Persistent index of the genealogy of tags (TagGenealogy)."""
+        if self._tag_genealogy is None:
+            self._tag_genealogy = TagGenealogy(self)
+        return self._tag_genealogy
+
     def tags_between(self, start_ref=None, end_ref='HEAD'):
         """Get the list of tags between 2 references (commits, branches, tags) in chronological order."""
-        if start_ref is None and end_ref:
-            refs = end_ref
-        else:
-            refs = '{}...{}'.format(start_ref, end_ref)
-        git_cmd = ['git', 'log', refs,
-                   '--decorate', '--oneline']
-        cmd_out = self._git_cmd(git_cmd)
-        # filter
-        list_of_commits = [self.re_oneline_decorated_commit.match(line) for line in cmd_out]
-        list_of_tagged_decos = [m.group('deco') for m in list_of_commits
-                                if m is not None and 'tag:' in m.group('deco')]
-        list_of_tags = [[d.strip()[5:] for d in decos.split(',') if d.strip().startswith('tag:')]
-                        for decos in list_of_tagged_decos]
-        return list_of_tags[::-1]
+        return self.tag_genealogy.tags_between(start_ref, end_ref)
 
     def tags_history(self, ref='HEAD'):
         return self.tags_between(None, ref)
@@ -304,12 +1133,7 @@ class GitProxy(object):
 
     def commit_exists(self, commit):
         """Check whether commit is existing."""
-        git_cmd = ['git', 'rev-parse', '--verify', commit + '^{commit}']
-        try:
-            self._git_cmd(git_cmd, stderr=subprocess.STDOUT)
-            return True
-        except subprocess.CalledProcessError:
-            return False
+        return self._object_header(commit + '^{commit}') is not None
 
     def commit(self, message, add=False):
         """
@@ -322,12 +1146,27 @@ class GitProxy(object):
         if add:
             git_cmd.append('-a')
         self._git_cmd(git_cmd)
+        self._invalidate_refs()
 
     @property
     def latest_commit(self):
         """Latest commit in current history."""
-        git_cmd = ['git', 'rev-parse', 'HEAD']
-        return self._git_cmd(git_cmd)[0]
+        header = self._object_header('HEAD')
+        if header is None:
+            raise GitError("HEAD does not point to any commit in: {}".format(self.repository))
+        return header[0]
+
+    @property
+    def is_shallow(self):
+        """Whether the repository is a shallow clone, i.e. with a truncated history."""
+        return self._git_cmd(['git', 'rev-parse', '--is-shallow-repository'])[0] == 'true'
+
+    def commit_of(self, ref):
+        """Commit pointed by **ref**."""
+        header = self._object_header(ref + '^{commit}')
+        if header is None:
+            raise GitError("Reference '{}' does not point to any commit in: {}".format(ref, self.repository))
+        return header[0]
 
     @property
     def latest_commit_author(self):
@@ -340,7 +1179,11 @@ class GitProxy(object):
 
     def parents(self, ref):
         """Get parent commit(s) of given ref."""
-        parents = self._git_cmd(['git', 'rev-list', '--parents', '-n', '1', ref])[0].split()[1:]
+        commit = self._object_contents(ref + '^{commit}')
+        if commit is None:
+            raise GitError("Unknown commit: {}".format(ref))
+        commit_headers = commit.split(b'\n\n', 1)[0].decode('utf-8').split('\n')
+        parents = [l.split()[1] for l in commit_headers if l.startswith('parent ')]
         assert len(parents) in (1, 2), "Commit should have 1 or 2 parents only."
         return parents
 
@@ -363,62 +1206,28 @@ class GitProxy(object):
 
     def touched_between(self, start_ref, end_ref):
         """
-        Return the lists of Added, Modified, Deleted, Renamed (etc...) files
-        between 2 references (commits, branches, tags).
+        Return the Added, Modified, Deleted, Renamed (etc...) files
+        between 2 references (commits, branches, tags), as a TouchedFiles object.
         """
         assert self.ref_exists(start_ref)
         assert self.ref_exists(end_ref)
-        git_cmd = ['git', 'diff', '--name-status', start_ref, end_ref]
-        asdict = {'A':set(), 'R':set(), 'M':set(), 'C':set(), 'T':set(),
-                  'D':set(),
-                  'U':set(), 'X':set(), 'B':set()}
-        touched = self._git_cmd(git_cmd)
-        for line in touched:
-            if line[0] in ('A', 'M', 'T', 'D'):
-                asdict[line[0]].add(line[2:].strip())
-            elif line[0] in ('C', 'R'):
-                asdict[line[0]].add(tuple(line.split()[1:3]))  # syntax: R file1 file2
-            else:
-                asdict[line[0]].add(line)  # FIXME: don't know how to interpret this
-        for k in list(asdict.keys()):
-            if len(asdict[k]) == 0:
-                asdict.pop(k)
-        return asdict
+        git_cmd = ['git', 'diff', '--raw', '--no-abbrev', '-z', start_ref, end_ref]
+        with self._git_stream(git_cmd, sep='\0', check=True) as tokens:
+            return TouchedFiles(FileChange.from_diff_z(tokens))
 
     @property
     def touched_since_last_commit(self):
         """
-        Return the lists of Added, Modified, Deleted, Renamed (etc...) files
-        since last commit.
-        """
-        git_cmd = ['git', 'status', '-s', '--porcelain']
-        touched = self._git_cmd(git_cmd)
-        asdict = {'A':set(), 'R':set(), 'M':set(), 'C':set(), 'T':set(),
-                  'D':set(),
-                  'U':set(), 'X':set(), 'B':set()}
-        for line in touched:
-            line = line.replace('??', 'A')
-            if line[0] in ('A', 'M', 'T', 'D'):
-                asdict[line[0]].add(line[2:].strip())
-            elif line[0] in ('C', 'R'):
-                asdict[line[0]].add(tuple(line.split()[1::2]))  # syntax: R99 file1 -> file2
-            else:
-                asdict[line[0]].add(line)  # FIXME: don't know how to interpret this
-        for k in list(asdict.keys()):
-            if len(asdict[k]) == 0:
-                asdict.pop(k)
-        return asdict
+        Return the Added, Modified, Deleted, Renamed (etc...) files
+        since last commit, as a TouchedFiles object.
+        """
+        git_cmd = ['git', 'status', '--porcelain', '-z']
+        with self._git_stream(git_cmd, sep='\0', check=True) as tokens:
+            return TouchedFiles(FileChange.from_status_z(tokens))
 
     def touched_files_since(self, ref):
         """Lists touched files since **ref** (commit or tag), including uncommited."""
-        uncommitted = self.touched_since_last_commit
-        touched = self.touched_between(ref, 'HEAD')
-        for k in uncommitted.keys():
-            if k in touched:
-                touched[k].update(uncommitted[k])
-            else:
-                touched[k] = uncommitted[k]
-        return touched
+        return self.touched_between(ref, 'HEAD').merged(self.touched_since_last_commit)
 
     def preview_merge(self, contrib_ref, target_ref, common_ancestor=None):
         """
@@ -434,35 +1243,21 @@ class GitProxy(object):
             print('Auto-determined common ancestor: {}'.format(common_ancestor))
         touched_in_contrib = self.touched_between(common_ancestor, contrib_ref)
         touched_in_target = self.touched_between(common_ancestor, target_ref)
-        potential_conflicts = {'{}/{}'.format(kc, kt):[]
-                               for kc in touched_in_contrib.keys()
-                               for kt in touched_in_target.keys()}
-        for kc in touched_in_contrib.keys():
-            for kt in touched_in_target.keys():
-                conflict_key = '{}/{}'.format(kc, kt)
-                if kc in ('A', 'M', 'T', 'D') and kt in ('A', 'M', 'T', 'D'):
-                    for f in touched_in_contrib[kc]:
-                        if f in touched_in_target[kt]:
-                            potential_conflicts[conflict_key].append(f)
-                elif kc in ('A', 'M', 'T', 'D') and kt in ('C', 'R'):
-                    for fc in touched_in_contrib[kc]:
-                        for ft in touched_in_target[kt]:
-                            if fc in ft:
-                                potential_conflicts[conflict_key].append((fc, ft))
-                elif kc in ('C', 'R') and kt in ('A', 'M', 'T', 'D'):
-                    for fc in touched_in_contrib[kc]:
-                        if fc[0] in touched_in_target or fc[0] in touched_in_target:
-                            potential_conflicts[conflict_key].append((fc, ft))
-                elif kc in ('C', 'R') and kt in ('C', 'R'):
-                    for fc in touched_in_contrib[kc]:
-                        for ft in touched_in_target[kt]:
-                            if not set(fc).isdisjoint(set(ft)):
-                                potential_conflicts[conflict_key].append((fc, ft))
-        for k in list(potential_conflicts.keys()):
-            if len(potential_conflicts[k]) == 0:
-                potential_conflicts.pop(k)
-            else:
-                potential_conflicts[k] = sorted(potential_conflicts[k])
+        potential_conflicts = {}
+        for kc, entries in touched_in_contrib.items():
+            for fc in entries:
+                paths = fc if kc in ('C', 'R') else (fc,)
+                for path in paths:
+                    for kt, ft in touched_in_target.changes_touching(path):
+                        if kc in ('C', 'R') or kt in ('C', 'R'):
+                            conflict = (fc, ft)
+                        else:
+                            conflict = fc
+                        conflicts = potential_conflicts.setdefault('{}/{}'.format(kc, kt), [])
+                        if conflict not in conflicts:
+                            conflicts.append(conflict)
+        for k in potential_conflicts.keys():
+            potential_conflicts[k] = sorted(potential_conflicts[k])
         return potential_conflicts
 
     def stage(self, filenames):
@@ -497,24 +1292,154 @@ class GitProxy(object):
                              overwrite=False):
         """
         Extract **filepath** from **git_ref** to a **destination** file, potentially outside the repo.
+        The blob is streamed byte for byte (binary-safe), without being held in memory.
 
         :param destination: can be a filename or an open IO such as sys.stdout
                             if '__tmp__' a temporary file is used, and returned
         :param overwrite: to allow overwriting of existing target file
         """
-        git_cmd = ['git', 'show', '{}:{}'.format(git_ref, filepath)]
-        f = self._git_cmd(git_cmd, strip=False)
+        git_cmd = ['git', 'cat-file', 'blob', '{}:{}'.format(git_ref, filepath)]
         if destination == '__tmp__':
-            destination = tempfile.mkstemp()[1]
+            fd, destination = tempfile.mkstemp()
+            os.close(fd)
         elif isinstance(destination, str) and os.path.exists(destination) and not overwrite:
             raise IOError("File '{}' already exists".format(destination))
         if isinstance(destination, str):
-            with io.open(destination, 'w') as out:
-                out.writelines([l + '\n' for l in f])
+            with io.open(destination, 'wb') as out:
+                # git writes directly into the destination file descriptor
+                returncode = subprocess.call(git_cmd, cwd=self.repository, stdout=out, stderr=subprocess.DEVNULL)
+            if returncode != 0:
+                os.remove(destination)
+                raise GitError("Unable to extract '{}' from '{}'".format(filepath, git_ref))
         else:
-            destination.writelines([l + '\n' for l in f])
+            out = self._binary_stream(destination)
+            p = subprocess.Popen(git_cmd, cwd=self.repository, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                for chunk in iter(lambda: p.stdout.read(GitBatchPipe.chunk_size), b''):
+                    out.write(chunk)
+            finally:
+                p.stdout.close()
+                p.wait()
+            out.flush()
+            if p.returncode != 0:
+                raise GitError("Unable to extract '{}' from '{}'".format(filepath, git_ref))
         return destination
 
+    def extract_files_from_to(self, git_ref, filepaths, destination_dir,
+                              overwrite=False):
+        """
+        Extract **filepaths** from **git_ref** into **destination_dir**, keeping their relative paths,
+        through a single `git cat-file --batch` session.
+
+        :param overwrite: to allow overwriting of existing target files
+        :return: dict {filepath: extracted file}
+        """
+        if not self.persistent_session:
+            extracted = {}
+            for filepath in filepaths:
+                destination = os.path.join(destination_dir, filepath)
+                os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+                extracted[filepath] = self.extract_file_from_to(git_ref, filepath, destination, overwrite=overwrite)
+            return extracted
+        pipe = self._batch_pipe('--batch')
+        tree = self._object_header(git_ref + '^{tree}')
+        if tree is None:
+            raise GitError("Unknown git reference: '{}'".format(git_ref))
+        extracted = {}
+        for filepath in filepaths:
+            destination = os.path.join(destination_dir, filepath)
+            if os.path.exists(destination) and not overwrite:
+                raise IOError("File '{}' already exists".format(destination))
+            header = self._object_header('{}:{}'.format(tree[0], filepath))
+            if header is None or header[1] != 'blob':
+                raise GitError("Unable to extract '{}' from '{}'".format(filepath, git_ref))
+            os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+            with io.open(destination, 'wb') as out:
+                pipe.read(header[0], out=out)
+            extracted[filepath] = destination
+        return extracted
+
+    def ls_tree(self, git_ref):
+        """
+        Generator of the entries of the tree of **git_ref** (recursively),
+        as (mode, type, object, path) tuples, read from `git ls-tree -r -z`.
+        """
+        git_cmd = ['git', 'ls-tree', '-r', '-z', '--full-tree', git_ref]
+        with self._git_stream(git_cmd, sep='\0', check=True) as entries:
+            for entry in entries:
+                if entry == '':
+                    continue
+                info, path = entry.split('\t', 1)
+                mode, otype, oid = info.split(' ')
+                yield (mode, otype, oid, path)
+
+    def export_tree(self, git_ref, destination_dir, exclude=None):
+        """
+        Write the tree of **git_ref** into **destination_dir**, straight from the object database:
+        the ref is not checked out and the working copy is left untouched.
+
+        :param exclude: function of the path of an entry, returning True if it is to be excluded
+        :return: statistics of the export (numbers of files, excluded entries, bytes written)
+        """
+        if self.persistent_session:
+            pipe = self._batch_pipe('--batch')
+        else:
+            pipe = GitBatchPipe(self.repository, '--batch')
+        stats = {'files':0, 'excluded':0, 'bytes':0}
+        try:
+            for mode, otype, oid, path in self.ls_tree(git_ref):
+                if exclude is not None and exclude(path):
+                    stats['excluded'] += 1
+                    continue
+                destination = os.path.join(destination_dir, path)
+                dirname = os.path.dirname(destination)
+                if not os.path.isdir(dirname) or os.path.islink(dirname):
+                    self._clear_parents(destination_dir, path)
+                    os.makedirs(dirname)
+                if otype == 'commit':  # submodule: empty directory, as after a checkout
+                    if not os.path.isdir(destination):
+                        os.makedirs(destination)
+                    continue
+                if os.path.isdir(destination) and not os.path.islink(destination):
+                    shutil.rmtree(destination)
+                elif os.path.lexists(destination):
+                    os.remove(destination)
+                if mode == '120000':  # symbolic link: contents is the target
+                    os.symlink(pipe.read(oid).decode('utf-8'), destination)
+                else:
+                    with io.open(destination, 'wb') as out:
+                        header = pipe.read(oid, out=out)
+                    if mode == '100755':
+                        os.chmod(destination, 0o755)
+                    stats['bytes'] += header[2]
+                stats['files'] += 1
+        finally:
+            if not self.persistent_session:
+                pipe.close()
+        return stats
+
+    @staticmethod
+    def _clear_parents(destination_dir, path):
+        """
+        Remove files or symbolic links left in **destination_dir** where the parent
+        directories of **path** are to be created (e.g. a file that became a directory).
+        """
+        parent = destination_dir
+        for component in path.split('/')[:-1]:
+            parent = os.path.join(parent, component)
+            if os.path.islink(parent) or (os.path.lexists(parent) and not os.path.isdir(parent)):
+                os.remove(parent)
+            elif not os.path.lexists(parent):
+                break
+
+    @staticmethod
+    def _binary_stream(stream):
+        """Binary layer of **stream**, flushing its text layer if any."""
+        if isinstance(stream, io.TextIOBase):
+            stream.flush()
+            return stream.buffer
+        return stream
+
     # Remotes ------------------------------------------------------------------
 
     @property
@@ -529,9 +1454,183 @@ class GitProxy(object):
     def remote_rename(self, source, target):
         print("{} : rename remote {} to {}".format(self.repository, source, target))
         self._git_cmd(['git', 'remote', 'rename', source, target])
+        self._invalidate_refs()
 
     def remote_rm(self, remote):
         self._git_cmd(['git', 'remote', 'rm', remote])
+        self._invalidate_refs()
+
+
+class WorktreePool(object):
+    """
+    Pool of detached `git worktree` of a repository, managed in a directory next to it
+    (<repository>.worktrees/ by default), so that several refs can be checked out concurrently
+    without touching the working copy of the repository.
+
+    Worktrees are leased exclusively (file locks, hence across processes and threads),
+    and idle ones are reset and reused rather than created anew.
+    """
+
+    def __init__(self, repository, pool_dir=None, max_worktrees=None, verbose=True):
+        """
+        :param repository: path to the git repository
+        :param pool_dir: directory in which to manage the worktrees
+        :param max_worktrees: maximum number of worktrees in pool (unlimited if None);
+                              when all are leased, wait for one to be released
+        """
+        self.repository = os.path.abspath(repository)
+        if pool_dir is None:
+            pool_dir = self.repository.rstrip(os.sep) + '.worktrees'
+        self.pool_dir = os.path.abspath(pool_dir)
+        self.max_worktrees = max_worktrees
+        self.verbose = verbose
+        self.git_proxy = GitProxy(self.repository)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<WorktreePool of '{}' in '{}'>".format(self.repository, self.pool_dir)
+
+    @contextmanager
+    def _locked(self):
+        """Context: exclusive access to the pool (threads and processes)."""
+        with self._lock:
+            os.makedirs(self.pool_dir, exist_ok=True)
+            with io.open(os.path.join(self.pool_dir, 'pool.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @property
+    def worktrees(self):
+        """Paths of the worktrees of the pool."""
+        if not os.path.isdir(self.pool_dir):
+            return []
+        return sorted([os.path.join(self.pool_dir, d) for d in os.listdir(self.pool_dir)
+                       if d.startswith('wt') and os.path.isdir(os.path.join(self.pool_dir, d))])
+
+    @staticmethod
+    def _try_lock(path):
+        """Try to lock worktree at **path**: return the open lock file if successful, else None."""
+        lock = io.open(path + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def _new_worktree_lock(self):
+        """
+        Path and lock of a new worktree, at the first free index: neither an existing worktree
+        (all leased, since called when none could be locked), nor a leased worktree whose
+        directory would have been removed.
+        """
+        existing = set(self.worktrees)
+        i = 0
+        while True:
+            path = os.path.join(self.pool_dir, 'wt{:03d}'.format(i))
+            if path not in existing:
+                lock = self._try_lock(path)
+                if lock is not None:
+                    return path, lock
+            i += 1
+
+    def lease(self, ref, poll_interval=5):
+        """
+        Lease a worktree of the pool, with **ref** checked out (detached).
+        The returned WorktreeLease is to be released (or used as a context).
+        """
+        commit = self.git_proxy.commit_of(ref)
+        while True:
+            fresh = False
+            with self._locked():
+                for path in self.worktrees:
+                    lock = self._try_lock(path)
+                    if lock is not None:
+                        break
+                else:
+                    path = None
+                    if self.max_worktrees is None or len(self.worktrees) < self.max_worktrees:
+                        path, lock = self._new_worktree_lock()
+                        try:
+                            self._add(path, commit)
+                        except Exception:
+                            lock.close()
+                            raise
+                        fresh = True
+            if path is not None:
+                break
+            time.sleep(poll_interval)
+        if not fresh:
+            try:
+                self._reset(path, commit)
+            except Exception:
+                lock.close()
+                raise
+        if self.verbose:
+            print("Worktree '{}' leased, at '{}' ({})".format(path, ref, commit))
+        return WorktreeLease(self, path, ref, commit, lock)
+
+    def _add(self, path, commit):
+        """Add a new worktree at **path**."""
+        self.git_proxy._git_cmd(['git', 'worktree', 'prune'])
+        self.git_proxy._git_cmd(['git', 'worktree', 'add', '--detach', path, commit],
+                                stderr=subprocess.DEVNULL)
+
+    def _reset(self, path, commit):
+        """Reset the (idle, locked) worktree at **path** to **commit**, discarding any change."""
+        if not os.path.exists(os.path.join(path, '.git')):  # worktree has been removed or is broken
+            with self._locked():
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+                self._add(path, commit)
+        worktree = GitProxy(path)
+        worktree._git_cmd(['git', 'checkout', '--force', '--detach', commit], stderr=subprocess.DEVNULL)
+        worktree._git_cmd(['git', 'reset', '--hard', '--quiet'])
+        worktree._git_cmd(['git', 'clean', '-ffdxq'])
+
+    def remove(self):
+        """Remove all idle worktrees of the pool."""
+        with self._locked():
+            for path in self.worktrees:
+                lock = self._try_lock(path)
+                if lock is not None:
+                    self.git_proxy._git_cmd(['git', 'worktree', 'remove', '--force', path])
+                    os.remove(path + '.lock')
+                    lock.close()
+            self.git_proxy._git_cmd(['git', 'worktree', 'prune'])
+
+
+class WorktreeLease(object):
+    """Exclusive lease of a worktree of a WorktreePool, to be released."""
+
+    def __init__(self, pool, path, ref, commit, lock):
+        self.pool = pool
+        self.path = path
+        self.ref = ref
+        self.commit = commit
+        self._lock = lock
+
+    def __repr__(self):
+        return "<WorktreeLease '{}' at '{}'{}>".format(self.path, self.ref, '' if self.active else ' (released)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    @property
+    def active(self):
+        return self._lock is not None
+
+    def release(self):
+        """Release the worktree, which remains in the pool to be reused."""
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
 
 
 class IALview(object):
@@ -548,11 +1647,14 @@ class IALview(object):
                  new_branch=False,
                  start_ref=None,
                  fetch=False,
-                 restore_initial_checkout_eventually=True):
+                 restore_initial_checkout_eventually=True,
+                 worktree_pool=None):
         """
         Hold **ref** from **repository**. If **ref** is None, takes the currently checked out ref.
 
         :param need_for_checkout: if False, do not checkout **ref** when initializing.
+                                  The view is then "checkout-free": its history and contents are
+                                  read from the git objects of **ref**, not from the working copy.
                                   WARNING: this is hazardous, a number of methods may not work !
                                   Better know what you are doing !
         :param remote: fetch ref from a remote
@@ -561,32 +1663,57 @@ class IALview(object):
         :param fetch: to fetch branch on remote or not
         :param restore_initial_checkout_eventually: when leaving (deleting the object), restore initially checkedout
                                                     state
+        :param worktree_pool: a WorktreePool of **repository**, from which to lease a worktree in which **ref**
+                              is checked out (detached), leaving the working copy of **repository** untouched.
+                              The worktree is released when the view is deleted (or by release_worktree()).
         """
         self.restore_initial_checkout_eventually = restore_initial_checkout_eventually
         self.repository = os.path.abspath(repository)
         self.git_proxy = GitProxy(self.repository)
+        self.checkout_free = not need_for_checkout
+        self.worktree = None
         if ref is None:
-            ref = self.git_proxy.currently_checkedout
+            head = self.git_proxy.resolve_ref('HEAD')
+            if head.head_branch is not None:
+                ref = head.head_branch
+            else:  # detached HEAD: as described by git (e.g. a tag)
+                ref = self.git_proxy.currently_checkedout
         self.ref = ref
         if fetch:
             self.git_proxy.fetch(remote=remote,
                                  ref=ref if remote is not None else None)
-        # initial state (to get back at the end)
-        self.initial_checkedout = self.git_proxy.currently_checkedout
+        # resolution of ref, and initial state (to get back at the end)
+        self.resolved = self.git_proxy.resolve_ref(ref)
+        self.initial_state = self.resolved
+        self.initial_checkedout = self.resolved.head
+        if worktree_pool is not None:
+            assert not new_branch, "Cannot create a new branch in a worktree of pool."
+            assert self.resolved.exists, "ref:'{}' does not exist in repository:'{}'".format(ref, self.repository)
+            self.worktree = worktree_pool.lease(self.resolved.full_name if self.resolved.kind == 'remote_branch'
+                                                else ref)
+            self.repository = self.worktree.path
+            self.git_proxy = GitProxy(self.repository)
+            self.resolved = self.resolved._replace(head_branch=None,
+                                                   head_commit=self.worktree.commit,
+                                                   dirty=False)
+            self.checkout_free = False
+            self.restore_initial_checkout_eventually = False
+            need_for_checkout = False
         # determine if need to checkout
+        resolved = self.resolved
         if need_for_checkout:
-            if self.git_proxy.ref_exists(ref):
+            if resolved.exists:
                 assert not new_branch, "ref: {} already exists, while **new_branch** is True.".format(ref)
-                if self.git_proxy.ref_is_branch(ref):
-                    need_for_checkout = (self.initial_checkedout != ref)
-                elif self.git_proxy.ref_is_tag(ref):
-                    if self.git_proxy.tag_points_to(ref) == self.git_proxy.latest_commit and self.git_proxy.is_clean:
+                if resolved.is_branch:
+                    need_for_checkout = (resolved.head_branch != ref)
+                elif resolved.is_tag:
+                    if resolved.commit == resolved.head_commit and resolved.is_clean:
                         # ref is a tag, HEAD points on same commit and working copy is clean
                         need_for_checkout = False
-                elif ref == 'HEAD':
+                elif resolved.kind == 'HEAD':
                     need_for_checkout = False
                 else:  # regular commit
-                    if self.git_proxy.latest_commit == ref:
+                    if resolved.commit == resolved.head_commit:
                         need_for_checkout = False
             else:
                 assert new_branch, ("ref:'{}' does not exist in repository:'{}'; ".format(ref, self.repository) +
@@ -594,43 +1721,58 @@ class IALview(object):
         # actual checkout if needed
         if need_for_checkout:
             # need to switch branch
-            assert self.git_proxy.is_clean, \
+            assert resolved.is_clean, \
                     "Repository: {} : working directory is not clean. Reset or commit changes manually.".format(self.repository)
             if new_branch:
                 assert start_ref is not None
                 self.git_proxy.checkout_new_branch(ref, start_ref)
             else:
-                if self.git_proxy.ref_is_branch(ref) and ref in self.git_proxy.detached_branches():
+                if resolved.kind == 'detached_branch':
                     #raise NotImplementedError("Checking out detached branch")
                     self.git_proxy.ref_checkout(ref)
-                elif self.git_proxy.ref_is_branch(ref) and ref not in self.git_proxy.local_branches:
+                elif resolved.kind == 'remote_branch':
                     # remote branch: need to checkout as new local branch
                     tracked = self.git_proxy.branch_as_detached(ref, remote)
                     print("Branch '{}' to be tracked as new branch from '{}'".format(ref, tracked))
                     self.git_proxy.checkout_new_branch(ref, tracked)
                 else:
                     self.git_proxy.ref_checkout(ref)
+            self.resolved = self.git_proxy.resolve_ref(ref)
 
     def __del__(self):
+        self.release_worktree()
         try:
-            if self.restore_initial_checkout_eventually and \
-               self.initial_checkedout not in (self.git_proxy.latest_commit, self.git_proxy.currently_checkedout):
-                # need to checkout back
-                if self.git_proxy.is_clean:
-                    self.git_proxy.ref_checkout(self.initial_checkedout)
-                else:
-                    print("! Warning ! Working directory is not clean at time of quiting the branch. Reset or commit changes manually.")
-                    print("(Unable to go back to previously checkedout state : {})".format(self.initial_checkedout))
+            if self.restore_initial_checkout_eventually:
+                current = self.git_proxy.resolve_ref('HEAD')
+                if self.initial_checkedout not in (current.head_commit, current.head_branch):
+                    # need to checkout back
+                    if current.is_clean:
+                        self.git_proxy.ref_checkout(self.initial_checkedout)
+                    else:
+                        print("! Warning ! Working directory is not clean at time of quiting the branch. Reset or commit changes manually.")
+                        print("(Unable to go back to previously checkedout state : {})".format(self.initial_checkedout))
         except Exception:
-            print("Unable to go back to previously checkedout state : {}".format(self.initial_checkedout))
+            print("Unable to go back to previously checkedout state : {}".format(getattr(self, 'initial_checkedout', None)))
+
+    def release_worktree(self):
+        """Release the worktree leased from a pool, if any."""
+        if getattr(self, 'worktree', None) is not None:
+            self.worktree.release()
 
     def info(self, out=sys.stdout):
         """Write info about the view."""
         info = ["-" * 50,
                 "*** View of ref: '{}' ***".format(self.ref),
-                self.git_proxy.log(['-1', '--decorate'])[0],
-                "Latest official tagged ancestor: " + self.latest_official_tagged_ancestor,
+                self.git_proxy.log(['-1', '--decorate'] + ([self.commit] if self.checkout_free else []))[0],
+                "Latest official tagged ancestor: " + self.context.latest_official_tagged_ancestor,
                 ]
+        if self.checkout_free:
+            info.extend(["Commit: " + self.commit,
+                         "(exported from git objects, without checkout)",
+                         "-" * 50])
+            for line in info:
+                out.write(line + '\n')
+            return
         touched_since_last_commit = self.git_proxy.touched_since_last_commit
         if len(touched_since_last_commit) > 0:
             info.extend(["Latest commit: " + self.git_proxy.latest_commit,
@@ -692,24 +1834,29 @@ class IALview(object):
     def tags_history(self):
         """Tags in chronological order in history of git_ref."""
         history = []
-        for t in self.git_proxy.tags_history(self.ref):
+        for t in self.git_proxy.tags_history(self.commit):
             history.extend(t)
         return history
 
     @property
     def official_tagged_ancestors(self):
         """All official tagged ancestors."""
+        return self.official_tagged_ancestors_of(self.git_proxy, self.commit)
+
+    @classmethod
+    def official_tagged_ancestors_of(cls, git_proxy, ref):
+        """All official tagged ancestors of **ref** in the repository of **git_proxy**."""
         official_tags = []
-        for tags in self.git_proxy.tags_between(self.first_tag, self.ref):
+        for tags in git_proxy.tags_between(cls.first_tag, ref):
             for tag in tags[::-1]:  # The latest is a priori the first one
-                if self._re_official_tags.match(tag):
+                if cls._re_official_tags.match(tag):
                     official_tags.append(tag)
         return official_tags
 
     @property
     def latest_tagged_ancestor(self):
         """Latest tagged ancestor."""
-        tags = self.git_proxy.tags_between(self.first_tag, self.ref)[-1]
+        tags = self.git_proxy.tags_between(self.first_tag, self.commit)[-1]
         return tags[0]
 
     @property
@@ -734,8 +1881,31 @@ class IALview(object):
         return self._re_official_tags.match(latest_official_tagged_ancestor).groupdict()
 
     # Content ------------------------------------------------------------------
+    @property
+    def context(self):
+        """
+        Immutable RefContext of the view (history walked once),
+        recomputed only if the commit pointed by the view has changed.
+        """
+        commit = self.commit
+        if getattr(self, '_context', None) is None or self._context.commit != commit:
+            self._context = RefContext.from_view(self)
+        return self._context
+
+    @property
+    def commit(self):
+        """
+        Commit pointed by the view; to be used rather than self.ref to read git objects,
+        since ref may be a branch known on a remote only.
+        """
+        if self.checkout_free:
+            return self.resolved.commit
+        return self.git_proxy.latest_commit
+
     def touched_files_since(self, ref):
         """Lists touched files since **ref** (commit or tag)."""
+        if self.checkout_free:
+            return self.git_proxy.touched_between(ref, self.commit)
         return self.git_proxy.touched_files_since(ref)
 
     @property
@@ -748,3 +1918,57 @@ class IALview(object):
         """Lists touched files since *self.latest_official_tagged_ancestor*."""
         return self.touched_files_since(self.latest_official_tagged_ancestor)
 
+
+class RefContext(collections.namedtuple('RefContext', ['repository', 'ref', 'commit',
+                                                        'official_tagged_ancestors', 'tags_history'])):
+    """
+    Immutable context of an IAL git reference, resolved once (history walk included)
+    and shared across the steps of a pack creation (naming, population...):
+
+    - repository: path to the IAL repository
+    - ref: the git reference
+    - commit: the commit pointed by ref
+    - official_tagged_ancestors: all official tagged ancestors, in chronological order
+    - tags_history: tags in chronological order in history of ref
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_view(cls, view):
+        """Build context from an IALview."""
+        return cls(view.repository,
+                   view.ref,
+                   view.commit,
+                   tuple(view.official_tagged_ancestors),
+                   tuple(view.tags_history))
+
+    @classmethod
+    def build(cls, repository, ref):
+        """Build context of **ref** in **repository** (without checkout)."""
+        return IALview(repository, ref, need_for_checkout=False).context
+
+    @property
+    def latest_official_tagged_ancestor(self):
+        """Latest official tagged ancestor."""
+        return self.official_tagged_ancestors[-1]
+
+    @property
+    def latest_official_ancestor_split(self):
+        """Parts of the latest official tagged ancestor (release, radical, version)."""
+        return types.MappingProxyType(
+            IAL_OFFICIAL_TAGS_re.match(self.latest_official_tagged_ancestor).groupdict())
+
+    @property
+    def latest_main_release_ancestor(self):
+        """Latest main release which is ancestor to the ref."""
+        for tag in self.official_tagged_ancestors[::-1]:  # start from latest one
+            if IAL_OFFICIAL_TAGS_re.match(tag).group('radical') is None:  # is it a main release
+                return tag
+
+    @property
+    def release_split(self):
+        """Parts of the ref name (cf. IALview.split_ref), or None if not conventional."""
+        try:
+            return types.MappingProxyType(IALview.split_ref(self.ref))
+        except SyntaxError:
+            return None
@@ -8,12 +8,23 @@ Utilities for IAL source code management.
 """
 
 import os
+import io
+import re
+import sys
+import errno
+import hashlib
+import filecmp
+import fcntl
 import shutil
+import tempfile
 import socket
 import subprocess
 import datetime
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from .config import hosts_re
+from .config import hosts_re, POPULATE_WORKERS, POPULATE_COPY_MODE
 
 
 def now(strftime_fmt="%Y%m%dT%H%M"):
@@ -27,16 +38,199 @@ def host_name():
             return host
 
 
-def copy_files_in_cwd(list_of_files, originary_directory_abspath):
-    """Copy a bunch of files from an originary directory to the cwd."""
+def git_blob_sha(path):
+    """SHA of the git blob of the contents of file at **path** (as `git hash-object`)."""
+    sha = hashlib.sha1('blob {}\0'.format(os.path.getsize(path)).encode('utf-8'))
+    with io.open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def same_file_contents(src, dst, blob=None):
+    """
+    Whether file **dst** has the same contents as **src**: same size and then
+    same inode, or same modification time (as left by a copy with copystat), or same contents
+    (compared to the git blob **blob** of **src** contents, if known).
+    """
+    try:
+        s = os.stat(src)
+        d = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    if s.st_size != d.st_size:
+        return False
+    if (s.st_dev, s.st_ino) == (d.st_dev, d.st_ino) or s.st_mtime_ns == d.st_mtime_ns:
+        return True
+    if blob is not None:
+        return git_blob_sha(dst) == blob
+    return filecmp.cmp(src, dst, shallow=False)
+
+
+def copy_files(list_of_files, originary_directory_abspath, destination_directory_abspath,
+               copier=None, sync=False, blobs=None):
+    """
+    Copy a bunch of files (relative paths) from an originary directory to a destination directory.
+
+    :param copier: a ZeroCopier to copy files with, if not plain copies
+    :param sync: only copy the files which contents differ (cf. same_file_contents),
+        leaving the others (and their modification times) untouched
+    :param blobs: with **sync**, {path: SHA of the git blob of the file contents} if known,
+        so that only the destination files need being read to compare
+    :return: numbers of files {'copied':..., 'skipped':...}
+    """
+    counts = {'copied':0, 'skipped':0}
     for f in list_of_files:
-        dirpath = os.path.dirname(os.path.abspath(f))
+        src = os.path.join(originary_directory_abspath, f)
+        dst = os.path.join(destination_directory_abspath, f)
+        if sync and same_file_contents(src, dst, blob=(blobs or {}).get(f)):
+            counts['skipped'] += 1
+            continue
+        counts['copied'] += 1
+        dirpath = os.path.dirname(dst)
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
-        shutil.copyfile(os.path.join(originary_directory_abspath, f), f,
+        if copier is not None:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            copier.copy_file(os.path.realpath(src), dst)
+            continue
+        shutil.copyfile(src, dst,
                         follow_symlinks=True)
-        shutil.copystat(os.path.join(originary_directory_abspath, f), f,
+        shutil.copystat(src, dst,
                         follow_symlinks=True)
+    return counts
+
+
+def copy_files_in_cwd(list_of_files, originary_directory_abspath, copier=None, sync=False, blobs=None):
+    """
+    Copy a bunch of files from an originary directory to the cwd (cf. copy_files).
+    """
+    return copy_files(list_of_files, originary_directory_abspath, os.getcwd(),
+                      copier=copier, sync=sync, blobs=blobs)
+
+
+class _ThreadsStdout(object):
+
+    def __init__(self, stdout):
+        """Proxy of sys.stdout, writing the output of threads to their own buffer, if any."""
+        self.stdout = stdout
+        self.local = threading.local()
+        self.users = 0
+
+    def _target(self):
+        buffer = getattr(self.local, 'buffer', None)
+        return self.stdout if buffer is None else buffer
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
+_threads_stdout_lock = threading.Lock()
+
+
+@contextmanager
+def captured_output():
+    """
+    Context: the output printed by the current thread is captured into the yielded buffer (io.StringIO),
+    so that the outputs of concurrent threads can be printed as blocks, rather than interleaved.
+    """
+    with _threads_stdout_lock:
+        if not isinstance(sys.stdout, _ThreadsStdout):
+            sys.stdout = _ThreadsStdout(sys.stdout)
+        proxy = sys.stdout
+        proxy.users += 1
+    buffer = io.StringIO()
+    proxy.local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        proxy.local.buffer = None
+        with _threads_stdout_lock:
+            proxy.users -= 1
+            if proxy.users == 0 and sys.stdout is proxy:
+                sys.stdout = proxy.stdout
+
+
+class PathFilter(object):
+
+    _wildcards_re = re.compile(r'[*?\[]')
+
+    def __init__(self, patterns):
+        """
+        Compiled filter of paths, from a list of **patterns**: relative paths, possibly with wildcards
+        (*, ?, [...]) matching within a path component and not matching a leading dot, as with glob.
+        A path is filtered if it, or one of its parent directories, matches a pattern.
+
+        Literal patterns are stored in a trie of path components,
+        patterns with wildcards are combined in a single regular expression.
+        """
+        self.trie = {}
+        wildcarded = []
+        for p in patterns:
+            parts = [c for c in os.path.normpath(p).split(os.sep) if c not in ('', '.')]
+            if len(parts) == 0 or '..' in parts:  # not within the root
+                continue
+            if any([self._wildcards_re.search(c) for c in parts]):
+                wildcarded.append([self._translate(c) for c in parts])
+            else:
+                node = self.trie
+                for c in parts:
+                    node = node.setdefault(c, {})
+                node[None] = True  # end of a pattern
+        self._regex = None
+        if wildcarded:
+            self._regex = re.compile('(?:{})(?:/|$)'.format('|'.join(['/'.join(parts) for parts in wildcarded])))
+
+    @staticmethod
+    def _translate(component):
+        """Regular expression for a path **component** pattern."""
+        regex = '' if component.startswith('.') else '(?!\\.)'
+        i = 0
+        while i < len(component):
+            c = component[i]
+            i += 1
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[':
+                j = i
+                if j < len(component) and component[j] == '!':
+                    j += 1
+                if j < len(component) and component[j] == ']':
+                    j += 1
+                j = component.find(']', j)
+                if j < 0:  # unclosed: literal
+                    regex += '\\['
+                else:
+                    chars = re.sub(r'([\\\[&~|])', r'\\\1', component[i:j])  # no set operations
+                    if chars.startswith('!'):
+                        chars = '^' + chars[1:]
+                    elif chars.startswith('^'):
+                        chars = '\\' + chars
+                    regex += '[{}]'.format(chars)
+                    i = j + 1
+            else:
+                regex += re.escape(c)
+        return regex
+
+    def matches(self, path):
+        """Whether **path** (relative, '/'-separated) is filtered."""
+        node = self.trie
+        for c in path.split('/'):
+            node = node.get(c)
+            if node is None:
+                break
+            if None in node:
+                return True
+        return self._regex is not None and self._regex.match(path) is not None
 
 
 class DirectoryFiltering(object):
@@ -52,27 +246,20 @@ class DirectoryFiltering(object):
         for f in filter_list:
             if not os.path.isabs(f):
                 f = os.path.join(self.abspath, f)
-            self.abspaths_to_be_ignored.append(os.path.join(self.abspath, f))
+            self.abspaths_to_be_ignored.append(f)
+        self.path_filter = PathFilter([os.path.relpath(f, self.abspath) for f in self.abspaths_to_be_ignored])
         self._filter_function = self._generate_filter_function()
 
     def _generate_filter_function(self):
         """
         Generate filter function for copytree **ignore** argument,
-        from a list of absolute paths to be ignored.
+        from the filter of paths to be ignored.
         """
         def ignore(src, names):
-            # absolute paths of files to be ignored in origin directory
-            ignored_names = []
-            for f in names:
-                abs_f = os.path.join(src, f)
-                for path in self.abspaths_to_be_ignored:
-                    if abs_f == path:  # exact file
-                        ignored_names.append(f)
-                        break
-                    elif os.path.join(path, '') in abs_f:  # the subdirectory is to be ignored
-                        ignored_names.append(f)
-                        break
-            return ignored_names
+            # paths relative to origin directory
+            src = os.path.relpath(src, self.abspath)
+            prefix = '' if src == '.' else src.replace(os.sep, '/') + '/'
+            return [f for f in names if self.path_filter.matches(prefix + f)]
         return ignore
 
     def copytree(self, dst, symlinks=False):
@@ -80,3 +267,285 @@ class DirectoryFiltering(object):
                         symlinks=symlinks,
                         ignore=self._filter_function)
 
+
+class ParallelRsync(object):
+
+    def __init__(self, workers=None, verbose=True, copier=None):
+        """
+        Copy directory trees with concurrent `rsync -a` processes
+        (or with a ZeroCopier **copier**, if given).
+
+        Subprojects (directories) are split into their entries, one level down,
+        so that large ones are spread across workers;
+        the attributes of split directories are set once their contents are copied,
+        so that the output tree is the same as with a single `rsync -a`.
+
+        :param workers: number of concurrent rsync processes; defaults to config.POPULATE_WORKERS
+                        (env var IAL_BUILD_POPULATE_WORKERS), to be sized for the filesystem
+        """
+        if workers is None:
+            workers = POPULATE_WORKERS
+        self.workers = max(1, workers)
+        self.verbose = verbose
+        self.copier = copier
+        self.stats = {}  # {worker: {'tasks':..., 'files':..., 'bytes':...}}
+        self._lock = threading.Lock()
+
+    def plan(self, src_dir, names, dst_dir, exclude=()):
+        """
+        Plan the copy of entries **names** of **src_dir** into **dst_dir**.
+
+        :param exclude: paths (relative to **src_dir**) not to be copied
+        :return: (tasks, split directories), tasks being (sources, destination directory)
+        """
+        tasks = []
+        split = []
+        loose_files = []
+        for name in names:
+            if name in exclude:
+                continue
+            src = os.path.join(src_dir, name)
+            if os.path.isdir(src) and not os.path.islink(src):
+                entries = [e for e in sorted(os.listdir(src)) if os.path.join(name, e) not in exclude]
+                subdirs = [os.path.join(src, e) for e in entries
+                           if os.path.isdir(os.path.join(src, e)) and not os.path.islink(os.path.join(src, e))]
+                files = [os.path.join(src, e) for e in entries if os.path.join(src, e) not in subdirs]
+                tasks.extend([([d], os.path.join(dst_dir, name)) for d in subdirs])
+                if files:
+                    tasks.append((files, os.path.join(dst_dir, name)))
+                split.append((src, dst_dir))
+            else:
+                loose_files.append(src)
+        if loose_files:
+            tasks.append((loose_files, dst_dir))
+        return tasks, split
+
+    def _rsync(self, task, src_dir, exclude):
+        sources, dst_dir = task
+        files = 0
+        size = 0
+        # excluded paths within the sources of the task
+        parent = os.path.dirname(sources[0])
+        excluded = [os.path.relpath(os.path.join(src_dir, p), parent) for p in exclude
+                    if any([os.path.join(src_dir, p).startswith(s + os.sep) for s in sources])]
+        if self.copier is not None:
+            excluded = set(excluded)
+
+            def ignore(d, names):
+                return [n for n in names if os.path.relpath(os.path.join(d, n), parent) in excluded]
+            for src in sources:
+                dst = os.path.join(dst_dir, os.path.basename(src))
+                if os.path.isdir(src) and not os.path.islink(src):
+                    n, b = self.copier.copytree(src, dst, ignore=ignore)
+                    files += n
+                    size += b
+                else:
+                    self.copier.copy_file(src, dst)
+                    files += 1
+                    size += os.lstat(src).st_size
+        else:
+            cmd = ['rsync', '-a', '--out-format=%l %n']
+            if excluded:
+                # anchored at the root of the transfer (the parent of sources); wildcards escaped
+                with tempfile.NamedTemporaryFile('w', prefix='rsync_exclude', delete=False) as f:
+                    f.writelines(['/' + re.sub(r'([*?\[\\])', r'\\\1', p) + '\n' for p in excluded])
+                cmd.append('--exclude-from=' + f.name)
+            try:
+                out = subprocess.check_output(cmd + sources + [dst_dir + os.sep])
+            finally:
+                if excluded:
+                    os.remove(f.name)
+            for line in out.decode('utf-8', errors='replace').splitlines():
+                length, _, name = line.partition(' ')
+                if not name.endswith('/'):  # directories are reported with a trailing /
+                    files += 1
+                    size += int(length) if length.isdigit() else 0
+        worker = threading.current_thread().name
+        with self._lock:
+            stats = self.stats.setdefault(worker, {'tasks':0, 'files':0, 'bytes':0})
+            stats['tasks'] += 1
+            stats['files'] += files
+            stats['bytes'] += size
+
+    def copy(self, src_dir, names, dst_dir, exclude=None):
+        """
+        Copy entries **names** of **src_dir** into **dst_dir** (as `rsync -a src_dir/name dst_dir/` each).
+
+        :param exclude: paths (relative to **src_dir**) not to be copied
+        :return: totals {'tasks':..., 'files':..., 'bytes':...}
+        """
+        exclude = set(exclude or ())
+        tasks, split = self.plan(src_dir, names, dst_dir, exclude=exclude)
+        for src, parent in split:
+            os.makedirs(os.path.join(parent, os.path.basename(src)), exist_ok=True)
+        # largest first: whole subdirectories before groups of files
+        tasks.sort(key=lambda t: (len(t[0]) > 1 or not os.path.isdir(t[0][0]),))
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(tasks))),
+                                thread_name_prefix='rsync') as executor:
+            list(executor.map(lambda t: self._rsync(t, src_dir, exclude), tasks))
+        # attributes of split directories, now that their contents are there
+        for src, parent in split:
+            if self.copier is not None:
+                shutil.copystat(src, os.path.join(parent, os.path.basename(src)))
+            else:
+                subprocess.check_call(['rsync', '-lptgoD', '--dirs', src, parent + os.sep])
+        totals = {k:sum([s[k] for s in self.stats.values()]) for k in ('tasks', 'files', 'bytes')}
+        if self.verbose:
+            for worker, s in sorted(self.stats.items()):
+                print("  {}: {} tasks, {} files, {} bytes".format(worker, s['tasks'], s['files'], s['bytes']))
+        return totals
+
+
+class ZeroCopier(object):
+
+    modes = ('copy', 'reflink', 'hardlink', 'auto')
+    FICLONE = 0x40049409  # ioctl: _IOW(0x94, 9, int), linux/fs.h
+
+    def __init__(self, mode=None, hardlinks=True):
+        """
+        Copy files sharing their contents with the source where the filesystem allows it:
+
+        - 'copy': plain copies
+        - 'reflink': copy-on-write clones (ioctl FICLONE: XFS, Btrfs...), else `copy_file_range`
+          (which may share or offload the copy), else plain copies
+        - 'hardlink': hardlinks (for files never written), else as 'reflink'
+        - 'auto': 'hardlink' if **hardlinks** are allowed, else 'reflink'
+
+        Metadata are preserved as with `shutil.copy2`, except for hardlinks which share them.
+        Fallbacks are detected once: after a failure of a method on a (source device, destination device),
+        it is not tried again for them.
+
+        :param mode: among self.modes, defaults to config.POPULATE_COPY_MODE (env var IAL_BUILD_POPULATE_COPY_MODE)
+        :param hardlinks: whether hardlinks are allowed (i.e. the copied files will never be written),
+                          else 'hardlink' falls back to 'reflink'
+        """
+        if mode is None:
+            mode = POPULATE_COPY_MODE
+        assert mode in self.modes, "Unknown copy mode: '{}', must be among {}".format(mode, self.modes)
+        self.mode = mode
+        self.hardlinks = hardlinks
+        self._unsupported = set()  # {(method, src device, dst device)}
+        self._lock = threading.Lock()
+        self.stats = {'files':0, 'logical_bytes':0, 'written_bytes':0,
+                      'hardlink':0, 'reflink':0, 'copy_file_range':0, 'copy':0}
+
+    @property
+    def methods(self):
+        """Methods to be tried, in order."""
+        if self.mode == 'copy':
+            return ['copy']
+        elif self.mode in ('hardlink', 'auto') and self.hardlinks:
+            return ['hardlink', 'reflink', 'copy_file_range', 'copy']
+        else:
+            return ['reflink', 'copy_file_range', 'copy']
+
+    def probe(self, src_dir, dst_dir):
+        """Detect which methods are supported from **src_dir** to **dst_dir**: {method: bool}."""
+        supported = {'copy':True}
+        same_device = os.stat(src_dir).st_dev == os.stat(dst_dir).st_dev
+        supported['hardlink'] = same_device
+        supported['copy_file_range'] = hasattr(os, 'copy_file_range')
+        # reflinks: between files of the destination filesystem (and same device for sources)
+        fd_a, a = tempfile.mkstemp(dir=dst_dir, prefix='.probe')
+        fd_b, b = tempfile.mkstemp(dir=dst_dir, prefix='.probe')
+        try:
+            os.write(fd_a, b'probe')
+            fcntl.ioctl(fd_b, self.FICLONE, fd_a)
+            supported['reflink'] = same_device
+        except OSError:
+            supported['reflink'] = False
+        finally:
+            os.close(fd_a)
+            os.close(fd_b)
+            os.remove(a)
+            os.remove(b)
+        return supported
+
+    def _try(self, method, src, dst, devices):
+        if (method, ) + devices in self._unsupported:
+            return False
+        try:
+            if method == 'hardlink':
+                os.link(src, dst)
+            elif method == 'reflink':
+                with io.open(src, 'rb') as fsrc, io.open(dst, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), self.FICLONE, fsrc.fileno())
+            elif method == 'copy_file_range':
+                size = os.stat(src).st_size
+                with io.open(src, 'rb') as fsrc, io.open(dst, 'wb') as fdst:
+                    copied = 0
+                    while copied < size:
+                        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                        if n == 0:
+                            break
+                        copied += n
+            else:
+                shutil.copyfile(src, dst)
+        except (OSError, AttributeError) as e:
+            if method != 'hardlink' and os.path.exists(dst):
+                os.remove(dst)
+            if method == 'copy':
+                raise
+            if isinstance(e, AttributeError) or e.errno in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY,
+                                                             errno.EINVAL, errno.ENOSYS, errno.EPERM,
+                                                             errno.EMLINK):
+                with self._lock:
+                    self._unsupported.add((method, ) + devices)
+                return False
+            raise
+        return True
+
+    def copy_file(self, src, dst):
+        """Copy file **src** to **dst** (symlinks are copied as symlinks), return the method used."""
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return 'symlink'
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        size = os.stat(src).st_size
+        for method in self.methods:
+            if self._try(method, src, dst, devices):
+                break
+        if method != 'hardlink':
+            shutil.copystat(src, dst)
+        with self._lock:
+            self.stats['files'] += 1
+            self.stats[method] += 1
+            self.stats['logical_bytes'] += size
+            if method in ('copy', 'copy_file_range'):  # copy_file_range may share, but who knows
+                self.stats['written_bytes'] += size
+        return method
+
+    def copytree(self, src, dst, ignore=None):
+        """
+        Copy directory tree **src** into **dst** (which may preexist), as `shutil.copytree(symlinks=True)`.
+
+        :param ignore: as in `shutil.copytree`
+        :return: number of files copied, and their size
+        """
+        files = 0
+        size = 0
+        names = os.listdir(src)
+        ignored = ignore(src, names) if ignore is not None else set()
+        os.makedirs(dst, exist_ok=True)
+        for name in names:
+            if name in ignored:
+                continue
+            s = os.path.join(src, name)
+            d = os.path.join(dst, name)
+            if os.path.isdir(s) and not os.path.islink(s):
+                n, b = self.copytree(s, d, ignore=ignore)
+                files += n
+                size += b
+            else:
+                self.copy_file(s, d)
+                files += 1
+                size += os.lstat(s).st_size
+        shutil.copystat(src, dst)
+        return files, size
+
+    def report(self):
+        """Human-readable report of what has been copied, and how."""
+        methods = ', '.join(['{} {}'.format(self.stats[m], m) for m in ('hardlink', 'reflink', 'copy_file_range', 'copy')
+                             if self.stats[m] > 0])
+        return "{} files, {} bytes populated, {} bytes actually written ({})".format(
+            self.stats['files'], self.stats['logical_bytes'], self.stats['written_bytes'], methods or '-')
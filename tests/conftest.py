@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+
+import pytest
+
+
+def git(repository, *args):
+    """Run a git command in **repository**, return its stripped output."""
+    return subprocess.check_output(['git'] + list(args), cwd=repository).decode('utf-8').strip()
+
+
+def commit_file(repository, path, contents, message=None):
+    """Write **contents** in **path** of **repository**, and commit it."""
+    abspath = os.path.join(repository, path)
+    os.makedirs(os.path.dirname(abspath), exist_ok=True)
+    with open(abspath, 'w') as f:
+        f.write(contents)
+    git(repository, 'add', path)
+    git(repository, 'commit', '--quiet', '-m', message or path)
+    return git(repository, 'rev-parse', 'HEAD')
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch, tmp_path):
+    """Git identity and config independent of the user's."""
+    monkeypatch.setenv('GIT_AUTHOR_NAME', 'Test')
+    monkeypatch.setenv('GIT_AUTHOR_EMAIL', 'test@example.com')
+    monkeypatch.setenv('GIT_COMMITTER_NAME', 'Test')
+    monkeypatch.setenv('GIT_COMMITTER_EMAIL', 'test@example.com')
+    monkeypatch.setenv('GIT_CONFIG_GLOBAL', str(tmp_path / 'gitconfig'))
+    monkeypatch.setenv('GIT_CONFIG_NOSYSTEM', '1')
+
+
+@pytest.fixture
+def repository(tmp_path):
+    """An empty git repository."""
+    path = str(tmp_path / 'repo')
+    os.makedirs(path)
+    git(path, 'init', '--quiet', '--initial-branch', 'main')
+    return path
+
+
+def make_pack(homepack, copy_mode=None, incremental=False):
+    """A preexisting (main, unless **incremental**) pack in **homepack**, as if created by gmkpack."""
+    from ial_build.pygmkpack import Pack
+    packname = 'CY50T1_main.00.GNU.x'
+    abspath = os.path.join(homepack, packname)
+    for d in ('src/local', 'hub/local/src'):
+        os.makedirs(os.path.join(abspath, d))
+    with open(os.path.join(abspath, '.genesis'), 'w') as f:
+        f.write('gmkpack {} -r 50t1 -b main -l GNU -o x -p masterodb\n'.format('-v 00' if incremental else '-a'))
+    with open(os.path.join(abspath, 'hub', '.gmkview'), 'w') as f:
+        f.write('main')
+    return Pack(packname, homepack=homepack, copy_mode=copy_mode)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.bundle.IALBundle: download of projects from local origins, snapshots of their repositories.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from ial_build.bundle import IALBundle
+from ial_build.repositories import RefContext
+
+from conftest import git, commit_file
+
+
+def make_origin(path, tags):
+    """Repository in **path**, with a commit per tag of **tags**."""
+    os.makedirs(path)
+    git(path, 'init', '--quiet', '--initial-branch', 'main')
+    for tag in tags:
+        commit_file(path, 'src/{}.F90'.format(tag), tag + '\n')
+        git(path, 'tag', tag)
+    return path
+
+
+def write_bundle(path, projects):
+    """Bundle file with **projects**: {name: {attribute: value}}."""
+    with open(path, 'w') as f:
+        f.write('name : test-bundle\nprojects :\n')
+        for name, config in projects.items():
+            f.write('    - {} :\n'.format(name))
+            for k, v in config.items():
+                f.write('        {} : {}\n'.format(k, v))
+    return path
+
+
+@pytest.fixture
+def origins(tmp_path):
+    """Origin repositories: IAL (CY38, CY49, CY50T1), and two other projects."""
+    return {'IAL':make_origin(str(tmp_path / 'origins' / 'IAL'), ['CY38', 'CY49', 'CY50T1']),
+            'ecbuild':make_origin(str(tmp_path / 'origins' / 'ecbuild'), ['3.7.0', '3.8.0']),
+            'fckit':make_origin(str(tmp_path / 'origins' / 'fckit'), ['0.10.0', '0.11.0'])}
+
+
+@pytest.fixture
+def bundle_file(origins, tmp_path):
+    return write_bundle(str(tmp_path / 'bundle.yml'),
+                        {'IAL':{'git':origins['IAL'], 'version':'CY50T1'},
+                         'ecbuild':{'git':origins['ecbuild'], 'version':'3.8.0'},
+                         'fckit':{'git':origins['fckit'], 'version':'0.10.0'},
+                         'local_dir':{'dir':os.path.join(origins['ecbuild'], 'src')}})
+
+
+@pytest.fixture
+def downloaded(bundle_file, tmp_path):
+    bundle = IALBundle(bundle_file)
+    bundle.download(src_dir=str(tmp_path / 'cache'))
+    yield bundle
+    bundle.release_cache()
+
+
+# Snapshots --------------------------------------------------------------------
+
+def test_snapshot(downloaded, origins):
+    snapshot = downloaded.snapshot()
+    assert snapshot.projects['ecbuild'].commit == git(origins['ecbuild'], 'rev-parse', '3.8.0')
+    assert snapshot.tags_history == {'IAL':['CY38', 'CY49', 'CY50T1'],
+                                     'ecbuild':['3.7.0', '3.8.0'],
+                                     'fckit':['0.10.0']}
+
+
+def test_snapshot_dir_project_within_repository(downloaded, origins):
+    # not a repository on its own: version from the enclosing one, no git queries
+    project = downloaded.snapshot().projects['local_dir']
+    assert project.version == git(origins['ecbuild'], 'rev-parse', 'HEAD')[:8]
+    assert (project.commit, project.tags_history) == (None, None)
+
+
+def test_IAL_tags_history_at_its_commit(bundle_file, origins, tmp_path):
+    # context of another IAL commit than the bundle's: not to be taken for the bundle's
+    context = RefContext.build(origins['IAL'], 'CY49')
+    bundle = IALBundle(bundle_file, IAL_ref_context=context)
+    bundle.download(src_dir=str(tmp_path / 'cache'))
+    assert bundle.snapshot().tags_history['IAL'] == ['CY38', 'CY49', 'CY50T1']
+    context = RefContext.build(origins['IAL'], 'CY50T1')
+    bundle = IALBundle(bundle_file, IAL_ref_context=context)
+    bundle.download(src_dir=str(tmp_path / 'cache'))
+    assert bundle.snapshot().tags_history['IAL'] == list(context.tags_history)
+
+
+def test_concurrent_snapshots(downloaded):
+    expected = downloaded.snapshot().tags_history
+    downloaded._tags_histories.clear()
+    results = []
+    def snapshot():
+        results.append(downloaded.snapshot(threads=4).tags_history)
+    threads = [threading.Thread(target=snapshot) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [expected] * 4
+    assert sorted(downloaded._tags_histories.keys()) == sorted([(p, downloaded.snapshot().projects[p].commit)
+                                                                 for p in ('ecbuild', 'fckit')])
+
+
+# Downloads --------------------------------------------------------------------
+
+def test_download_timings(bundle_file, tmp_path):
+    bundle = IALBundle(bundle_file)
+    timings = bundle.download(src_dir=str(tmp_path / 'cache'))
+    bundle.release_cache()
+    assert sorted(timings.keys()) == ['IAL', 'ecbuild', 'fckit', 'local_dir']
+    assert all([isinstance(t, float) and t > 0 for t in timings.values()])
+    assert os.path.islink(os.path.join(str(tmp_path / 'cache'), 'local_dir'))
+    # then at their locked commits: no download
+    bundle = IALBundle(bundle_file)
+    timings = bundle.download(src_dir=str(tmp_path / 'cache'))
+    bundle.release_cache()
+    assert timings == {'IAL':0., 'ecbuild':0., 'fckit':0., 'local_dir':0.}
+
+
+@pytest.mark.parametrize('per_host', [1, 2])
+def test_downloads_per_host(bundle_file, tmp_path, monkeypatch, per_host):
+    monkeypatch.setattr('ial_build.bundle.BUNDLE_DOWNLOADS_PER_HOST', per_host)
+    bundle = IALBundle(bundle_file)
+    download_project = bundle._download_project
+    running = []
+    concurrency = []
+    lock = threading.Lock()
+    def tracked(*args, **kwargs):
+        with lock:
+            running.append(1)
+            concurrency.append(len(running))
+        try:
+            time.sleep(0.2)
+            return download_project(*args, **kwargs)
+        finally:
+            with lock:
+                running.pop()
+    monkeypatch.setattr(bundle, '_download_project', tracked)
+    bundle.download(src_dir=str(tmp_path / 'cache'), threads=4)  # all from localhost
+    bundle.release_cache()
+    assert max(concurrency) == per_host
+
+
+def test_cache_maintained_after_download(bundle_file, tmp_path, monkeypatch):
+    from ial_build.cache import BundleCache
+    cache = BundleCache(str(tmp_path / 'cache'), verbose=False)
+    os.makedirs(os.path.join(cache.cache_dir, 'stale'))
+    cache.record('stale', last_used=1000.)
+    gcs = []
+    git_gc = BundleCache._git_gc
+    monkeypatch.setattr(BundleCache, '_git_gc', lambda self, name, auto=True: gcs.append((name, auto)) or
+                        git_gc(self, name, auto))
+    monkeypatch.setattr('ial_build.cache.BUNDLE_CACHE_BUDGET', '1')
+    bundle = IALBundle(bundle_file)
+    bundle.download(src_dir=cache.cache_dir)
+    # gc in the downloaded repositories, eviction of the others within budget
+    assert sorted(gcs) == [('IAL', True), ('ecbuild', True), ('fckit', True)]
+    assert cache.entries == ['IAL', 'ecbuild', 'fckit', 'local_dir']
+    bundle.release_cache()
+
+def test_origin_host():
+    assert IALBundle.origin_host('https://user@github.com:443/ACCORD-NWP/IAL.git') == 'github.com'
+    assert IALBundle.origin_host('git@github.com:ACCORD-NWP/IAL.git') == 'github.com'
+    assert IALBundle.origin_host('ssh://git@host.example.org/IAL.git') == 'host.example.org'
+    assert IALBundle.origin_host('file:///home/user/IAL') == 'localhost'
+    assert IALBundle.origin_host('/home/user/IAL') == 'localhost'
+
+
+def test_download_threads(monkeypatch):
+    monkeypatch.setattr('ial_build.bundle.BUNDLE_DOWNLOAD_THREADS', 8)
+    assert IALBundle.download_threads(1) == 1
+    assert 1 <= IALBundle.download_threads(3) <= 3
+    assert IALBundle.download_threads(100) <= 8
+
+
+# Lockfile ---------------------------------------------------------------------
+
+def test_lockfile(downloaded, origins):
+    locked = downloaded._read_lockfile()
+    assert locked['ecbuild'] == {'version':'3.8.0', 'commit':git(origins['ecbuild'], 'rev-parse', '3.8.0'),
+                                 'immutable':True}
+    assert 'local_dir' not in locked  # not a git project
+
+
+def test_branch_version_always_downloaded(origins, tmp_path):
+    bundle_file = write_bundle(str(tmp_path / 'bundle.yml'),
+                               {'IAL':{'git':origins['IAL'], 'version':'CY50T1'},
+                                'fckit':{'git':origins['fckit'], 'version':'main'}})
+    for _ in range(2):
+        bundle = IALBundle(bundle_file)
+        timings = bundle.download(src_dir=str(tmp_path / 'cache'))
+        bundle.release_cache()
+    assert timings['IAL'] == 0. and timings['fckit'] > 0.  # may have moved on remote
+    assert bundle._read_lockfile()['fckit']['immutable'] is False
+
+
+def test_moved_in_cache_downloaded_again(bundle_file, origins, tmp_path):
+    cache = str(tmp_path / 'cache')
+    IALBundle(bundle_file).download(src_dir=cache)
+    git(os.path.join(cache, 'ecbuild'), 'checkout', '--quiet', '3.7.0')
+    bundle = IALBundle(bundle_file)
+    timings = bundle.download(src_dir=cache)
+    bundle.release_cache()
+    assert timings['ecbuild'] > 0. and timings['fckit'] == 0.
+    assert git(os.path.join(cache, 'ecbuild'), 'rev-parse', 'HEAD') == git(origins['ecbuild'], 'rev-parse', '3.8.0')
+
+
+def test_edited_bundle_or_corrupt_lockfile(bundle_file, origins, tmp_path):
+    cache = str(tmp_path / 'cache')
+    bundle = IALBundle(bundle_file)
+    bundle.download(src_dir=cache)
+    bundle.release_cache()
+    with open(bundle._lockfile_path, 'w') as f:
+        f.write('{not json')
+    bundle = IALBundle(bundle_file)
+    assert set(bundle.download(src_dir=cache).values()) != {0.}
+    bundle.release_cache()
+    # another version of a project: other lockfile, and project downloaded at its version
+    write_bundle(bundle_file, {'IAL':{'git':origins['IAL'], 'version':'CY50T1'},
+                               'ecbuild':{'git':origins['ecbuild'], 'version':'3.7.0'}})
+    bundle = IALBundle(bundle_file)
+    timings = bundle.download(src_dir=cache)
+    bundle.release_cache()
+    assert timings['ecbuild'] > 0.
+    assert git(os.path.join(cache, 'ecbuild'), 'rev-parse', 'HEAD') == git(origins['ecbuild'], 'rev-parse', '3.7.0')
+
+
+def test_relative_dir_project_in_reduced_bundle(origins, tmp_path):
+    os.makedirs(str(tmp_path / 'local_project'))
+    bundle_file = write_bundle(str(tmp_path / 'bundle.yml'),
+                               {'IAL':{'git':origins['IAL'], 'version':'CY50T1'},
+                                'local_project':{'dir':'local_project'}})  # relative to the bundle file
+    cache = str(tmp_path / 'cache')
+    bundle = IALBundle(bundle_file)
+    bundle.download(src_dir=cache)
+    bundle.release_cache()
+    assert os.path.realpath(os.path.join(cache, 'local_project')) == str(tmp_path / 'local_project')
+
+
+# Partial clones ---------------------------------------------------------------
+
+@pytest.fixture
+def remote_bundle_file(origins, tmp_path):
+    """Bundle of origins as URLs (partial clones are pointless, hence not done, from local paths)."""
+    for origin in origins.values():
+        git(origin, 'config', 'uploadpack.allowFilter', 'true')
+        git(origin, 'config', 'uploadpack.allowAnySHA1InWant', 'true')
+    return write_bundle(str(tmp_path / 'bundle.yml'),
+                        {'IAL':{'git':'file://' + origins['IAL'], 'version':'CY50T1'},
+                         'ecbuild':{'git':'file://' + origins['ecbuild'], 'version':'3.8.0'},
+                         'fckit':{'git':'file://' + origins['fckit'],
+                                  'version':git(origins['fckit'], 'rev-parse', '0.10.0')}})
+
+
+def test_blobless_clones(remote_bundle_file, origins, tmp_path):
+    from ial_build.cache import BundleCache
+    cache = str(tmp_path / 'cache')
+    bundle = IALBundle(remote_bundle_file)
+    bundle.download(src_dir=cache, clone_mode='blobless')
+    bundle.release_cache()
+    for project in ('IAL', 'ecbuild', 'fckit'):
+        repository = os.path.join(cache, project)
+        assert git(repository, 'config', 'remote.origin.partialclonefilter') == 'blob:none'
+        assert not bundle._git_proxy(project).is_shallow
+    assert git(os.path.join(cache, 'ecbuild'), 'rev-parse', 'HEAD') == git(origins['ecbuild'], 'rev-parse', '3.8.0')
+    assert bundle.snapshot().tags_history['ecbuild'] == ['3.7.0', '3.8.0']  # full history
+    report = BundleCache(cache, verbose=False).report()
+    assert report['clones']['blobless']['count'] == 3
+
+
+def test_shallow_clones(remote_bundle_file, origins, tmp_path):
+    cache = str(tmp_path / 'cache')
+    bundle = IALBundle(remote_bundle_file)
+    bundle.download(src_dir=cache, clone_mode='shallow')
+    bundle.release_cache()
+    for project, version in (('IAL', 'CY50T1'), ('ecbuild', '3.8.0'), ('fckit', '0.10.0')):
+        assert git(os.path.join(cache, project), 'rev-parse', 'HEAD') == git(origins[project], 'rev-parse', version)
+    assert bundle._git_proxy('ecbuild').is_shallow
+    # no tags history of shallow clones, but IAL's (deepened)
+    snapshot = bundle.snapshot()
+    assert snapshot.tags_history == {'IAL':['CY38', 'CY49', 'CY50T1']}
+    assert not bundle._git_proxy('IAL').is_shallow
+    # deepened on demand
+    commit = snapshot.projects['ecbuild'].commit
+    assert bundle.deepened_tags_history('ecbuild', commit) == ['3.7.0', '3.8.0']
+    assert not bundle._git_proxy('ecbuild').is_shallow
+    assert bundle.snapshot().tags_history['ecbuild'] == ['3.7.0', '3.8.0']
+
+
+def test_clone_mode_per_project(remote_bundle_file, origins, tmp_path):
+    with open(remote_bundle_file) as f:
+        contents = f.read()
+    with open(remote_bundle_file, 'w') as f:
+        f.write(contents.replace("version : 3.8.0\n", "version : 3.8.0\n        clone_mode : shallow\n"))
+    bundle = IALBundle(remote_bundle_file)
+    assert bundle.project_clone_mode('ecbuild', 'blobless') == 'shallow'
+    assert bundle.project_clone_mode('fckit', 'blobless') == 'blobless'
+    with pytest.raises(ValueError):
+        bundle.project_clone_mode('fckit', 'thin')
+    bundle.download(src_dir=str(tmp_path / 'cache'), clone_mode='blobless')
+    bundle.release_cache()
+    assert bundle._git_proxy('ecbuild').is_shallow and not bundle._git_proxy('fckit').is_shallow
+
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.bundle.IALbundleMirror: persistent bare mirror, fetched only when older than its TTL.
+"""
+import os
+import time
+
+import pytest
+
+from ial_build.bundle import IALbundleMirror
+
+from conftest import git, commit_file
+
+
+@pytest.fixture
+def origin(repository):
+    commit_file(repository, 'bundle.yml', 'v1\n')
+    git(repository, 'tag', 'BDL50-v1')
+    return repository
+
+
+def age(mirror, seconds):
+    """Make the last fetch of **mirror** older by **seconds**."""
+    mtime = os.path.getmtime(mirror._fetch_stamp) - seconds
+    os.utime(mirror._fetch_stamp, (mtime, mtime))
+
+
+def new_mirror(origin, cache_dir, ttl):
+    mirror = IALbundleMirror(origin, cache_dir=cache_dir, ttl=ttl)
+    mirror.cache_lease.release()
+    return mirror
+
+
+def test_fetched_after_ttl(origin, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    mirror = new_mirror(origin, cache_dir, 3600)
+    assert mirror.tags == ['BDL50-v1']
+    assert mirror.last_fetch_age < 60
+    assert os.path.dirname(mirror.repository) == cache_dir
+    # new tag in origin: not seen within TTL (no fetch)
+    commit_file(origin, 'bundle.yml', 'v2\n')
+    git(origin, 'tag', 'BDL50-v2')
+    assert new_mirror(origin, cache_dir, 3600).tags == ['BDL50-v1']
+    # then fetched
+    age(mirror, 3600)
+    mirror = new_mirror(origin, cache_dir, 3600)
+    assert mirror.tags == ['BDL50-v1', 'BDL50-v2']
+    assert mirror.last_fetch_age < 60
+
+
+def test_ttl_zero_and_tags_changes(origin, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    new_mirror(origin, cache_dir, 0)
+    git(origin, 'tag', 'BDL50-v1b')
+    commit_file(origin, 'bundle.yml', 'v1 fixed\n')
+    git(origin, 'tag', '--force', 'BDL50-v1b')  # moved
+    git(origin, 'tag', '--delete', 'BDL50-v1')
+    mirror = new_mirror(origin, cache_dir, 0)
+    assert mirror.tags == ['BDL50-v1b']
+    assert mirror.tag_points_to('BDL50-v1b') == git(origin, 'rev-parse', 'HEAD')
+
+
+def test_unreachable_origin(origin, tmp_path, capsys):
+    cache_dir = str(tmp_path / 'cache')
+    mirror = new_mirror(origin, cache_dir, 0)
+    age(mirror, 100)
+    stamp = os.path.getmtime(mirror._fetch_stamp)
+    os.rename(origin, origin + '.moved')
+    mirror = IALbundleMirror(origin, cache_dir=cache_dir, ttl=0)
+    mirror.cache_lease.release()
+    assert mirror.tags == ['BDL50-v1']  # used as is
+    assert 'could not fetch' in capsys.readouterr().out
+    assert os.path.getmtime(mirror._fetch_stamp) == stamp  # still to be fetched next time
+
+
+def test_one_mirror_per_origin(origin, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    other = str(tmp_path / 'other')
+    git(str(tmp_path), 'clone', '--quiet', origin, other)
+    assert new_mirror(origin, cache_dir, 3600).repository != new_mirror(other, cache_dir, 3600).repository
+    assert new_mirror(origin, cache_dir, 3600).repository == new_mirror(origin, cache_dir, 3600).repository
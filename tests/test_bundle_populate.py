@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the population of packs from a downloaded bundle: Pack.bundle_populate and its components.
+"""
+import os
+
+import pytest
+
+from ial_build.bundle import IALBundle
+
+from conftest import git, commit_file, make_pack
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def make_origin(path, files, tags):
+    """Repository in **path**, with **files** {path: contents} committed, then tagged with **tags**."""
+    os.makedirs(path)
+    git(path, 'init', '--quiet', '--initial-branch', 'main')
+    for f, contents in files.items():
+        commit_file(path, f, contents)
+    for tag in tags:
+        git(path, 'tag', tag)
+    return path
+
+
+@pytest.fixture
+def origins(tmp_path):
+    IAL = make_origin(str(tmp_path / 'origins' / 'IAL'), {'arpifs/a.F90':'a 38\n'}, ['CY38'])
+    commit_file(IAL, 'arpifs/a.F90', 'a\n')
+    commit_file(IAL, 'filtered/b.F90', 'b\n')
+    commit_file(IAL, 'bundle/filter.yml', 'filtered\n')
+    git(IAL, 'tag', 'CY50T1')
+    return {'IAL':IAL,
+            'surfex':make_origin(str(tmp_path / 'origins' / 'surfex'),
+                                 {'src/s.F90':'s\n', 'src/filtered.F90':'f\n', 'filter.yml':'src/filtered.F90\n'},
+                                 ['V9']),
+            'ecbuild':make_origin(str(tmp_path / 'origins' / 'ecbuild'), {'CMakeLists.txt':'ecbuild\n'}, ['3.8.0']),
+            'fckit':make_origin(str(tmp_path / 'origins' / 'fckit'), {'CMakeLists.txt':'fckit\n'}, ['0.10.0'])}
+
+
+@pytest.fixture
+def bundle(origins, tmp_path):
+    path = str(tmp_path / 'bundle.yml')
+    with open(path, 'w') as f:
+        f.write("""name : test-bundle
+projects :
+    - IAL :
+        git : {IAL}
+        version : CY50T1
+        gmkpack_filter_file : bundle/filter.yml
+    - surfex :
+        git : {surfex}
+        version : V9
+        gmkpack : src/local
+        gmkpack_filter_file : filter.yml
+    - ecbuild :
+        git : {ecbuild}
+        version : 3.8.0
+    - fckit :
+        git : {fckit}
+        version : 0.10.0
+""".format(**origins))
+    bundle = IALBundle(path)
+    bundle.download(src_dir=str(tmp_path / 'cache'))
+    yield bundle
+    bundle.release_cache()
+
+
+# src/local --------------------------------------------------------------------
+
+def test_IAL_component_exported(bundle, origins, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'))
+    cache = bundle.local_project_repo('IAL')
+    # uncommitted change in the cache: not exported, only the downloaded commit
+    with open(os.path.join(cache, 'arpifs', 'a.F90'), 'w') as f:
+        f.write('a modified\n')
+    pack.bundle_populate_gmkpack_component('IAL', bundle,
+                                           filter_file=pack._filter_file_in_repo_format.format('bundle/filter.yml'))
+    # at the root of src/local, filtered out, without a clone
+    assert sorted(os.listdir(pack._local)) == ['arpifs', 'bundle']
+    assert read(os.path.join(pack._local, 'arpifs', 'a.F90')) == 'a\n'
+    commit = git(origins['IAL'], 'rev-parse', 'CY50T1')
+    assert "Component IAL exported from '{}' at commit: {}".format(cache, commit) in read(pack.origin_filepath)
+    # cache repository left as is
+    assert read(os.path.join(cache, 'arpifs', 'a.F90')) == 'a modified\n'
+    assert git(cache, 'rev-parse', 'HEAD') == commit
+
+
+def test_other_component_cloned(bundle, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'))
+    pack.bundle_populate_gmkpack_component('surfex', bundle,
+                                           filter_file=pack._filter_file_in_repo_format.format('filter.yml'))
+    clone = os.path.join(pack._local, 'surfex')
+    assert os.path.isdir(os.path.join(clone, '.git'))
+    assert os.listdir(os.path.join(clone, 'src')) == ['s.F90']
+
+
+# Hub --------------------------------------------------------------------------
+
+def ecSDK(pack):
+    return os.path.join(pack._hub_local_src, 'ecSDK')
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_hub_populated_concurrently(bundle, tmp_path, capsys, incremental):
+    pack = make_pack(str(tmp_path / 'pack'), incremental=incremental)
+    pack.bundle_populate_hub_components(['ecbuild', 'fckit'], bundle, workers=2)
+    # both in the same directory, without leftovers of their staging
+    assert sorted(os.listdir(ecSDK(pack))) == ['ecbuild', 'fckit']
+    for p in ('ecbuild', 'fckit'):
+        assert read(os.path.join(ecSDK(pack), p, 'CMakeLists.txt')) == p + '\n'
+        assert git(os.path.join(ecSDK(pack), p), 'status', '--porcelain') == ''
+    # incremental: hub/local first
+    assert read(pack._hub_gmkview_file) == ('local\nmain' if incremental else 'main')
+    # output as a block per package, in order
+    out = capsys.readouterr().out
+    assert out.index("* 'ecbuild'") < out.index("* 'fckit'")
+    assert out.count(" ... package populated.") == 2
+
+
+def test_hub_package_replaced(bundle, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'))
+    stale = os.path.join(ecSDK(pack), 'ecbuild', 'stale.txt')
+    os.makedirs(os.path.dirname(stale))
+    with open(stale, 'w') as f:
+        f.write('stale\n')
+    pack.bundle_populate_hub_components(['ecbuild'], bundle)
+    assert os.listdir(ecSDK(pack)) == ['ecbuild']  # no .previous left
+    assert not os.path.exists(stale)
+    assert read(os.path.join(ecSDK(pack), 'ecbuild', 'CMakeLists.txt')) == 'ecbuild\n'
+
+
+def test_hub_package_failed(bundle, tmp_path, monkeypatch):
+    pack = make_pack(str(tmp_path / 'pack'))
+    previous = os.path.join(ecSDK(pack), 'fckit', 'previous.txt')
+    os.makedirs(os.path.dirname(previous))
+    with open(previous, 'w') as f:
+        f.write('previous\n')
+    local_project_repo = bundle.local_project_repo
+    monkeypatch.setattr(bundle, 'local_project_repo',
+                        lambda p: str(tmp_path / 'missing') if p == 'fckit' else local_project_repo(p))
+    with pytest.raises(Exception):
+        pack.bundle_populate_hub_components(['fckit', 'ecbuild'], bundle, workers=2)
+    # the others are populated, the failed one is left as it was
+    assert sorted(os.listdir(ecSDK(pack))) == ['ecbuild', 'fckit']
+    assert read(os.path.join(ecSDK(pack), 'ecbuild', 'CMakeLists.txt')) == 'ecbuild\n'
+    assert os.listdir(os.path.join(ecSDK(pack), 'fckit')) == ['previous.txt']
+
+
+def test_hub_package_hardlinked_from_cache(bundle, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'), copy_mode='hardlink')
+    pack.bundle_populate_hub_components(['ecbuild'], bundle)
+    package = os.path.join(ecSDK(pack), 'ecbuild')
+    cached = os.path.join(bundle.local_project_repo('ecbuild'), 'CMakeLists.txt')
+    assert os.stat(os.path.join(package, 'CMakeLists.txt')).st_ino == os.stat(cached).st_ino
+    # a clone of its own, clean
+    assert git(package, 'status', '--porcelain') == ''
+    assert git(package, 'rev-parse', 'HEAD') == git(bundle.local_project_repo('ecbuild'), 'rev-parse', 'HEAD')
+
+
+def test_bundle_populate(bundle, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'))
+    os.makedirs(os.path.join(pack._local, 'stale'))
+    pack.bundle_populate(bundle, workers=4)
+    assert sorted(os.listdir(ecSDK(pack))) == ['ecbuild', 'fckit']
+    assert sorted(os.listdir(pack._local)) == ['arpifs', 'bundle', 'surfex']
+    assert read(os.path.join(pack.abspath, 'bundle.yml')) == read(bundle.bundle_file)
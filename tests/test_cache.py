@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.cache.BundleCache: LRU eviction under budget, leases, dry runs, history.
+"""
+import os
+import io
+import fcntl
+import subprocess
+
+import pytest
+
+from ial_build.cache import BundleCache, parse_size
+
+
+def make_entry(cache, name, kbytes):
+    path = os.path.join(cache.cache_dir, name)
+    os.makedirs(path)
+    with io.open(os.path.join(path, 'data'), 'wb') as f:
+        f.write(os.urandom(kbytes * 1024))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Cache with entries 'a' (oldest), 'b', 'c' (most recently used) of 64K each."""
+    cache = BundleCache(str(tmp_path / 'cache'), verbose=False)
+    os.makedirs(cache.cache_dir)
+    for i, name in enumerate(('a', 'b', 'c')):
+        make_entry(cache, name, 64)
+        cache.record(name, last_used=1000. + i)
+    return cache
+
+
+def test_parse_size():
+    assert parse_size('20G') == 20 * 1024 ** 3
+    assert parse_size('1.5k') == 1536
+    assert parse_size(42) == 42
+    with pytest.raises(ValueError):
+        parse_size('a lot')
+
+
+def test_evict_lru_until_budget(cache):
+    sizes = cache.refresh_sizes()
+    budget = sizes['b'] + sizes['c']
+    assert cache.evict(budget=budget) == ['a']
+    assert cache.entries == ['b', 'c']
+    assert cache.evict(budget=budget) == []
+    assert cache.evict(budget=sizes['c']) == ['b']
+    assert cache.entries == ['c']
+
+
+def test_evict_follows_last_use(cache):
+    cache.lease(['a']).release()  # 'a' becomes the most recently used
+    sizes = cache.refresh_sizes()
+    assert cache.evict(budget=sizes['a']) == ['b', 'c']
+    assert cache.entries == ['a']
+
+
+def test_evict_without_budget(cache):
+    cache.budget = None
+    assert cache.evict() == []
+    assert cache.entries == ['a', 'b', 'c']
+
+
+def test_leased_entries_not_evicted(cache):
+    with cache.lease(['a']):
+        assert cache.in_use('a')
+        assert cache.evict(budget=0) == ['b', 'c']
+        assert cache.entries == ['a']
+    assert not cache.in_use('a')
+    assert cache.evict(budget=0) == ['a']
+
+
+def test_exclusively_locked_entries_not_evicted(cache):
+    # e.g. being evicted or gc'ed by another process
+    with io.open(cache._inuse_path('b'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert cache.evict(budget=0) == ['a', 'c']
+    assert cache.entries == ['b']
+
+
+def test_evict_dryrun(cache):
+    sizes = cache.refresh_sizes()
+    assert cache.evict(budget=sizes['c'], dryrun=True) == ['a', 'b']
+    assert cache.entries == ['a', 'b', 'c']
+    report = cache.report()
+    assert report['evictions'] == []
+    assert sorted(report['entries'].keys()) == ['a', 'b', 'c']
+
+
+def test_evictions_history(cache):
+    sizes = cache.refresh_sizes()
+    cache.evict(budget=sizes['c'])
+    evictions = cache.report()['evictions']
+    assert [e['name'] for e in evictions] == ['a', 'b']
+    assert [e['size'] for e in evictions] == [sizes['a'], sizes['b']]
+    assert all([e['budget'] == sizes['c'] for e in evictions])
+
+
+def test_evictions_history_length(cache):
+    cache.history_length = 2
+    cache.evict(budget=0)
+    assert [e['name'] for e in cache.report()['evictions']] == ['b', 'c']
+
+
+def test_hits_and_misses(cache):
+    cache.lease(['a', 'missing']).release()
+    report = cache.report()
+    assert (report['hits'], report['misses']) == (1, 1)
+    assert report['entries']['a']['hits'] == 1
+
+
+def test_refresh_sizes_forgets_vanished_entries(cache):
+    cache.lease(['gone']).release()
+    cache.record('forgotten', size=1)
+    with cache.lease(['leased']):
+        cache.refresh_sizes()
+        with cache._registry() as registry:
+            assert 'leased' in registry['entries']  # in use: not forgotten
+            assert 'gone' not in registry['entries']
+            assert 'forgotten' not in registry['entries']
+    # no lock file created for entries never leased
+    assert not os.path.exists(cache._inuse_path('forgotten'))
+    assert not cache.in_use('forgotten')
+    assert not os.path.exists(cache._inuse_path('forgotten'))
+
+
+def test_gc(cache, tmp_path):
+    os.makedirs(os.path.join(cache.cache_dir, 'repo'))
+    subprocess.check_call(['git', 'init', '--quiet', os.path.join(cache.cache_dir, 'repo')])
+    os.makedirs(str(tmp_path / 'elsewhere'))
+    subprocess.check_call(['git', 'init', '--quiet', str(tmp_path / 'elsewhere')])
+    os.symlink(str(tmp_path / 'elsewhere'), os.path.join(cache.cache_dir, 'link'))
+    # not git repositories, or links to repositories out of the cache, are left alone
+    assert cache.gc() == ['repo']
+    with cache.lease(['repo', 'link', 'a']) as lease:
+        assert cache.gc() == []  # in use
+        assert lease.gc() == ['repo']  # by the holder of the lease
+        assert lease.gc(['repo', 'other']) == ['repo']
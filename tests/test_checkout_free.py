@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the checkout-free population of main packs:
+ial_build.repositories.GitProxy.export_tree and ial_build.algos.IAL2pack(checkout=False).
+"""
+import os
+
+import pytest
+
+from ial_build.repositories import GitProxy
+from ial_build.pygmkpack import GmkpackTool
+
+from conftest import git, commit_file
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+# Export -----------------------------------------------------------------------
+
+def test_export_tree(repository, tmp_path):
+    commit_file(repository, 'arpifs/a.F90', 'a v1\n')
+    commit_file(repository, 'arpifs/b.F90', 'b v1\n')
+    git(repository, 'tag', 'v1')
+    commit_file(repository, 'arpifs/a.F90', 'a v2\n')
+    os.chmod(os.path.join(repository, 'arpifs', 'a.F90'), 0o755)
+    os.symlink('a.F90', os.path.join(repository, 'arpifs', 'link'))
+    commit_file(repository, 'filtered/c.F90', 'c\n')
+    git(repository, 'add', '--chmod=+x', 'arpifs/a.F90')
+    git(repository, 'add', 'arpifs/link')
+    git(repository, 'commit', '--quiet', '-m', 'v2')
+    git(repository, 'checkout', '--quiet', 'v1')  # working copy elsewhere: contents from the objects
+    destination = str(tmp_path / 'export')
+    stats = GitProxy(repository).export_tree('main', destination, exclude=lambda p: p.startswith('filtered/'))
+    assert stats == {'files':3, 'excluded':1, 'bytes':len('a v2\n') + len('b v1\n')}  # links: not counted
+    assert read(os.path.join(destination, 'arpifs', 'a.F90')) == 'a v2\n'
+    assert os.access(os.path.join(destination, 'arpifs', 'a.F90'), os.X_OK)
+    assert os.readlink(os.path.join(destination, 'arpifs', 'link')) == 'a.F90'
+    assert not os.path.exists(os.path.join(destination, 'filtered'))
+    assert read(os.path.join(repository, 'arpifs', 'a.F90')) == 'a v1\n'  # working copy untouched
+
+
+def test_export_tree_over_stale_destination(repository, tmp_path):
+    commit_file(repository, 'file_then_dir/a.F90', 'a\n')
+    commit_file(repository, 'dir_then_file', 'b\n')
+    commit_file(repository, 'link_then_dir/c.F90', 'c\n')
+    destination = str(tmp_path / 'export')
+    os.makedirs(os.path.join(destination, 'dir_then_file', 'sub'))
+    with open(os.path.join(destination, 'file_then_dir'), 'w') as f:
+        f.write('stale\n')
+    os.makedirs(str(tmp_path / 'elsewhere'))
+    os.symlink(str(tmp_path / 'elsewhere'), os.path.join(destination, 'link_then_dir'))
+    GitProxy(repository).export_tree('HEAD', destination)
+    assert read(os.path.join(destination, 'file_then_dir', 'a.F90')) == 'a\n'
+    assert read(os.path.join(destination, 'dir_then_file')) == 'b\n'
+    assert not os.path.islink(os.path.join(destination, 'link_then_dir'))
+    assert read(os.path.join(destination, 'link_then_dir', 'c.F90')) == 'c\n'
+    assert os.listdir(str(tmp_path / 'elsewhere')) == []  # not written through the stale link
+
+
+def test_extract_files_from_to(repository, tmp_path):
+    commit_file(repository, 'bundle/bundle.yml', 'v1\n')
+    commit_file(repository, 'bundle/filter.yml', 'v1\n')
+    git(repository, 'tag', 'v1')
+    commit_file(repository, 'bundle/bundle.yml', 'v2\n')
+    destination = str(tmp_path / 'extracted')
+    extracted = GitProxy(repository).extract_files_from_to('v1', ['bundle/bundle.yml', 'bundle/filter.yml'],
+                                                           destination)
+    assert extracted == {f:os.path.join(destination, f) for f in ('bundle/bundle.yml', 'bundle/filter.yml')}
+    assert read(extracted['bundle/bundle.yml']) == 'v1\n'
+    with pytest.raises(IOError):
+        GitProxy(repository).extract_files_from_to('v1', ['bundle/bundle.yml'], destination)
+
+
+# Pack -------------------------------------------------------------------------
+
+BUNDLE = """name : IAL-bundle
+projects :
+    - IAL :
+        dir : $IAL_DIR
+        gmkpack_filter_file : bundle/filter.yml
+    - hubpkg :
+        dir : $IAL_DIR/../hubpkg
+        gmkpack : hub/local/src/Hubpkg
+"""
+
+
+@pytest.fixture
+def IAL(repository):
+    """
+    IAL repository with a bundle, tagged CY50T1, then checked out elsewhere;
+    and a hub package next to it.
+    """
+    hubpkg = os.path.join(os.path.dirname(repository), 'hubpkg')
+    os.makedirs(hubpkg)
+    git(hubpkg, 'init', '--quiet', '--initial-branch', 'main')
+    commit_file(hubpkg, 'CMakeLists.txt', 'project(hubpkg)\n')
+    commit_file(repository, 'arpifs/a.F90', 'a 38\n')
+    git(repository, 'tag', 'CY38')  # first tag of the history
+    commit_file(repository, 'bundle/bundle.yml', BUNDLE)
+    commit_file(repository, 'bundle/filter.yml', 'filtered\n')
+    commit_file(repository, 'arpifs/a.F90', 'a\n')
+    commit_file(repository, 'filtered/b.F90', 'b\n')
+    git(repository, 'tag', 'CY50T1')
+    git(repository, 'checkout', '--quiet', '-b', 'elsewhere')
+    commit_file(repository, 'arpifs/a.F90', 'a modified\n')
+    git(repository, 'rm', '--quiet', 'bundle/bundle.yml')
+    git(repository, 'commit', '--quiet', '-m', 'bundle removed')
+    return repository
+
+
+def test_IAL2pack_without_checkout(IAL, tmp_path, monkeypatch):
+    from ial_build.algos import IAL2pack
+    monkeypatch.delenv('IAL_DIR', raising=False)
+    homepack = str(tmp_path / 'pack')
+    packname = GmkpackTool.guess_pack_name('CY50T1', 'GNU', 'x', 'main')
+    pack_dir = os.path.join(homepack, packname)
+    for d in ('src/local', 'hub/local/src'):
+        os.makedirs(os.path.join(pack_dir, d))
+    with open(os.path.join(pack_dir, '.genesis'), 'w') as f:
+        f.write('gmkpack -a -r 50t1 -b main -l GNU -o x -p masterodb\n')
+    pack = IAL2pack('CY50T1', IAL,
+                    pack_type='main',
+                    preexisting_pack=True,
+                    checkout=False,
+                    compiler_label='GNU',
+                    compiler_flag='x',
+                    homepack=homepack,
+                    bundle_cache_dir=str(tmp_path / 'cache'))
+    assert pack.abspath == pack_dir
+    # sources from the tag, though checked out elsewhere, and filtered
+    assert read(os.path.join(pack_dir, 'src', 'local', 'arpifs', 'a.F90')) == 'a\n'
+    assert not os.path.exists(os.path.join(pack_dir, 'src', 'local', 'filtered'))
+    # $IAL_DIR is the repository, not above the extracted bundle
+    assert os.environ['IAL_DIR'] == IAL
+    assert os.path.exists(os.path.join(pack_dir, 'hub', 'local', 'src', 'Hubpkg', 'hubpkg', 'CMakeLists.txt'))
+    assert git(IAL, 'rev-parse', '--abbrev-ref', 'HEAD') == 'elsewhere'
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the exclusion of filtered sources while copying them to a pack, rather than a posteriori:
+Pack.sources_filter_exclusions, ParallelRsync(exclude=...), git_clone(exclude=...),
+and their equivalence with the a posteriori filtering.
+"""
+import os
+import shutil
+
+import pytest
+
+from ial_build.repositories import git_clone
+from ial_build.util import ParallelRsync, ZeroCopier
+
+from conftest import git, commit_file, make_pack
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def files(root):
+    """Relative paths of the files (and links) under **root**, .git excepted."""
+    out = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        out.extend([os.path.relpath(os.path.join(dirpath, f), root) for f in filenames])
+    return sorted(out)
+
+
+SOURCES = ['arpifs/a.F90', 'arpifs/b.F90', 'arpifs/module/m1.F90', 'arpifs/module/m2.F90',
+           'odb/d.F90', 'surfex/s.F90', 'weird[1]*.F90', 'weird[1]x.F90']
+FILTER = ['odb', 'arpifs/module/m*', 'arpifs/b.F90', 'weird[[]1]x.F90', '# comment', 'missing/file.F90']
+
+
+@pytest.fixture
+def source(tmp_path):
+    src = str(tmp_path / 'src')
+    for f in SOURCES:
+        write(os.path.join(src, f), f + '\n')
+    return src
+
+
+@pytest.fixture
+def filter_file(tmp_path):
+    path = str(tmp_path / 'filter.yml')
+    with open(path, 'w') as f:
+        f.write('\n'.join(FILTER) + '\n\n')
+    return path
+
+
+FILTERED = ['arpifs/a.F90', 'surfex/s.F90', 'weird[1]*.F90']
+
+
+# Exclusions -------------------------------------------------------------------
+
+def test_sources_filter_exclusions(source, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'))
+    filter_list = [f for f in FILTER if not f.startswith('#')]
+    assert pack.sources_filter_exclusions(filter_list, source) == {
+        'odb', 'arpifs/module/m1.F90', 'arpifs/module/m2.F90', 'arpifs/b.F90', 'weird[1]x.F90'}
+    # absolute paths: relative to the destination, if in it
+    filter_list = [os.path.join(pack._local, 'sub', 'odb'), os.path.join(pack._local, 'surfex'), '../surfex']
+    assert pack.sources_filter_exclusions(filter_list, source, subdir='sub') == {'odb'}
+    # component cloned in a subdirectory of the filters' root
+    assert pack.sources_filter_exclusions(['surfex', 'comp/odb'], source,
+                                          destination=os.path.join(pack._local, 'comp')) == {'odb'}
+
+
+# Copy -------------------------------------------------------------------------
+
+@pytest.mark.parametrize('copier', [None, 'copy'])
+def test_parallel_copy_exclude(source, tmp_path, copier):
+    if copier is None and shutil.which('rsync') is None:
+        pytest.skip("rsync not available")
+    dst = str(tmp_path / 'dst')
+    os.makedirs(dst)
+    rsync = ParallelRsync(workers=2, copier=ZeroCopier(copier) if copier else None)
+    exclude = {'odb', 'arpifs/module/m1.F90', 'arpifs/b.F90', 'weird[1]x.F90'}
+    totals = rsync.copy(source, sorted(os.listdir(source)), dst, exclude=exclude)
+    # wildcards of excluded paths are literal
+    assert files(dst) == ['arpifs/a.F90', 'arpifs/module/m2.F90', 'surfex/s.F90', 'weird[1]*.F90']
+    assert totals['files'] == 4
+    assert not os.path.exists(os.path.join(dst, 'odb'))
+
+
+def test_git_clone_exclude(repository, tmp_path):
+    for f in SOURCES:
+        commit_file(repository, f, f + '\n')
+    clone = str(tmp_path / 'clone')
+    git_clone(repository, clone, exclude=['odb', 'arpifs/module/m1.F90', 'arpifs/./b.F90'], quiet=True)
+    assert files(clone) == ['arpifs/a.F90', 'arpifs/module/m2.F90', 'surfex/s.F90',
+                            'weird[1]*.F90', 'weird[1]x.F90']
+    # excluded paths: seen as deleted, as when removed a posteriori
+    assert sorted(git(clone, 'ls-files', '--deleted').split('\n')) == [
+        'arpifs/b.F90', 'arpifs/module/m1.F90', 'odb/d.F90']
+
+
+# Pack -------------------------------------------------------------------------
+
+@pytest.mark.parametrize('copy_mode', ['copy', 'reflink'])
+def test_same_as_a_posteriori(source, filter_file, tmp_path, copy_mode, capsys):
+    if copy_mode == 'copy' and shutil.which('rsync') is None:
+        pytest.skip("rsync not available")
+    pack = make_pack(str(tmp_path / 'pack'), copy_mode=copy_mode)
+    pack._populate_from_repo_in_bulk(source, filter_file=filter_file, workers=2)
+    assert files(pack._local) == FILTERED
+    assert "Sources filter: 5 paths excluded at copy, 0 left to be removed a posteriori." in capsys.readouterr().out
+    # as formerly: everything copied, then filtered
+    former = make_pack(str(tmp_path / 'former'), copy_mode=copy_mode)
+    shutil.copytree(source, former._local, dirs_exist_ok=True)
+    former.filter_sources_a_posteriori(former.prepare_sources_filter(filter_file))
+    assert files(former._local) == FILTERED
+
+
+def test_reconcile_a_posteriori(source, filter_file, tmp_path, capsys):
+    pack = make_pack(str(tmp_path / 'pack'))
+    shutil.copytree(source, pack._local, dirs_exist_ok=True)
+    # what could not be excluded at copy is removed afterwards
+    pack.reconcile_sources_filter(filter_file, {'odb'})
+    assert files(pack._local) == FILTERED
+    assert "Sources filter: 1 paths excluded at copy, 5 left to be removed a posteriori." in capsys.readouterr().out
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.repositories.GitProxy.fork_point and fork_points (batch mode),
+against the former comparison of full first-parent histories.
+"""
+import io
+import json
+import sys
+
+import pytest
+
+from ial_build.repositories import GitProxy, GitError
+from ial_build.cli import fork_point as fork_point_cli
+
+from conftest import git, commit_file
+
+
+def legacy_fork_point(repository, refA, refB):
+    """Most recent commit of the first-parent history of **refA** also in the one of **refB**."""
+    historyB = set(git(repository, 'rev-list', '--first-parent', refB).split('\n'))
+    for commit in git(repository, 'rev-list', '--first-parent', refA).split('\n'):
+        if commit in historyB:
+            return commit
+
+
+@pytest.fixture
+def history(repository):
+    """
+    main:    m1 - m2 - m3 ---------- m4(merge) - m5
+                   \\     \\          /
+    topic:          \\     t1 - t2 --
+    old:             o1 - o2
+    orphan:  x1
+    """
+    commit_file(repository, 'm', 'm1\n')
+    m2 = commit_file(repository, 'm', 'm2\n')
+    git(repository, 'checkout', '--quiet', '-b', 'old')
+    commit_file(repository, 'o', 'o1\n')
+    commit_file(repository, 'o', 'o2\n')
+    git(repository, 'checkout', '--quiet', 'main')
+    m3 = commit_file(repository, 'm', 'm3\n')
+    git(repository, 'checkout', '--quiet', '-b', 'topic')
+    commit_file(repository, 't', 't1\n')
+    commit_file(repository, 't', 't2\n')
+    git(repository, 'checkout', '--quiet', 'main')
+    git(repository, 'merge', '--quiet', '--no-ff', '-m', 'm4', 'topic')
+    commit_file(repository, 'm', 'm5\n')
+    git(repository, 'checkout', '--quiet', '--orphan', 'orphan')
+    commit_file(repository, 'x', 'x1\n')
+    git(repository, 'checkout', '--quiet', 'main')
+    git(repository, 'tag', 'prefix', 'main~2')  # in the first-parent history of main
+    return {'m2':m2, 'm3':m3}
+
+
+REFS = ['topic', 'old', 'prefix', 'main']
+
+
+def test_same_as_legacy(repository, history):
+    proxy = GitProxy(repository)
+    for ref in REFS:
+        for base in REFS:
+            assert proxy.fork_point(ref, base) == legacy_fork_point(repository, ref, base), (ref, base)
+    assert proxy.fork_point('topic', 'main') == history['m3']  # though merged since
+    assert proxy.fork_point('old') == history['m2']
+
+
+def test_no_common_history(repository, history):
+    with pytest.raises(GitError):
+        GitProxy(repository).fork_point('orphan', 'main')
+    with pytest.raises(GitError):
+        GitProxy(repository).fork_point('unknown', 'main')
+
+
+def test_batch(repository, history):
+    proxy = GitProxy(repository)
+    fork_points = proxy.fork_points(REFS + ['orphan'], base='main')
+    assert fork_points == dict([(ref, proxy.fork_point(ref, 'main')) for ref in REFS], orphan=None)
+
+
+def test_cli_batch_from_stdin(repository, history, monkeypatch, capsys):
+    stdin = io.StringIO('topic\n\nold\n')
+    monkeypatch.setattr(sys, 'stdin', stdin)
+    monkeypatch.setattr(sys, 'argv', ['ial-fork_point', '-r', repository, '--refs_file', '-', '--format', 'json'])
+    fork_point_cli.main()
+    assert json.loads(capsys.readouterr().out) == {'topic':history['m3'], 'old':history['m2']}
+    assert not stdin.closed
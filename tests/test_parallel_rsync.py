@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the population of main packs with concurrent copy workers:
+ial_build.util.ParallelRsync and Pack._populate_from_repo_in_bulk.
+"""
+import os
+import shutil
+
+import pytest
+
+from ial_build.util import ParallelRsync
+
+from conftest import make_pack
+
+needs_rsync = pytest.mark.skipif(shutil.which('rsync') is None, reason="rsync not available")
+
+
+def write(path, contents, mtime=1000):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+    os.utime(path, (mtime, mtime))
+
+
+def tree(root):
+    """{relative path: (kind, contents or link target, mode, mtime)} of the tree under **root**."""
+    out = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if os.path.islink(path):
+                entry = ('link', os.readlink(path), None, None)
+            elif os.path.isdir(path):
+                entry = ('dir', None, st.st_mode, int(st.st_mtime))
+            else:
+                with open(path) as f:
+                    entry = ('file', f.read(), st.st_mode, int(st.st_mtime))
+            out[os.path.relpath(path, root)] = entry
+    return out
+
+
+@pytest.fixture
+def source(tmp_path):
+    """
+    src/
+        arpifs/ (mode 750) a.F90, sub/b.F90, sub/deeper/c.F90, link -> a.F90
+        odb/d.F90
+        loose.txt
+    """
+    src = str(tmp_path / 'src')
+    write(os.path.join(src, 'arpifs', 'a.F90'), 'a\n')
+    write(os.path.join(src, 'arpifs', 'sub', 'b.F90'), 'b\n')
+    write(os.path.join(src, 'arpifs', 'sub', 'deeper', 'c.F90'), 'c\n')
+    os.symlink('a.F90', os.path.join(src, 'arpifs', 'link'))
+    write(os.path.join(src, 'odb', 'd.F90'), 'd\n')
+    write(os.path.join(src, 'loose.txt'), 'loose\n')
+    for d in ('arpifs/sub/deeper', 'arpifs/sub', 'arpifs', 'odb'):
+        os.utime(os.path.join(src, d), (2000, 2000))
+    os.chmod(os.path.join(src, 'arpifs'), 0o750)
+    return src
+
+
+# Plan -------------------------------------------------------------------------
+
+def test_plan(source, tmp_path):
+    dst = str(tmp_path / 'dst')
+    tasks, split = ParallelRsync(workers=2).plan(source, ['arpifs', 'loose.txt', 'odb'], dst)
+    j = os.path.join
+    assert sorted(tasks) == sorted([
+        ([j(source, 'arpifs', 'sub')], j(dst, 'arpifs')),
+        ([j(source, 'arpifs', 'a.F90'), j(source, 'arpifs', 'link')], j(dst, 'arpifs')),
+        ([j(source, 'odb', 'd.F90')], j(dst, 'odb')),
+        ([j(source, 'loose.txt')], dst)])
+    assert split == [(j(source, 'arpifs'), dst), (j(source, 'odb'), dst)]
+
+
+def test_workers():
+    assert ParallelRsync(workers=0).workers == 1
+    assert ParallelRsync().workers >= 1
+
+
+# Copy -------------------------------------------------------------------------
+
+def check_copy(rsync, source, dst):
+    os.makedirs(dst)
+    totals = rsync.copy(source, sorted(os.listdir(source)), dst)
+    # same tree as a single copy, incl. attributes of the directories split across workers
+    assert tree(dst) == tree(source)
+    assert totals == {'tasks':4, 'files':6, 'bytes':len('a\nb\nc\nd\nloose\n') + len('a.F90')}
+    assert sum([s['tasks'] for s in rsync.stats.values()]) == 4
+
+
+@needs_rsync
+def test_copy_rsync(source, tmp_path):
+    check_copy(ParallelRsync(workers=3), source, str(tmp_path / 'dst'))
+
+
+# Pack -------------------------------------------------------------------------
+
+@needs_rsync
+def test_populate_from_repo_in_bulk(source, tmp_path):
+    os.makedirs(os.path.join(source, '.git'))
+    filter_file = str(tmp_path / 'filter.yml')
+    with open(filter_file, 'w') as f:
+        f.write('odb\narpifs/sub/*\n')
+    pack = make_pack(str(tmp_path / 'pack'), copy_mode='copy')
+    pack._populate_from_repo_in_bulk(source, filter_file=filter_file, workers=2)
+    assert sorted(tree(pack._local).keys()) == ['arpifs', 'arpifs/a.F90', 'arpifs/link', 'arpifs/sub',
+                                                'loose.txt']
+
+
+def test_components_populated_concurrently(tmp_path, capsys):
+    pack = make_pack(str(tmp_path / 'pack'), incremental=True)
+    components = ['comp{}'.format(i) for i in range(8)]
+    for c in components:
+        for i in range(20):
+            write(str(tmp_path / c / 'src' / '{}_{}.F90'.format(c, i)), c + '\n')
+    cwd = os.getcwd()
+
+    def populate(component):
+        print(component + ' starts')
+        pack.populate_from_list_of_files_in_dir(sorted(os.listdir(str(tmp_path / component / 'src'))),
+                                                str(tmp_path / component / 'src'), subdir=component)
+        print(component + ' done')
+    pack._concurrently(populate, components, workers=4)
+    assert os.getcwd() == cwd
+    # each component in its own subdirectory, whatever the others do
+    for c in components:
+        assert sorted(os.listdir(os.path.join(pack._local, c))) == sorted(['{}_{}.F90'.format(c, i)
+                                                                          for i in range(20)])
+    # output printed as a block per component, in order
+    assert capsys.readouterr().out == ''.join(['{0} starts\n{0} done\n'.format(c) for c in components])
+
+
+def test_components_populated_concurrently_error(tmp_path):
+    def populate(component):
+        if component == 'b':
+            raise ValueError(component)
+    with pytest.raises(ValueError):
+        make_pack(str(tmp_path / 'pack'))._concurrently(populate, ['a', 'b', 'c'], workers=2)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.util.PathFilter and DirectoryFiltering.
+"""
+import os
+
+from ial_build.util import DirectoryFiltering, PathFilter
+
+
+def test_literal_patterns():
+    path_filter = PathFilter(['arpifs/module', './surfex/', 'a/b/c.F90', '../out'])
+    assert path_filter.matches('arpifs/module')
+    assert path_filter.matches('arpifs/module/yomct0.F90')  # within a filtered directory
+    assert path_filter.matches('surfex/x.F90')
+    assert path_filter.matches('a/b/c.F90')
+    assert not path_filter.matches('arpifs/modules')
+    assert not path_filter.matches('a/b')
+    assert not path_filter.matches('out')
+
+
+def test_wildcards():
+    path_filter = PathFilter(['*/programs/*.F90', 'mpa/[!c]*', 'x?z'])
+    assert path_filter.matches('arpifs/programs/master.F90')
+    assert not path_filter.matches('arpifs/programs/master.F')
+    assert not path_filter.matches('arpifs/sub/programs/master.F90')  # within a component only
+    assert path_filter.matches('mpa/dust/x.F90')
+    assert not path_filter.matches('mpa/chem')
+    assert path_filter.matches('xyz') and not path_filter.matches('xz')
+    assert not path_filter.matches('.hidden/programs/a.F90')  # no leading dot, as glob
+
+
+def test_directory_filtering(tmp_path):
+    root = str(tmp_path)
+    filtering = DirectoryFiltering(root, ['arpifs/module', os.path.join(root, 'surfex')])
+    ignore = filtering._filter_function
+    assert ignore(os.path.join(root, 'arpifs'), ['module', 'setup']) == ['module']
+    assert ignore(root, ['arpifs', 'surfex']) == ['surfex']
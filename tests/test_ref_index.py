@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the memoization of refs in ial_build.repositories.GitProxy.ref_index (RefIndex):
+invalidation on changes made by other processes, cost of a check.
+"""
+import os
+
+import pytest
+
+import ial_build.repositories
+from ial_build.repositories import GitProxy
+
+from conftest import git, commit_file
+
+
+def age_refs(repository, mtime):
+    """Set the mtimes of packed-refs and refs/ directories to **mtime** (s)."""
+    gitdir = os.path.join(repository, '.git')
+    if os.path.exists(os.path.join(gitdir, 'packed-refs')):
+        os.utime(os.path.join(gitdir, 'packed-refs'), (mtime, mtime))
+    for dirpath, _, _ in os.walk(os.path.join(gitdir, 'refs')):
+        os.utime(dirpath, (mtime, mtime))
+
+
+@pytest.fixture
+def proxy(repository):
+    commit_file(repository, 'a', 'a\n')
+    git(repository, 'tag', 'v1')
+    git(repository, 'branch', 'feature')
+    git(repository, 'pack-refs', '--all')
+    git(repository, 'tag', 'v2')  # loose
+    age_refs(repository, 1000000000.5)
+    return GitProxy(repository)
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Count the builds of RefIndex."""
+    counter = []
+    build = ial_build.repositories.RefIndex.build.__func__
+    monkeypatch.setattr(ial_build.repositories.RefIndex, 'build',
+                        classmethod(lambda cls, git_proxy: counter.append(1) or build(cls, git_proxy)))
+    return counter
+
+
+def test_memoized_without_walk(proxy, builds, monkeypatch):
+    assert proxy.tags == ['v1', 'v2']
+    walks = []
+    os_walk = os.walk
+    monkeypatch.setattr(os, 'walk', lambda *a, **k: walks.append(1) or os_walk(*a, **k))
+    for _ in range(10):
+        assert proxy.ref_is_tag('v1') and proxy.ref_is_branch('feature')
+    assert (len(builds), len(walks)) == (1, 0)
+
+
+@pytest.mark.parametrize('change', [
+    ['tag', 'v3'],  # new loose ref
+    ['tag', '--delete', 'v1'],  # packed ref deleted
+    ['tag', '--delete', 'v2'],  # loose ref deleted
+    ['tag', 'sub/v3'],  # in a new directory
+    ['branch', '--move', 'feature', 'renamed']])
+def test_invalidated_by_other_processes(proxy, builds, change):
+    before = set(proxy.tags) | set(proxy.ref_index.local_branches)
+    git(proxy.repository, *change)
+    age_refs(proxy.repository, 1000000100.5)  # then not too recent to be trusted
+    after = set(git(proxy.repository, 'for-each-ref', '--format=%(refname:short)').split('\n'))
+    assert set(proxy.tags) | set(proxy.ref_index.local_branches) == after != before
+    assert len(builds) == 2
+
+
+def test_refs_updated_in_same_tick(repository, builds):
+    # coarse timestamps (e.g. a second): a change within the tick of the build leaves the mtimes unchanged
+    commit_file(repository, 'a', 'a\n')
+    git(repository, 'tag', 'v1')
+    proxy = GitProxy(repository)
+    tick = int(os.stat(os.path.join(repository, '.git', 'refs', 'tags')).st_mtime)
+    age_refs(repository, tick)
+    assert proxy.tags == ['v1']
+    git(repository, 'tag', 'v2')
+    age_refs(repository, tick)
+    assert proxy.tags == ['v1', 'v2']
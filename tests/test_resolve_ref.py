@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.repositories.GitProxy.resolve_ref (ResolvedRef), and of IALview relying on it.
+"""
+import os
+
+import pytest
+
+from ial_build.repositories import GitProxy, IALview
+
+from conftest import git, commit_file
+
+
+@pytest.fixture
+def clone(repository, tmp_path):
+    """Clone of a repository with branches main and remote_only, and tags."""
+    c1 = commit_file(repository, 'a', 'a1\n')
+    git(repository, 'tag', 'light')
+    git(repository, 'tag', '-a', '-m', 'annotated', 'annotated')
+    git(repository, 'branch', 'remote_only')
+    commit_file(repository, 'a', 'a2\n')
+    clone = str(tmp_path / 'clone')
+    git(str(tmp_path), 'clone', '--quiet', repository, clone)
+    return {'path':clone, 'c1':c1, 'c2':git(repository, 'rev-parse', 'HEAD')}
+
+
+def test_kinds(clone):
+    proxy = GitProxy(clone['path'])
+    expected = {'main':('branch', 'refs/heads/main', clone['c2']),
+                'origin/remote_only':('detached_branch', 'refs/remotes/origin/remote_only', clone['c1']),
+                'remote_only':('remote_branch', 'refs/remotes/origin/remote_only', clone['c1']),
+                'light':('tag', 'refs/tags/light', clone['c1']),
+                'annotated':('tag', 'refs/tags/annotated', clone['c1']),  # peeled
+                clone['c1']:('commit', None, clone['c1']),
+                clone['c1'][:8]:('commit', None, clone['c1']),
+                'HEAD':('HEAD', 'refs/heads/main', clone['c2']),  # full name of the branch checked out
+                'unknown':(None, None, None)}
+    for ref, (kind, full_name, commit) in expected.items():
+        resolved = proxy.resolve_ref(ref)
+        assert (resolved.kind, resolved.full_name, resolved.commit) == (kind, full_name, commit), ref
+        assert resolved.exists == (kind is not None)
+    assert proxy.resolve_ref('remote_only').is_branch and proxy.resolve_ref('annotated').is_tag
+
+
+def test_head_state(clone):
+    proxy = GitProxy(clone['path'])
+    resolved = proxy.resolve_ref('light')
+    assert (resolved.head_branch, resolved.head_commit, resolved.head) == ('main', clone['c2'], 'main')
+    assert resolved.is_clean
+    git(clone['path'], 'checkout', '--quiet', 'light')
+    resolved = proxy.resolve_ref('main')
+    assert (resolved.head_branch, resolved.head_commit, resolved.head) == (None, clone['c1'], clone['c1'])
+    with open(os.path.join(clone['path'], 'untracked'), 'w') as f:
+        f.write('x\n')
+    assert proxy.resolve_ref().dirty
+
+
+def test_unborn_head(repository):
+    resolved = GitProxy(repository).resolve_ref()
+    assert (resolved.kind, resolved.head_branch, resolved.head_commit) == (None, 'main', None)
+
+
+def test_view_checkouts(clone):
+    path = clone['path']
+    # same commit as HEAD, clean: no checkout
+    git(path, 'checkout', '--quiet', 'light')
+    view = IALview(path, 'annotated', restore_initial_checkout_eventually=False)
+    assert view.resolved.head_commit == clone['c1'] and git(path, 'rev-parse', '--abbrev-ref', 'HEAD') == 'HEAD'
+    # remote branch: checked out as a new tracking branch
+    view = IALview(path, 'remote_only', restore_initial_checkout_eventually=False)
+    assert view.resolved.kind == 'branch' and view.resolved.head_branch == 'remote_only'
+    # currently checked out ref
+    assert IALview(path).ref == 'remote_only'
+    git(path, 'checkout', '--quiet', 'light')
+    assert IALview(path).ref == 'light'
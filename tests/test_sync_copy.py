@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the copy of only changed files (repopulating a preexisting pack):
+ial_build.util.same_file_contents and copy_files(sync=True).
+"""
+import os
+
+import pytest
+
+from ial_build.repositories import GitProxy
+from ial_build.util import copy_files, git_blob_sha, same_file_contents, ZeroCopier
+
+from conftest import git, commit_file
+
+
+def write(path, contents, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return str(tmp_path / 'src'), str(tmp_path / 'dst')
+
+
+def test_git_blob_sha(repository):
+    write(os.path.join(repository, 'f'), 'some contents\n')
+    assert git_blob_sha(os.path.join(repository, 'f')) == git(repository, 'hash-object', 'f')
+
+
+def test_same_size_same_mtime(dirs):
+    src, dst = dirs
+    write(os.path.join(src, 'f'), 'aaaa', mtime=1000)
+    write(os.path.join(dst, 'f'), 'bbbb', mtime=1000)
+    # as left by a previous copy with copystat: contents not read
+    assert same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'f'))
+
+
+def test_same_size_other_mtime(dirs):
+    src, dst = dirs
+    write(os.path.join(src, 'f'), 'aaaa', mtime=1000)
+    write(os.path.join(dst, 'f'), 'aaaa', mtime=2000)
+    write(os.path.join(dst, 'g'), 'bbbb', mtime=2000)
+    assert same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'f'))
+    assert not same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'g'))
+
+
+def test_same_size_other_mtime_with_blob(dirs):
+    src, dst = dirs
+    write(os.path.join(src, 'f'), 'aaaa', mtime=1000)
+    write(os.path.join(dst, 'f'), 'aaaa', mtime=2000)
+    blob = git_blob_sha(os.path.join(src, 'f'))
+    assert same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'f'), blob=blob)
+    # compared to the blob, not to the source contents
+    other_blob = git_blob_sha(os.path.join(dst, 'f')).replace('a', 'b')
+    assert not same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'f'), blob=other_blob)
+
+
+def test_other_size_or_missing(dirs):
+    src, dst = dirs
+    write(os.path.join(src, 'f'), 'aaaa', mtime=1000)
+    write(os.path.join(dst, 'f'), 'aaaaa', mtime=1000)
+    assert not same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'f'))
+    assert not same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'missing'))
+
+
+def test_same_inode(dirs):
+    src, dst = dirs
+    write(os.path.join(src, 'f'), 'aaaa', mtime=1000)
+    os.makedirs(dst)
+    os.link(os.path.join(src, 'f'), os.path.join(dst, 'f'))
+    assert same_file_contents(os.path.join(src, 'f'), os.path.join(dst, 'f'), blob='0' * 40)
+
+
+@pytest.mark.parametrize('copier', [None, 'copy', 'reflink'])
+def test_copy_files_sync(dirs, copier):
+    src, dst = dirs
+    for name in ('unchanged', 'touched', 'modified', 'new'):
+        write(os.path.join(src, 'd', name), name + ' v2', mtime=3000)
+    write(os.path.join(dst, 'd', 'unchanged'), 'unchanged v2', mtime=1000)
+    write(os.path.join(dst, 'd', 'touched'), 'touched v2', mtime=1000)
+    write(os.path.join(dst, 'd', 'modified'), 'modified v1', mtime=1000)
+    files = ['d/unchanged', 'd/touched', 'd/modified', 'd/new']
+    blobs = {'d/touched':git_blob_sha(os.path.join(src, 'd', 'touched'))}
+    copier = ZeroCopier(copier) if copier is not None else None
+    counts = copy_files(files, src, dst, copier=copier, sync=True, blobs=blobs)
+    assert counts == {'copied':2, 'skipped':2}
+    for name in ('unchanged', 'touched', 'modified', 'new'):
+        with open(os.path.join(dst, 'd', name)) as f:
+            assert f.read() == name + ' v2'
+    # skipped files keep their modification time: not to be recompiled
+    assert os.stat(os.path.join(dst, 'd', 'unchanged')).st_mtime == 1000
+    assert os.stat(os.path.join(dst, 'd', 'touched')).st_mtime == 1000
+    assert os.stat(os.path.join(dst, 'd', 'modified')).st_mtime == 3000
+    # and then all skipped
+    assert copy_files(files, src, dst, copier=copier, sync=True) == {'copied':0, 'skipped':4}
+
+
+def test_copy_files_no_sync(dirs):
+    src, dst = dirs
+    write(os.path.join(src, 'f'), 'aaaa', mtime=3000)
+    write(os.path.join(dst, 'f'), 'aaaa', mtime=1000)
+    assert copy_files(['f'], src, dst) == {'copied':1, 'skipped':0}
+    assert os.stat(os.path.join(dst, 'f')).st_mtime == 3000
+
+
+def test_blob_dropped_for_uncommitted_changes(repository, tmp_path):
+    commit_file(repository, 'src/a.F90', 'x = 1\n')
+    commit_file(repository, 'src/b.F90', 'y = 1\n')
+    git(repository, 'tag', 'start')
+    commit_file(repository, 'src/a.F90', 'x = 2\n')
+    commit_file(repository, 'src/b.F90', 'y = 2\n')
+    # pack populated from the committed state
+    pack = str(tmp_path / 'pack')
+    for name in ('a', 'b'):
+        write(os.path.join(pack, 'src', name + '.F90'), '{} = 2\n'.format('x' if name == 'a' else 'y'), mtime=1000)
+    # then uncommitted change, of same size
+    write(os.path.join(repository, 'src', 'a.F90'), 'x = 3\n')
+    touched = GitProxy(repository).touched_files_since('start')
+    assert list(touched.blobs.keys()) == ['src/b.F90']
+    counts = copy_files(touched.to_copy, repository, pack, sync=True, blobs=touched.blobs)
+    assert counts == {'copied':1, 'skipped':1}
+    with open(os.path.join(pack, 'src', 'a.F90')) as f:
+        assert f.read() == 'x = 3\n'
+    assert os.stat(os.path.join(pack, 'src', 'b.F90')).st_mtime == 1000
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.repositories.TagGenealogy, against the former implementation
+of GitProxy.tags_between, that parsed `git log --decorate`.
+"""
+import os
+import subprocess
+
+import pytest
+
+from ial_build.repositories import GitProxy, TagGenealogy
+
+from conftest import git
+
+_date = [1600000000]
+
+
+def commit(repository, name):
+    """Commit a new file **name**, one minute after the previous commit."""
+    _date[0] += 60
+    with open(os.path.join(repository, name), 'w') as f:
+        f.write(name + '\n')
+    git(repository, 'add', name)
+    date = '{} +0000'.format(_date[0])
+    subprocess.check_call(['git', 'commit', '--quiet', '-m', name], cwd=repository,
+                          env=dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date))
+    return git(repository, 'rev-parse', 'HEAD')
+
+
+def legacy_tags_between(repository, start_ref=None, end_ref='HEAD'):
+    """Tags between 2 references, from `git log --decorate` (former GitProxy.tags_between)."""
+    if start_ref is None and end_ref:
+        refs = end_ref
+    else:
+        refs = '{}...{}'.format(start_ref, end_ref)
+    out = git(repository, 'log', refs, '--decorate', '--oneline').split('\n')
+    commits = [GitProxy.re_oneline_decorated_commit.match(line) for line in out]
+    decos = [m.group('deco') for m in commits if m is not None and 'tag:' in m.group('deco')]
+    return [[d.strip()[5:] for d in deco.split(',') if d.strip().startswith('tag:')]
+            for deco in decos][::-1]
+
+
+@pytest.fixture
+def history(repository):
+    """
+    main:    c1(CY38) - c2(CY46) - c3 - c4(CY47, CY47_r1) ------------ m(CY48)
+                          \\                                           /
+    branch:                b1(CY46T1, annotated) - b2(CY46T1_bf.01) -
+    """
+    c1 = commit(repository, 'c1')
+    git(repository, 'tag', 'CY38')
+    commit(repository, 'c2')
+    git(repository, 'tag', 'CY46')
+    git(repository, 'checkout', '--quiet', '-b', 'branch')
+    commit(repository, 'b1')
+    git(repository, 'tag', '-a', '-m', 'annotated', 'CY46T1')
+    commit(repository, 'b2')
+    git(repository, 'tag', 'CY46T1_bf.01')
+    git(repository, 'checkout', '--quiet', 'main')
+    c3 = commit(repository, 'c3')
+    c4 = commit(repository, 'c4')
+    git(repository, 'tag', 'CY47')
+    git(repository, 'tag', 'CY47_r1')
+    _date[0] += 60
+    date = '{} +0000'.format(_date[0])
+    subprocess.check_call(['git', 'merge', '--quiet', '--no-ff', '-m', 'merge', 'branch'], cwd=repository,
+                          env=dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date))
+    git(repository, 'tag', 'CY48')
+    git(repository, 'tag', 'a_tree', 'HEAD^{tree}')  # not a commit: out of genealogy
+    return {'c1':c1, 'c3':c3, 'c4':c4}
+
+
+RANGES = [(None, 'HEAD'), ('CY38', 'HEAD'), ('CY46', 'HEAD'), (None, 'branch'),
+          ('CY46T1', 'main'), ('CY47', 'branch'), (None, 'CY47')]
+
+
+def check_against_legacy(repository):
+    proxy = GitProxy(repository)
+    for start, end in RANGES:
+        assert proxy.tags_between(start, end) == legacy_tags_between(repository, start, end), (start, end)
+
+
+def test_same_as_legacy(repository, history):
+    check_against_legacy(repository)
+    assert GitProxy(repository).tags_history('HEAD') == [
+        ['CY38'], ['CY46'], ['CY46T1'], ['CY46T1_bf.01'], ['CY47_r1', 'CY47'], ['CY48']]
+
+
+def test_persistent_and_up_to_date(repository, history):
+    GitProxy(repository).tags_history()
+    genealogy = TagGenealogy(GitProxy(repository))  # reloaded from disk
+    assert 'CY48' in genealogy.tags and 'a_tree' not in genealogy.tags
+    mtime = os.stat(genealogy.path).st_mtime_ns
+    genealogy.refresh()
+    assert os.stat(genealogy.path).st_mtime_ns == mtime  # not rebuilt
+
+
+def test_tag_added_later_on_older_commit(repository, history):
+    check_against_legacy(repository)
+    git(repository, 'tag', 'CY46_late', history['c3'])
+    git(repository, 'tag', 'CY37', history['c1'])  # same commit as an indexed tag
+    check_against_legacy(repository)
+    assert GitProxy(repository).tags_between('CY46', 'CY47') == [['CY46_late'], ['CY47_r1', 'CY47']]
+
+
+def test_tag_moved(repository, history):
+    check_against_legacy(repository)
+    git(repository, 'tag', '--force', 'CY47', history['c3'])
+    check_against_legacy(repository)
+    assert GitProxy(repository).tags_between('CY46', 'CY47') == [['CY47']]
+
+
+def test_tag_deleted(repository, history):
+    check_against_legacy(repository)
+    git(repository, 'tag', '--delete', 'CY46T1_bf.01')  # its commit is left untagged
+    git(repository, 'tag', '--delete', 'CY47_r1')
+    check_against_legacy(repository)
+    assert GitProxy(repository).tags_history() == [['CY38'], ['CY46'], ['CY46T1'], ['CY47'], ['CY48']]
+
+
+def test_new_commits_tagged(repository, history):
+    check_against_legacy(repository)
+    commit(repository, 'c5')
+    git(repository, 'tag', 'CY49')
+    check_against_legacy(repository)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.repositories.FileChange and TouchedFiles:
+parsing of git outputs, layers of committed and uncommitted changes, blobs.
+"""
+import os
+
+from ial_build.repositories import FileChange, GitProxy, TouchedFiles
+
+from conftest import git, commit_file
+
+SHA_A = 'a' * 40
+SHA_B = 'b' * 40
+NULL = '0' * 40
+
+
+# Parsing ----------------------------------------------------------------------
+
+def test_from_diff_z_name_status():
+    tokens = ['M', 'src/a.F90', 'R087', 'old name.F90', 'new name.F90', 'C100', 'b.F90', 'c.F90',
+              'D', 'line\nbreak.F90', '']
+    changes = list(FileChange.from_diff_z(tokens))
+    assert [(c.status, c.old_path, c.new_path, c.similarity) for c in changes] == [
+        ('M', 'src/a.F90', 'src/a.F90', None),
+        ('R', 'old name.F90', 'new name.F90', 87),
+        ('C', 'b.F90', 'c.F90', 100),
+        ('D', 'line\nbreak.F90', 'line\nbreak.F90', None)]
+    assert all([c.blob is None for c in changes])
+
+
+def test_from_diff_z_raw():
+    tokens = [':100644 100644 {} {} M'.format(SHA_A, SHA_B), 'a.F90',
+              ':100644 100644 {} {} R095'.format(SHA_A, SHA_B), 'b.F90', 'c.F90',
+              ':100644 000000 {} {} D'.format(SHA_A, NULL), 'd.F90']
+    changes = list(FileChange.from_diff_z(tokens))
+    assert [(c.status, c.new_path, c.similarity, c.blob) for c in changes] == [
+        ('M', 'a.F90', None, SHA_B),
+        ('R', 'c.F90', 95, SHA_B),
+        ('D', 'd.F90', None, None)]
+
+
+def test_from_status_z():
+    # renamed/copied: 'XY new\0old\0'
+    tokens = ['R  new.F90', 'old.F90', ' M with space.F90', 'MM both.F90', '?? untracked\n.F90',
+              '!! ignored.o', 'C  copy.F90', 'orig.F90', ' D gone.F90', '']
+    changes = list(FileChange.from_status_z(tokens))
+    assert [(c.status, c.old_path, c.new_path) for c in changes] == [
+        ('R', 'old.F90', 'new.F90'),
+        ('M', 'with space.F90', 'with space.F90'),
+        ('M', 'both.F90', 'both.F90'),
+        ('A', 'untracked\n.F90', 'untracked\n.F90'),
+        ('C', 'orig.F90', 'copy.F90'),
+        ('D', 'gone.F90', 'gone.F90')]
+
+
+# Layers -----------------------------------------------------------------------
+
+def test_mapping_and_lookups():
+    touched = TouchedFiles([FileChange('M', 'b'), FileChange('M', 'a'), FileChange('R', 'c', 'd', 90),
+                            FileChange('D', 'e')])
+    assert dict(touched) == {'M':('a', 'b'), 'R':(('c', 'd'),), 'D':('e',)}
+    assert touched.changes_touching('c') == [('R', ('c', 'd'))]
+    assert touched.touches('d') and not touched.touches('f')
+    assert touched.to_copy == ['a', 'b', 'd']
+    assert touched.to_delete == ['c', 'e']
+
+
+def test_later_layer_supersedes():
+    committed = TouchedFiles([FileChange('A', 'new'), FileChange('D', 'gone'), FileChange('M', 'kept')])
+    uncommitted = TouchedFiles([FileChange('D', 'new'), FileChange('A', 'gone')])
+    touched = committed.merged(uncommitted)
+    assert touched.to_copy == ['gone', 'kept']
+    assert touched.to_delete == ['new']
+    assert touched['A'] == ('gone', 'new')
+    # the other way round
+    touched = uncommitted.merged(committed)
+    assert touched.to_copy == ['kept', 'new']
+    assert touched.to_delete == ['gone']
+
+
+def test_rename_then_recreated():
+    # within a layer, deletions are resolved before copies
+    touched = TouchedFiles([FileChange('R', 'old', 'new', 100), FileChange('A', 'old')])
+    assert touched.to_copy == ['new', 'old']
+    assert touched.to_delete == []
+
+
+def test_blobs_dropped_by_later_layers():
+    committed = TouchedFiles([FileChange('M', 'a', blob=SHA_A), FileChange('M', 'b', blob=SHA_B),
+                              FileChange('R', 'c', 'd', 100, blob=SHA_A), FileChange('A', 'e', blob=SHA_A)])
+    uncommitted = TouchedFiles([FileChange('M', 'a'), FileChange('D', 'e')])
+    assert committed.blobs == {'a':SHA_A, 'b':SHA_B, 'd':SHA_A, 'e':SHA_A}
+    # uncommitted changes: new contents unknown; deleted: not to be copied
+    assert committed.merged(uncommitted).blobs == {'b':SHA_B, 'd':SHA_A}
+    # blobs of a later layer supersede
+    recommitted = TouchedFiles([FileChange('M', 'a', blob=SHA_B)])
+    assert committed.merged(uncommitted).merged(recommitted).blobs == {'a':SHA_B, 'b':SHA_B, 'd':SHA_A}
+
+
+# From a repository ------------------------------------------------------------
+
+def test_touched_files_since(repository):
+    contents = 'program p\n' + '\n'.join(['  x = {}'.format(i) for i in range(50)]) + '\nend\n'
+    commit_file(repository, 'src/to be renamed.F90', contents)
+    commit_file(repository, 'src/modified.F90', 'a\n')
+    commit_file(repository, 'src/deleted.F90', 'a\n')
+    git(repository, 'tag', 'start')
+    # committed changes
+    git(repository, 'mv', 'src/to be renamed.F90', 'src/renamed with space.F90')
+    git(repository, 'commit', '--quiet', '-m', 'rename')
+    commit_file(repository, 'src/modified.F90', 'b\n')
+    commit_file(repository, 'src/new\nline.F90', 'new\n')
+    git(repository, 'rm', '--quiet', 'src/deleted.F90')
+    git(repository, 'commit', '--quiet', '-m', 'delete')
+    # uncommitted changes
+    with open(os.path.join(repository, 'src', 'modified.F90'), 'w') as f:
+        f.write('c\n')
+    git(repository, 'mv', 'src/new\nline.F90', 'src/staged rename.F90')
+    with open(os.path.join(repository, 'src', 'untracked file.F90'), 'w') as f:
+        f.write('a\n')
+
+    proxy = GitProxy(repository)
+    committed = proxy.touched_between('start', 'HEAD')
+    assert committed['R'] == (('src/to be renamed.F90', 'src/renamed with space.F90'),)
+    assert committed['A'] == ('src/new\nline.F90',)
+    assert committed['D'] == ('src/deleted.F90',)
+    uncommitted = proxy.touched_since_last_commit
+    assert uncommitted['R'] == (('src/new\nline.F90', 'src/staged rename.F90'),)
+    assert uncommitted['A'] == ('src/untracked file.F90',)
+    touched = proxy.touched_files_since('start')
+    assert touched.to_copy == ['src/modified.F90', 'src/renamed with space.F90',
+                               'src/staged rename.F90', 'src/untracked file.F90']
+    assert touched.to_delete == ['src/deleted.F90', 'src/new\nline.F90', 'src/to be renamed.F90']
+    # blobs: only of committed contents not touched since
+    assert touched.blobs == {'src/renamed with space.F90':git(repository, 'rev-parse',
+                                                              'HEAD:src/renamed with space.F90')}
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ial_build.repositories.WorktreePool: leases of worktrees, reuse, limits, and views in worktrees.
+"""
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from ial_build.repositories import IALview, WorktreePool
+
+from conftest import git, commit_file
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.fixture
+def repository_with_tags(repository):
+    commit_file(repository, 'src/a.F90', 'v1\n')
+    git(repository, 'tag', 'v1')
+    commit_file(repository, 'src/a.F90', 'v2\n')
+    git(repository, 'tag', 'v2')
+    git(repository, 'checkout', '--quiet', '-b', 'work', 'v1')
+    return repository
+
+
+@pytest.fixture
+def pool(repository_with_tags, tmp_path):
+    return WorktreePool(repository_with_tags, pool_dir=str(tmp_path / 'pool'), verbose=False)
+
+
+def test_lease(pool, repository_with_tags):
+    with pool.lease('v2') as lease:
+        assert lease.commit == git(repository_with_tags, 'rev-parse', 'v2')
+        assert read(os.path.join(lease.path, 'src', 'a.F90')) == 'v2\n'
+        assert git(lease.path, 'rev-parse', 'HEAD') == lease.commit
+    assert not lease.active
+    # working copy of the repository untouched
+    assert git(repository_with_tags, 'rev-parse', '--abbrev-ref', 'HEAD') == 'work'
+    assert read(os.path.join(repository_with_tags, 'src', 'a.F90')) == 'v1\n'
+
+
+def test_concurrent_leases_then_reuse(pool):
+    lease1 = pool.lease('v1')
+    lease2 = pool.lease('v2')
+    assert lease1.path != lease2.path
+    assert read(os.path.join(lease1.path, 'src', 'a.F90')) == 'v1\n'
+    assert read(os.path.join(lease2.path, 'src', 'a.F90')) == 'v2\n'
+    # changes left in a worktree
+    with open(os.path.join(lease1.path, 'src', 'a.F90'), 'w') as f:
+        f.write('modified\n')
+    with open(os.path.join(lease1.path, 'untracked.F90'), 'w') as f:
+        f.write('untracked\n')
+    lease1.release()
+    lease2.release()
+    # idle worktrees reused, reset and cleaned
+    with pool.lease('v2') as lease:
+        assert lease.path in (lease1.path, lease2.path)
+        assert read(os.path.join(lease.path, 'src', 'a.F90')) == 'v2\n'
+        assert not os.path.exists(os.path.join(lease.path, 'untracked.F90'))
+    assert len(pool.worktrees) == 2
+
+
+def test_max_worktrees(pool):
+    pool.max_worktrees = 1
+    lease = pool.lease('v1')
+    leased = []
+    thread = threading.Thread(target=lambda: leased.append(pool.lease('v2', poll_interval=0.05)))
+    thread.start()
+    time.sleep(0.3)
+    assert leased == []  # waiting for the only worktree
+    lease.release()
+    thread.join(timeout=10)
+    assert leased[0].path == lease.path and leased[0].commit != lease.commit
+    leased[0].release()
+
+
+def test_removed_worktree_added_again(pool):
+    with pool.lease('v1') as lease:
+        path = lease.path
+    shutil.rmtree(path)
+    with pool.lease('v2') as lease:
+        assert lease.path == path
+        assert read(os.path.join(path, 'src', 'a.F90')) == 'v2\n'
+
+
+def test_remove(pool, repository_with_tags):
+    busy = pool.lease('v1')
+    with pool.lease('v2'):
+        pass
+    pool.remove()
+    assert pool.worktrees == [busy.path]  # leased one kept
+    busy.release()
+    pool.remove()
+    assert pool.worktrees == []
+    assert len(git(repository_with_tags, 'worktree', 'list').split('\n')) == 1
+
+
+def test_view_in_worktree(pool, repository_with_tags):
+    view = IALview(repository_with_tags, 'v2', worktree_pool=pool)
+    assert view.repository in pool.worktrees
+    assert read(os.path.join(view.repository, 'src', 'a.F90')) == 'v2\n'
+    assert git(repository_with_tags, 'rev-parse', '--abbrev-ref', 'HEAD') == 'work'
+    # worktree busy as long as the view holds it
+    with pool.lease('v1') as lease:
+        assert lease.path != view.repository
+    view.release_worktree()
+    with pool.lease('v1') as lease:
+        assert lease.path == view.repository
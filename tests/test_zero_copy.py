@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the zero-copy population of packs:
+ial_build.util.ZeroCopier, its fallbacks, and the hardlink policy of Pack.copier.
+"""
+import errno
+import fcntl
+import os
+import shutil
+
+import pytest
+
+from ial_build.util import ParallelRsync, ZeroCopier
+
+from conftest import make_pack
+
+
+def write(path, contents, mtime=1000):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+    os.utime(path, (mtime, mtime))
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def unsupported(err):
+    """A replacement of a system call, failing with **err**, that counts its calls."""
+    def failing(*args, **kwargs):
+        failing.calls += 1
+        raise OSError(err, os.strerror(err))
+    failing.calls = 0
+    return failing
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = str(tmp_path / 'src' / 'a.F90')
+    write(path, 'contents\n')
+    os.chmod(path, 0o640)
+    return path
+
+
+# Modes ------------------------------------------------------------------------
+
+def test_methods():
+    assert ZeroCopier('copy').methods == ['copy']
+    assert ZeroCopier('reflink').methods == ['reflink', 'copy_file_range', 'copy']
+    for mode in ('hardlink', 'auto'):
+        assert ZeroCopier(mode).methods == ['hardlink', 'reflink', 'copy_file_range', 'copy']
+        assert ZeroCopier(mode, hardlinks=False).methods == ['reflink', 'copy_file_range', 'copy']
+    with pytest.raises(AssertionError):
+        ZeroCopier('symlink')
+
+
+def test_probe(tmp_path):
+    supported = ZeroCopier('auto').probe(str(tmp_path), str(tmp_path))
+    assert supported['copy'] and supported['hardlink']
+    assert os.listdir(str(tmp_path)) == []  # probe files removed
+
+
+def test_copy(src, tmp_path):
+    copier = ZeroCopier('copy')
+    dst = str(tmp_path / 'dst')
+    assert copier.copy_file(src, dst) == 'copy'
+    assert read(dst) == 'contents\n'
+    assert os.stat(dst).st_ino != os.stat(src).st_ino
+    assert os.stat(dst).st_mtime == 1000 and os.stat(dst).st_mode == os.stat(src).st_mode
+    assert copier.stats['written_bytes'] == copier.stats['logical_bytes'] == len('contents\n')
+
+
+def test_hardlink(src, tmp_path):
+    copier = ZeroCopier('hardlink')
+    dst = str(tmp_path / 'dst')
+    assert copier.copy_file(src, dst) == 'hardlink'
+    assert os.stat(dst).st_ino == os.stat(src).st_ino
+    assert copier.stats == dict(copier.stats, files=1, hardlink=1, logical_bytes=len('contents\n'),
+                                written_bytes=0)
+    assert copier.report() == "1 files, 9 bytes populated, 0 bytes actually written (1 hardlink)"
+
+
+def test_hardlinks_not_allowed(src, tmp_path):
+    copier = ZeroCopier('hardlink', hardlinks=False)
+    dst = str(tmp_path / 'dst')
+    assert copier.copy_file(src, dst) in ('reflink', 'copy_file_range', 'copy')
+    assert os.stat(dst).st_ino != os.stat(src).st_ino
+    assert read(dst) == 'contents\n'
+    assert os.stat(dst).st_mtime == 1000
+
+
+def test_symlink(tmp_path):
+    os.symlink('a.F90', str(tmp_path / 'link'))
+    assert ZeroCopier('hardlink').copy_file(str(tmp_path / 'link'), str(tmp_path / 'copied')) == 'symlink'
+    assert os.readlink(str(tmp_path / 'copied')) == 'a.F90'
+
+
+# Fallbacks --------------------------------------------------------------------
+
+def test_fallbacks(src, tmp_path, monkeypatch):
+    link = unsupported(errno.EXDEV)
+    ioctl = unsupported(errno.EOPNOTSUPP)
+    copy_file_range = unsupported(errno.ENOSYS)
+    monkeypatch.setattr(os, 'link', link)
+    monkeypatch.setattr(fcntl, 'ioctl', ioctl)
+    monkeypatch.setattr(os, 'copy_file_range', copy_file_range, raising=False)
+    copier = ZeroCopier('auto')
+    for name in ('a', 'b', 'c'):
+        dst = str(tmp_path / name)
+        assert copier.copy_file(src, dst) == 'copy'
+        assert read(dst) == 'contents\n'
+        assert os.stat(dst).st_mtime == 1000
+    # each unsupported method is tried once for a pair of devices
+    assert (link.calls, ioctl.calls, copy_file_range.calls) == (1, 1, 1)
+    assert copier.stats['copy'] == 3 and copier.stats['written_bytes'] == 3 * len('contents\n')
+    assert sorted(os.listdir(str(tmp_path))) == ['a', 'b', 'c', 'src']  # no leftover of failed attempts
+
+
+def test_reflink_fallback(src, tmp_path, monkeypatch):
+    monkeypatch.setattr(fcntl, 'ioctl', unsupported(errno.ENOTTY))
+    copier = ZeroCopier('reflink')
+    dst = str(tmp_path / 'dst')
+    assert copier.copy_file(src, dst) == ('copy_file_range' if hasattr(os, 'copy_file_range') else 'copy')
+    assert read(dst) == 'contents\n'
+
+
+def test_other_errors_raised(src, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'link', unsupported(errno.ENOSPC))
+    copier = ZeroCopier('hardlink')
+    with pytest.raises(OSError):
+        copier.copy_file(src, str(tmp_path / 'dst'))
+    assert copier._unsupported == set()
+
+
+# Trees ------------------------------------------------------------------------
+
+@pytest.fixture
+def source(tmp_path):
+    src = str(tmp_path / 'tree')
+    write(os.path.join(src, 'arpifs', 'a.F90'), 'a\n')
+    write(os.path.join(src, 'arpifs', 'sub', 'b.F90'), 'b\n')
+    os.symlink('a.F90', os.path.join(src, 'arpifs', 'link'))
+    write(os.path.join(src, 'loose.txt'), 'loose\n')
+    os.utime(os.path.join(src, 'arpifs'), (2000, 2000))
+    return src
+
+
+def test_copytree(source, tmp_path):
+    copier = ZeroCopier('hardlink')
+    dst = str(tmp_path / 'dst')
+    assert copier.copytree(source, dst, ignore=lambda d, names: ['sub'] if 'sub' in names else []) == (
+        3, len('a\nloose\n') + len('a.F90'))
+    assert sorted(os.listdir(os.path.join(dst, 'arpifs'))) == ['a.F90', 'link']
+    assert os.stat(os.path.join(dst, 'arpifs')).st_mtime == 2000
+    assert copier.stats['hardlink'] == 2
+
+
+@pytest.mark.parametrize('mode', ['copy', 'reflink', 'hardlink'])
+def test_parallel_copy(source, tmp_path, mode):
+    copier = ZeroCopier(mode)
+    dst = str(tmp_path / 'dst')
+    os.makedirs(dst)
+    totals = ParallelRsync(workers=2, copier=copier).copy(source, ['arpifs', 'loose.txt'], dst)
+    assert totals == {'tasks':3, 'files':4, 'bytes':len('a\nb\nloose\n') + len('a.F90')}
+    assert read(os.path.join(dst, 'arpifs', 'sub', 'b.F90')) == 'b\n'
+    assert os.readlink(os.path.join(dst, 'arpifs', 'link')) == 'a.F90'
+    assert os.stat(os.path.join(dst, 'arpifs')).st_mtime == 2000
+    assert copier.stats['files'] == 3  # + 1 symlink
+
+
+# Pack policy ------------------------------------------------------------------
+
+def test_pack_copier(tmp_path):
+    assert make_pack(str(tmp_path / 'copy'), copy_mode='copy').copier(immutable_source=True) is None
+    main = make_pack(str(tmp_path / 'main'), copy_mode='auto')
+    # hardlinks from immutable sources (bundle cache) only: working copies are edited in place
+    assert main.copier(immutable_source=True).methods[0] == 'hardlink'
+    assert main.copier().methods[0] == 'reflink'
+    # never in incremental packs, which files are meant to be edited
+    incremental = make_pack(str(tmp_path / 'incremental'), copy_mode='auto', incremental=True)
+    assert incremental.copier(immutable_source=True).methods[0] == 'reflink'
+
+
+def test_populate_from_repo_in_bulk_not_hardlinked(source, tmp_path):
+    pack = make_pack(str(tmp_path / 'pack'), copy_mode='hardlink')
+    pack._populate_from_repo_in_bulk(source, workers=2)
+    a = os.path.join(pack._local, 'arpifs', 'a.F90')
+    assert read(a) == 'a\n'
+    assert os.stat(a).st_ino != os.stat(os.path.join(source, 'arpifs', 'a.F90')).st_ino
+    shutil.rmtree(source)
+    assert read(a) == 'a\n'